@@ -1,28 +1,134 @@
+import time
+# Taken before wx loads so the start-up time logged covers the imports.
+STARTED = time.perf_counter()
 import wx
 import os
-from datetime import datetime
-import zipfile
-import tarfile
 import json
-import sys
+import re
+from archiver.i18n import catalog
+from archiver.operations import Operation, OperationQueue
+from archiver.metrics import LOG_NAME, PROFILE_DIR, OperationLog, timing_record
+from archiver.listmodel import FileListModel
+
+CONTENT_SEARCH_HITS = 500
+TEST_FAILURES_SHOWN = 20
+METRICS_PHASES_SHOWN = 3
+PHASE_LABELS = {'scan': "обход папок", 'read': "чтение", 'compress': "сжатие", 'wait': "ожидание сжатия", 'write': "запись", 'fsync': "сброс на диск"}
+COLUMN_LABELS = ("Имя файла/папки", "Размер", "Дата изменения")
+ICON_FILES = ('archive.png', 'delete.png')
+PREVIEW_BYTES = 64 * 1024
+ARCHIVE_WILDCARD = "Архивы (*.zip;*.tar;*.tar.gz;*.tgz;*.tar.bz2;*.tbz2;*.tar.xz;*.txz)|*.zip;*.tar;*.tar.gz;*.tgz;*.tar.bz2;*.tbz2;*.tar.xz;*.txz"
+
+class FileListCtrl(wx.ListCtrl):
+    def __init__(self, parent, model):
+        super(FileListCtrl, self).__init__(parent, style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.BORDER_SUNKEN)
+        self.model = model
+
+    def OnGetItemText(self, item, column):
+        return self.model.text(item, column)
+
+    def refresh(self):
+        index = self.GetFirstSelected()
+        while index != -1:
+            self.Select(index, False)
+            index = self.GetNextSelected(index)
+        self.SetItemCount(len(self.model))
+        self.Refresh()
+
+    def get_selected_rows(self):
+        rows = []
+        index = self.GetFirstSelected()
+        while index != -1:
+            rows.append(index)
+            index = self.GetNextSelected(index)
+        return rows
+
+class PreviewDialog(wx.Dialog):
+    # Modeless view of the start of one member, filled in by the frame as
+    # preview operations finish; each "more" doubles what is shown.
+    def __init__(self, frame):
+        super(PreviewDialog, self).__init__(frame, title=frame.get_translation("Просмотр"), size=(760, 560),
+                                            style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+        self.frame = frame
+        self.archive_name = ""
+        self.name = ""
+        self.shown = 0
+        self.text = wx.TextCtrl(self, style=wx.TE_MULTILINE | wx.TE_READONLY | wx.TE_DONTWRAP)
+        self.text.SetFont(wx.Font(10, wx.FONTFAMILY_TELETYPE, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL))
+        self.info = wx.StaticText(self)
+        self.more_button = wx.Button(self, label=frame.get_translation("Показать ещё"))
+        open_button = wx.Button(self, label=frame.get_translation("Открыть в программе"))
+        close_button = wx.Button(self, wx.ID_CLOSE)
+        buttons = wx.BoxSizer(wx.HORIZONTAL)
+        buttons.Add(self.info, 1, wx.ALIGN_CENTER_VERTICAL)
+        buttons.Add(self.more_button, 0, wx.LEFT, 5)
+        buttons.Add(open_button, 0, wx.LEFT, 5)
+        buttons.Add(close_button, 0, wx.LEFT, 5)
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.text, 1, wx.EXPAND | wx.ALL, 10)
+        sizer.Add(buttons, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 10)
+        self.SetSizer(sizer)
+        self.more_button.Bind(wx.EVT_BUTTON, lambda event: frame.preview_member(self.archive_name, self.name, self.shown * 2))
+        open_button.Bind(wx.EVT_BUTTON, lambda event: frame.open_member(self.archive_name, self.name))
+        close_button.Bind(wx.EVT_BUTTON, lambda event: self.Hide())
+        self.Bind(wx.EVT_CLOSE, lambda event: self.Hide())
+
+    def show_preview(self, archive_name, name, text, shown, size):
+        self.archive_name = archive_name
+        self.name = name
+        self.shown = shown
+        self.SetTitle(f"{self.frame.get_translation('Просмотр')}: {name}")
+        self.text.SetValue(text)
+        self.info.SetLabel(f"{self.frame.get_translation('Показано байт:')} {shown} {self.frame.get_translation('из')} {size}")
+        self.more_button.Enable(shown < size)
+        self.Show()
+        self.Raise()
 
 class Archiver(wx.Frame):
     def __init__(self, parent, title):
         self.config_dir = os.path.join(os.getenv('LOCALAPPDATA'), 'Archiver')
         self.config_path = os.path.join(self.config_dir, 'config.json')
         self.load_config()
+        self.translations = catalog(self.language)
+        self.frame_title = title
         super(Archiver, self).__init__(parent, title=self.get_translation(title), size=(900, 700))
         self.current_directory = os.path.dirname(os.path.abspath(__file__))
+        self.icons = {}
         self.SetIcon(self.load_icon('archive.png', wx.ART_FILE_OPEN))
         self.panel = wx.Panel(self)
         self.panel.SetBackgroundColour(wx.Colour(245, 245, 245))
         self.archive_name = ""
         self.current_folder = ""
+        self.archive_index = None
+        self.session = None
+        self.preview_dialog = None
+        self.log = OperationLog(os.path.join(self.config_dir, LOG_NAME))
+        self._engine = None
+        self.operations = OperationQueue(dispatch=wx.CallAfter)
         self.create_menu()
         self.create_toolbar()
         self.create_main_area()
         self.create_status_bar()
+        self.Bind(wx.EVT_CLOSE, self.on_close)
         self.Show()
+        wx.CallAfter(self.on_started)
+
+    @property
+    def engine(self):
+        # The archive code is imported when the first operation needs it
+        # rather than before the window shows: it is most of the import
+        # time left once wx is loaded.
+        if self._engine is None:
+            from archiver.engine import ArchiveEngine
+            self._engine = ArchiveEngine(self.compression, self.compression_policy, None, self.sync_hash, self.include, self.exclude,
+                                         self.symlinks, self.log.path,
+                                         os.path.join(self.config_dir, PROFILE_DIR) if self.profile_operations else None,
+                                         self.tar_index_cache)
+        return self._engine
+
+    def on_started(self):
+        self.load_icons()
+        self.log.write_record(timing_record('startup', time.perf_counter() - STARTED, language=self.language))
 
     def load_config(self):
         if not os.path.exists(self.config_dir):
@@ -32,27 +138,68 @@ class Archiver(wx.Frame):
                 with open(self.config_path, 'r', encoding='utf-8') as f:
                     config = json.load(f)
                     self.language = config.get('language', 'ru')
+                    self.compression = config.get('compression', 'deflated')
+                    self.sync_hash = config.get('sync_hash', False)
+                    self.include = config.get('include', [])
+                    self.exclude = config.get('exclude', [])
+                    self.symlinks = config.get('symlinks', 'follow')
+                    self.compression_policy = config.get('compression_policy', {})
+                    self.verify_before_extract = config.get('verify_before_extract', False)
+                    self.verify_after_commit = config.get('verify_after_commit', False)
+                    self.profile_operations = config.get('profile_operations', False)
+                    self.tar_index_cache = config.get('tar_index_cache', True)
             except:
                 self.language = 'ru'
+                self.compression = 'deflated'
+                self.sync_hash = False
+                self.include = []
+                self.exclude = []
+                self.symlinks = 'follow'
+                self.compression_policy = {}
+                self.verify_before_extract = False
+                self.verify_after_commit = False
+                self.profile_operations = False
+                self.tar_index_cache = True
         else:
             self.language = 'ru'
+            self.compression = 'deflated'
+            self.sync_hash = False
+            self.include = []
+            self.exclude = []
+            self.symlinks = 'follow'
+            self.compression_policy = {}
+            self.verify_before_extract = False
+            self.verify_after_commit = False
+            self.profile_operations = False
+            self.tar_index_cache = True
             self.save_config()
 
     def save_config(self):
-        config = {'language': self.language}
+        config = {'language': self.language, 'compression': self.compression, 'sync_hash': self.sync_hash,
+                  'include': self.include, 'exclude': self.exclude, 'symlinks': self.symlinks,
+                  'compression_policy': self.compression_policy, 'verify_before_extract': self.verify_before_extract,
+                  'verify_after_commit': self.verify_after_commit, 'profile_operations': self.profile_operations,
+                  'tar_index_cache': self.tar_index_cache}
         try:
             with open(self.config_path, 'w', encoding='utf-8') as f:
                 json.dump(config, f, ensure_ascii=False, indent=4)
         except Exception as e:
             self.show_error_dialog(f"{self.get_translation('Ошибка сохранения конфига: ')}{str(e)}")
 
-    def restart_application(self):
-        python = sys.executable
-        os.execl(python, python, *sys.argv)
-
     def load_icon(self, filename, fallback_art):
-        icon_path = os.path.join(self.current_directory, filename)
-        return wx.Icon(icon_path, wx.BITMAP_TYPE_PNG) if os.path.exists(icon_path) else wx.ArtProvider.GetIcon(fallback_art, wx.ART_OTHER)
+        # Stock art stands in until load_icons() has read the PNGs.
+        icon = self.icons.get(filename)
+        return icon if icon is not None else wx.ArtProvider.GetIcon(fallback_art, wx.ART_OTHER)
+
+    def load_icons(self):
+        # Decoding the PNGs waits until the window is up; the first paint
+        # does not need them.
+        for filename in ICON_FILES:
+            icon_path = os.path.join(self.current_directory, filename)
+            if os.path.exists(icon_path):
+                self.icons[filename] = wx.Icon(icon_path, wx.BITMAP_TYPE_PNG)
+        self.SetIcon(self.load_icon('archive.png', wx.ART_FILE_OPEN))
+        self.toolbar.SetToolNormalBitmap(self.delete_tool_id, self.load_icon('delete.png', wx.ART_DELETE))
 
     def create_menu(self):
         self.menubar = wx.MenuBar()
@@ -78,6 +225,14 @@ class Archiver(wx.Frame):
         self.toolsMenu.Append(wx.ID_ANY, self.get_translation("Создать папку"), self.get_translation("Создать папку в архиве"))
         self.toolsMenu.Append(wx.ID_ANY, self.get_translation("Обратная связь"), self.get_translation("Связь с разработчиком"))
         self.toolsMenu.Append(wx.ID_ANY, self.get_translation("Настройки"), self.get_translation("Настройки приложения"))
+        self.toolsMenu.Append(wx.ID_ANY, self.get_translation("Отменить операцию\tEsc"), self.get_translation("Отменить текущую операцию"))
+        self.toolsMenu.Append(wx.ID_ANY, self.get_translation("Метод сжатия"), self.get_translation("Выбрать метод сжатия ZIP"))
+        self.toolsMenu.Append(wx.ID_ANY, self.get_translation("Синхронизировать с папкой"), self.get_translation("Обновить архив из папки и удалить отсутствующие файлы"))
+        self.toolsMenu.AppendCheckItem(wx.ID_ANY, self.get_translation("Пакетный режим"), self.get_translation("Накапливать изменения и записывать их в архив за один проход"))
+        self.toolsMenu.Append(wx.ID_ANY, self.get_translation("Применить изменения\tCtrl+S"), self.get_translation("Записать накопленные изменения в архив"))
+        self.toolsMenu.Append(wx.ID_ANY, self.get_translation("Переименовать\tF2"), self.get_translation("Переименовать выбранный файл или папку"))
+        self.toolsMenu.Append(wx.ID_ANY, self.get_translation("Проверить архив\tCtrl+T"), self.get_translation("Проверить контрольные суммы всех файлов архива"))
+        self.toolsMenu.Append(wx.ID_ANY, self.get_translation("Конвертировать архив"), self.get_translation("Сохранить архив в другом формате"))
         
         self.Bind(wx.EVT_MENU, self.on_open_settings, id=self.toolsMenu.FindItemByPosition(5).GetId())
         self.Bind(wx.EVT_MENU, self.on_add_file_or_folder, id=self.toolsMenu.FindItemByPosition(0).GetId())
@@ -85,11 +240,19 @@ class Archiver(wx.Frame):
         self.Bind(wx.EVT_MENU, self.on_extract_selected, id=self.toolsMenu.FindItemByPosition(2).GetId())
         self.Bind(wx.EVT_MENU, self.on_create_folder, id=self.toolsMenu.FindItemByPosition(3).GetId())
         self.Bind(wx.EVT_MENU, self.on_feedback, id=self.toolsMenu.FindItemByPosition(4).GetId())
+        self.Bind(wx.EVT_MENU, self.on_cancel_operations, id=self.toolsMenu.FindItemByPosition(6).GetId())
+        self.Bind(wx.EVT_MENU, self.on_select_compression, id=self.toolsMenu.FindItemByPosition(7).GetId())
+        self.Bind(wx.EVT_MENU, self.on_sync_folder, id=self.toolsMenu.FindItemByPosition(8).GetId())
+        self.Bind(wx.EVT_MENU, self.on_toggle_batch_mode, id=self.toolsMenu.FindItemByPosition(9).GetId())
+        self.Bind(wx.EVT_MENU, self.on_commit_session, id=self.toolsMenu.FindItemByPosition(10).GetId())
+        self.Bind(wx.EVT_MENU, self.on_rename, id=self.toolsMenu.FindItemByPosition(11).GetId())
+        self.Bind(wx.EVT_MENU, self.on_test_archive, id=self.toolsMenu.FindItemByPosition(12).GetId())
+        self.Bind(wx.EVT_MENU, self.on_convert_archive, id=self.toolsMenu.FindItemByPosition(13).GetId())
         
         self.menubar.Append(self.toolsMenu, self.get_translation("Инструменты"))
 
     def create_toolbar(self):
-        toolbar = self.CreateToolBar()
+        toolbar = self.toolbar = self.CreateToolBar()
         toolbar.SetBackgroundColour(wx.Colour(240, 240, 240))
         toolbar.AddTool(wx.ID_NEW, self.get_translation("Новый"), wx.ArtProvider.GetBitmap(wx.ART_NEW, wx.ART_TOOLBAR))
         toolbar.AddTool(wx.ID_OPEN, self.get_translation("Открыть"), wx.ArtProvider.GetBitmap(wx.ART_FILE_OPEN, wx.ART_TOOLBAR))
@@ -103,6 +266,7 @@ class Archiver(wx.Frame):
         delete_tool = toolbar.AddTool(wx.ID_ANY, self.get_translation("Удалить"), delete_tool_icon, shortHelp=self.get_translation("Удалить выбранный файл"))
         
         toolbar.Realize()
+        self.delete_tool_id = delete_tool.GetId()
         self.Bind(wx.EVT_TOOL, self.on_create_archive, id=wx.ID_NEW)
         self.Bind(wx.EVT_TOOL, self.on_select_archive, id=wx.ID_OPEN)
         self.Bind(wx.EVT_TOOL, self.on_add_file_or_folder, id=wx.ID_ADD)
@@ -112,167 +276,23 @@ class Archiver(wx.Frame):
 
     def create_main_area(self):
         sizer = wx.BoxSizer(wx.VERTICAL)
-        self.list_ctrl = wx.ListCtrl(self.panel, style=wx.LC_REPORT | wx.BORDER_SUNKEN)
-        self.list_ctrl.InsertColumn(0, self.get_translation("Имя файла/папки"), width=400)
-        self.list_ctrl.InsertColumn(1, self.get_translation("Размер"), width=90)
-        self.list_ctrl.InsertColumn(2, self.get_translation("Дата изменения"), width=120)
+        self.file_model = FileListModel()
+        self.list_ctrl = FileListCtrl(self.panel, self.file_model)
+        for column, (label, width) in enumerate(zip(COLUMN_LABELS, (400, 90, 120))):
+            self.list_ctrl.InsertColumn(column, self.get_translation(label), width=width)
         sizer.Add(self.list_ctrl, 1, wx.EXPAND | wx.ALL, 10)
         self.panel.SetSizer(sizer)
         self.list_ctrl.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.on_item_double_click)
+        self.list_ctrl.Bind(wx.EVT_LIST_COL_CLICK, self.on_column_click)
 
     def create_status_bar(self):
-        self.status_bar = self.CreateStatusBar()
+        self.status_bar = self.CreateStatusBar(3)
+        self.status_bar.SetStatusWidths([-1, 380, 320])
         self.status_bar.SetBackgroundColour(wx.Colour(220, 220, 220))
         self.status_bar.SetStatusText(self.get_translation("Готово"))
 
     def get_translation(self, text):
-        translations = {
-            'ru': {
-                "Имя файла/папки": "Имя файла/папки",
-                "Размер": "Размер",
-                "Дата изменения": "Дата изменения",
-                "Готово": "Готово",
-                "Обратная связь": "Обратная связь",
-                "Выбор": "Выбор",
-                "Поиск файла": "Поиск файла",
-                "Удаление": "Удаление",
-                "Файлы загружены из": "Файлы загружены из",
-                "Файлы добавлены в архив.": "Файлы добавлены в архив.",
-                "Файл не найден.": "Файл не найден.",
-                "Настройки": "Настройки",
-                "Новый архив\tCtrl+N": "Новый архив\tCtrl+N",
-                "Открыть архив\tCtrl+O": "Открыть архив\tCtrl+O",
-                "Выход\tCtrl+Q": "Выход\tCtrl+Q",
-                "Файл": "Файл",
-                "Добавить файл или папку\tCtrl+A": "Добавить файл или папку\tCtrl+A",
-                "Извлечь всё\tCtrl+E": "Извлечь всё\tCtrl+E",
-                "Извлечь выбранное\tCtrl+Shift+E": "Извлечь выбранное\tCtrl+Shift+E",
-                "Создать папку": "Создать папку",
-                "Инструменты": "Инструменты",
-                "Новый": "Новый",
-                "Открыть": "Открыть",
-                "Добавить": "Добавить",
-                "Извлечь": "Извлечь",
-                "Поиск": "Поиск",
-                "Удалить": "Удалить",
-                "Поиск файла в архиве": "Поиск файла в архиве",
-                "Удалить выбранный файл": "Удалить выбранный файл",
-                "Ошибка сохранения конфига: ": "Ошибка сохранения конфига: ",
-                "Некорректный zip файл.": "Некорректный zip файл.",
-                "Сначала откройте архив.": "Сначала откройте архив.",
-                "Выберите хотя бы один файл для извлечения.": "Выберите хотя бы один файл для извлечения.",
-                "Выберите файл для удаления.": "Выберите файл для удаления.",
-                "Файлы удалены.": "Файлы удалены.",
-                "Папка и файлы добавлены в архив.": "Папка и файлы добавлены в архив.",
-                "Введите имя файла для поиска:": "Введите имя файла для поиска:",
-                "Создать новый архив": "Создать новый архив",
-                "Открыть существующий архив": "Открыть существующий архив",
-                "Выход из приложения": "Выход из приложения",
-                "Связь с разработчиком": "Связь с разработчиком",
-                "Настройки приложения": "Настройки приложения",
-                "Архиватор": "Архиватор",
-                "Выберите язык:": "Выберите язык:",
-                "Настройки языка": "Настройки языка",
-                "Язык изменен. Программа будет перезапущена.": "Язык изменен. Программа будет перезапущена.",
-                "Информация": "Информация",
-                "Ошибка": "Ошибка",
-                "Добавить файл или папку в архив": "Добавить файл или папку в архив",
-                "Извлечь все файлы из архива": "Извлечь все файлы из архива",
-                "Извлечь выбранный файл": "Извлечь выбранный файл",
-                "Создать папку в архиве": "Создать папку в архиве",
-                "Введите имя папки:": "Введите имя папки:",
-                "Создание папки": "Создание папки",
-                "Папка": "Папка",
-                "создана.": "создана.",
-                "Выберите архив": "Выберите архив",
-                "Открыт архив:": "Открыт архив:",
-                "Создать архив": "Создать архив",
-                "Создание архива:": "Создание архива:",
-                "Архив": "Архив",
-                "создан.": "создан.",
-                "Добавить файл (OK) или папку (Cancel)?": "Добавить файл (OK) или папку (Cancel)?",
-                "Выберите файл для добавления": "Выберите файл для добавления",
-                "Выберите папку для добавления": "Выберите папку для добавления",
-                "Выберите папку для извлечения": "Выберите папку для извлечения",
-                "Все файлы извлечены в": "Все файлы извлечены в",
-                "Файлы извлечены в": "Файлы извлечены в",
-                "Вы уверены, что хотите удалить": "Вы уверены, что хотите удалить",
-                "файл(ов)?": "файл(ов)?"
-            },
-            'en': {
-                "Имя файла/папки": "File/Folder Name",
-                "Размер": "Size",
-                "Дата изменения": "Date Modified",
-                "Готово": "Ready",
-                "Обратная связь": "Feedback",
-                "Выбор": "Selection",
-                "Поиск файла": "Search File",
-                "Удаление": "Deletion",
-                "Файлы загружены из": "Files loaded from",
-                "Файлы добавлены в архив.": "Files added to archive.",
-                "Файл не найден.": "File not found.",
-                "Настройки": "Settings",
-                "Новый архив\tCtrl+N": "New Archive\tCtrl+N",
-                "Открыть архив\tCtrl+O": "Open Archive\tCtrl+O",
-                "Выход\tCtrl+Q": "Exit\tCtrl+Q",
-                "Файл": "File",
-                "Добавить файл или папку\tCtrl+A": "Add File or Folder\tCtrl+A",
-                "Извлечь всё\tCtrl+E": "Extract All\tCtrl+E",
-                "Извлечь выбранное\tCtrl+Shift+E": "Extract Selected\tCtrl+Shift+E",
-                "Создать папку": "Create Folder",
-                "Инструменты": "Tools",
-                "Новый": "New",
-                "Открыть": "Open",
-                "Добавить": "Add",
-                "Извлечь": "Extract",
-                "Поиск": "Search",
-                "Удалить": "Delete",
-                "Поиск файла в архиве": "Search file in archive",
-                "Удалить выбранный файл": "Delete selected file",
-                "Ошибка сохранения конфига: ": "Error saving config: ",
-                "Некорректный zip файл.": "Invalid zip file.",
-                "Сначала откройте архив.": "Open the archive first.",
-                "Выберите хотя бы один файл для извлечения.": "Select at least one file to extract.",
-                "Выберите файл для удаления.": "Select a file to delete.",
-                "Файлы удалены.": "Files deleted.",
-                "Папка и файлы добавлены в архив.": "Folder and files added to archive.",
-                "Введите имя файла для поиска:": "Enter the file name to search:",
-                "Создать новый архив": "Create new archive",
-                "Открыть существующий архив": "Open existing archive",
-                "Выход из приложения": "Exit application",
-                "Связь с разработчиком": "Contact developer",
-                "Настройки приложения": "Application settings",
-                "Архиватор": "Archiver",
-                "Выберите язык:": "Select language:",
-                "Настройки языка": "Language settings",
-                "Язык изменен. Программа будет перезапущена.": "Language changed. Application will restart.",
-                "Информация": "Information",
-                "Ошибка": "Error",
-                "Добавить файл или папку в архив": "Add file or folder to archive",
-                "Извлечь все файлы из архива": "Extract all files from archive",
-                "Извлечь выбранный файл": "Extract selected file",
-                "Создать папку в архиве": "Create folder in archive",
-                "Введите имя папки:": "Enter folder name:",
-                "Создание папки": "Create folder",
-                "Папка": "Folder",
-                "создана.": "created.",
-                "Выберите архив": "Select archive",
-                "Открыт архив:": "Archive opened:",
-                "Создать архив": "Create archive",
-                "Создание архива:": "Creating archive:",
-                "Архив": "Archive",
-                "создан.": "created.",
-                "Добавить файл (OK) или папку (Cancel)?": "Add file (OK) or folder (Cancel)?",
-                "Выберите файл для добавления": "Select file to add",
-                "Выберите папку для добавления": "Select folder to add",
-                "Выберите папку для извлечения": "Select folder for extraction",
-                "Все файлы извлечены в": "All files extracted to",
-                "Файлы извлечены в": "Files extracted to",
-                "Вы уверены, что хотите удалить": "Are you sure you want to delete",
-                "файл(ов)?": "file(s)?"
-            }
-        }
-        return translations[self.language].get(text, text)
+        return self.translations.get(text, text)
 
     def on_open_settings(self, event):
         dialog = wx.SingleChoiceDialog(
@@ -290,24 +310,104 @@ class Archiver(wx.Frame):
             if old_language != self.language:
                 self.save_config()
                 dialog.Destroy()
-                msg = self.get_translation("Язык изменен. Программа будет перезапущена.")
-                wx.MessageBox(msg, self.get_translation("Информация"), wx.OK | wx.ICON_INFORMATION)
-                self.Close()
-                self.restart_application()
+                self.switch_language()
             else:
                 dialog.Destroy()
         else:
             dialog.Destroy()
 
+    def switch_language(self):
+        # Relabels the running window instead of restarting the process:
+        # the menus are rebuilt in place, the toolbar is recreated and the
+        # column headers and title are renamed.
+        started = time.perf_counter()
+        self.translations = catalog(self.language)
+        self.SetTitle(self.get_translation(self.frame_title))
+        self.Freeze()
+        try:
+            while self.menubar.GetMenuCount():
+                self.menubar.Remove(0).Destroy()
+            self.update_file_menu()
+            self.update_tools_menu()
+            self.toolsMenu.FindItemByPosition(9).Check(self.session is not None)
+            toolbar = self.toolbar
+            self.SetToolBar(None)
+            toolbar.Destroy()
+            self.create_toolbar()
+            for column, label in enumerate(COLUMN_LABELS):
+                item = self.list_ctrl.GetColumn(column)
+                item.SetText(self.get_translation(label))
+                self.list_ctrl.SetColumn(column, item)
+            self.status_bar.SetStatusText(self.get_translation("Готово"))
+            if self.preview_dialog is not None:
+                self.preview_dialog.Destroy()
+                self.preview_dialog = None
+        finally:
+            self.Thaw()
+        self.log.write_record(timing_record('switch_language', time.perf_counter() - started, language=self.language))
+
+    def on_select_compression(self, event):
+        methods = ['stored', 'deflated', 'bzip2', 'lzma']
+        dialog = wx.SingleChoiceDialog(
+            self,
+            self.get_translation("Выберите метод сжатия:"),
+            self.get_translation("Метод сжатия"),
+            [self.get_translation("Без сжатия"), "Deflate", "BZIP2", "LZMA"]
+        )
+        dialog.SetSelection(methods.index(self.compression) if self.compression in methods else 1)
+        if dialog.ShowModal() == wx.ID_OK:
+            self.compression = methods[dialog.GetSelection()]
+            self.engine.compression = self.compression
+            self.save_config()
+        dialog.Destroy()
+
     def on_feedback(self, event):
         wx.MessageBox("Для обратной связи свяжитесь со мной в Discord: nonamecgalockoi", self.get_translation("Обратная связь"), wx.OK | wx.ICON_INFORMATION)
 
+    def on_column_click(self, event):
+        self.file_model.toggle_sort(event.GetColumn())
+        if hasattr(self.list_ctrl, 'ShowSortIndicator'):
+            self.list_ctrl.ShowSortIndicator(self.file_model.sort_column, self.file_model.sort_ascending)
+        self.list_ctrl.refresh()
+
     def on_item_double_click(self, event):
-        item = event.GetItem()
-        item_name = item.GetText()
-        if item_name.endswith('/'):
-            self.current_folder = os.path.join(self.current_folder, item_name)
+        row = event.GetIndex()
+        item_name = self.file_model.name(row)
+        if self.file_model.is_parent(row):
+            self.current_folder = self.current_folder.rstrip('/').rpartition('/')[0]
+            if self.current_folder:
+                self.current_folder += '/'
+            self.update_file_list()
+        elif item_name.endswith('/'):
+            self.current_folder = self.row_path(row)
             self.update_file_list()
+        else:
+            self.preview_member(self.archive_name, self.row_path(row), PREVIEW_BYTES)
+
+    def member_crc(self, archive_name, name):
+        # ZIP members are cached by their CRC, which the listed index
+        # already has; tar members go by the archive's size and mtime.
+        if self.archive_index is None or archive_name != self.archive_name:
+            return None
+        node = self.archive_index.find(name)
+        return node.crc if node is not None else None
+
+    def preview_member(self, archive_name, name, limit):
+        self.run_operation("Просмотр", self.engine.preview, archive_name, name, limit, self.member_crc(archive_name, name),
+                           on_done=lambda result: self.on_member_previewed(archive_name, name, result))
+
+    def on_member_previewed(self, archive_name, name, result):
+        if self.preview_dialog is None:
+            self.preview_dialog = PreviewDialog(self)
+        self.preview_dialog.show_preview(archive_name, name, *result)
+
+    def open_member(self, archive_name, name):
+        self.run_operation("Открытие файла", self.engine.open_member, archive_name, name, self.member_crc(archive_name, name),
+                           on_done=self.on_member_extracted)
+
+    def on_member_extracted(self, path):
+        if not wx.LaunchDefaultApplication(path):
+            self.show_error_dialog(f"{self.get_translation('Не удалось открыть файл:')} {path}")
 
     def on_create_folder(self, event):
         if not self.archive_name:
@@ -316,44 +416,42 @@ class Archiver(wx.Frame):
         dialog = wx.TextEntryDialog(self, self.get_translation("Введите имя папки:"), self.get_translation("Создание папки"), "")
         if dialog.ShowModal() == wx.ID_OK:
             folder_name = dialog.GetValue() + '/'
-            if folder_name:
-                try:
-                    if self.archive_name.lower().endswith('.zip'):
-                        with zipfile.ZipFile(self.archive_name, 'a') as archive:
-                            archive.writestr(os.path.join(self.current_folder, folder_name), b'')
-                    elif self.archive_name.lower().endswith('.tar'):
-                        with tarfile.open(self.archive_name, 'a') as archive:
-                            archive.addfile(tarfile.TarInfo(os.path.join(self.current_folder, folder_name)))
-                    self.show_info_dialog(f"{self.get_translation('Папка')} '{folder_name}' {self.get_translation('создана.')}")
-                    self.update_file_list()
-                except Exception as e:
-                    self.show_error_dialog(str(e))
+            if dialog.GetValue() and self.staging():
+                self.session.mkdir(self.current_folder + folder_name)
+                self.show_pending_changes()
+            elif folder_name:
+                self.run_operation("Создание папки", self.engine.create_folder, self.archive_name, self.current_folder + folder_name,
+                                   on_done=lambda result, archive_name=self.archive_name: self.on_folder_created(archive_name, result, folder_name))
+
+    def on_folder_created(self, archive_name, added, folder_name):
+        self.patch_index(archive_name, added=added)
+        self.show_info_dialog(f"{self.get_translation('Папка')} '{folder_name}' {self.get_translation('создана.')}")
+        self.update_file_list()
 
     def on_select_archive(self, event):
-        wildcard = "Архивы (*.zip;*.tar)|*.zip;*.tar"
+        wildcard = ARCHIVE_WILDCARD
         with wx.FileDialog(self, self.get_translation("Выберите архив"), wildcard=wildcard, style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST) as fileDialog:
             if fileDialog.ShowModal() == wx.ID_CANCEL:
                 return
+            self.commit_session()
             self.archive_name = fileDialog.GetPath()
             self.current_folder = ""
+            self.archive_index = None
             self.status_bar.SetStatusText(f"{self.get_translation('Открыт архив:')} {self.archive_name}")
             self.update_file_list()
 
     def on_create_archive(self, event):
-        wildcard = "Архивы (*.zip;*.tar)|*.zip;*.tar"
+        wildcard = ARCHIVE_WILDCARD
         with wx.FileDialog(self, self.get_translation("Создать архив"), wildcard=wildcard, style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT) as fileDialog:
             if fileDialog.ShowModal() == wx.ID_CANCEL:
                 return
+            self.commit_session()
             self.archive_name = fileDialog.GetPath()
             self.current_folder = ""
+            self.archive_index = None
             self.status_bar.SetStatusText(f"{self.get_translation('Создание архива:')} {self.archive_name}")
             try:
-                if self.archive_name.lower().endswith('.zip'):
-                    with zipfile.ZipFile(self.archive_name, 'w') as archive:
-                        pass
-                elif self.archive_name.lower().endswith('.tar'):
-                    with tarfile.open(self.archive_name, 'w') as archive:
-                        pass
+                self.engine.create(self.archive_name)
                 self.show_info_dialog(f"{self.get_translation('Архив')} {self.archive_name} {self.get_translation('создан.')}.")
             except Exception as e:
                 self.show_error_dialog(str(e))
@@ -365,6 +463,153 @@ class Archiver(wx.Frame):
     def show_error_dialog(self, message):
         wx.MessageBox(message, self.get_translation("Ошибка"), wx.OK | wx.ICON_ERROR)
 
+    def run_operation(self, title, func, *args, on_done=None, **kwargs):
+        operation = self.engine.instrument(Operation(self.get_translation(title), func, *args, key=self.archive_name, **kwargs))
+        operation.on_progress = self.on_operation_progress
+        operation.on_done = lambda op: self.on_operation_done(op, on_done)
+        operation.on_error = self.on_operation_error
+        operation.on_cancel = self.on_operation_cancelled
+        self.status_bar.SetStatusText(f"{operation.title}...", 1)
+        return self.operations.submit(operation)
+
+    def format_progress(self, progress):
+        parts = [progress.title]
+        fraction = progress.fraction
+        if fraction is not None:
+            parts.append(f"{fraction * 100:.0f}%")
+        if progress.members_total:
+            parts.append(f"{progress.members_done}/{progress.members_total} {self.get_translation('файлов')}")
+        if progress.bytes_done:
+            parts.append(f"{progress.throughput / 1048576:.1f} {self.get_translation('МБ/с')}")
+        eta = progress.eta
+        if eta is not None:
+            minutes, seconds = divmod(int(eta), 60)
+            parts.append(f"{self.get_translation('осталось')} {minutes:02d}:{seconds:02d}")
+        return " · ".join(parts)
+
+    def format_metrics(self, progress):
+        # Where the time goes, as a share of the elapsed time per phase, so
+        # a slow job shows whether it waits on the disk, the compressor or
+        # the folder scan.
+        parts = []
+        if progress.members_done:
+            parts.append(f"{progress.member_rate:.0f} {self.get_translation('файлов/с')}")
+        if progress.elapsed > 0:
+            phases = sorted(progress.phases.items(), key=lambda item: item[1]['seconds'], reverse=True)
+            for name, phase in phases[:METRICS_PHASES_SHOWN]:
+                parts.append(f"{self.get_translation(PHASE_LABELS.get(name, name))} {phase['seconds'] / progress.elapsed:.0%}")
+        depth = sum(queue['depth'] for queue in progress.queues.values())
+        if depth:
+            parts.append(f"{self.get_translation('в очереди')} {depth}")
+        waiting = len(self.operations.pending()) - 1
+        if waiting > 0:
+            parts.append(f"{self.get_translation('операций ждёт')} {waiting}")
+        return " · ".join(parts)
+
+    def on_operation_progress(self, operation, progress):
+        self.status_bar.SetStatusText(self.format_progress(progress), 1)
+        self.status_bar.SetStatusText(self.format_metrics(progress), 2)
+
+    def on_operation_done(self, operation, on_done):
+        self.status_bar.SetStatusText("" if self.operations.busy else self.get_translation("Готово"), 1)
+        self.status_bar.SetStatusText(self.format_metrics(operation.progress()), 2)
+        if on_done is not None:
+            on_done(operation.result)
+
+    def on_operation_error(self, operation):
+        self.status_bar.SetStatusText("", 1)
+        self.status_bar.SetStatusText(self.format_metrics(operation.progress()), 2)
+        if self.engine.is_corrupt(operation.error):
+            self.show_error_dialog(self.get_translation("Некорректный zip файл."))
+        else:
+            self.show_error_dialog(str(operation.error))
+        if operation.func != self.engine.load_index:
+            self.update_file_list()
+
+    def on_operation_cancelled(self, operation):
+        self.status_bar.SetStatusText(f"{operation.title}: {self.get_translation('Операция отменена.')}", 1)
+        self.status_bar.SetStatusText(self.format_metrics(operation.progress()), 2)
+        if operation.func != self.engine.load_index:
+            self.update_file_list()
+
+    def on_cancel_operations(self, event):
+        self.operations.cancel_all()
+
+    def on_close(self, event):
+        self.operations.shutdown()
+        if self.session is not None and len(self.session) and self.session.archive_name:
+            # Queued edits are written out before the window goes away.
+            try:
+                self.engine.commit(self.engine.instrument(Operation(self.get_translation("Применение изменений"), None)), self.session,
+                                   self.make_policy())
+            except Exception as e:
+                self.show_error_dialog(str(e))
+        if self._engine is not None:
+            self._engine.close()
+        self.Destroy()
+
+    def staging(self):
+        if self.session is None:
+            return False
+        if self.session.archive_name != self.archive_name:
+            self.session = self.engine.session(self.archive_name)
+        return True
+
+    def show_pending_changes(self):
+        self.status_bar.SetStatusText(f"{self.get_translation('Изменений в очереди:')} {len(self.session)}")
+
+    def on_toggle_batch_mode(self, event):
+        if event.IsChecked():
+            self.session = self.engine.session(self.archive_name)
+            self.show_pending_changes()
+        else:
+            self.commit_session()
+            self.session = None
+
+    def on_commit_session(self, event):
+        if self.session is None or not len(self.session):
+            self.show_info_dialog(self.get_translation("Нет изменений для применения."))
+            return
+        self.commit_session()
+
+    def commit_session(self):
+        # The queued session is handed to the operation and a fresh one
+        # takes its place, so edits made while it runs are not lost.
+        if self.session is None or not len(self.session) or not self.session.archive_name:
+            return
+        session = self.session
+        self.session = self.engine.session(self.archive_name)
+        policy = self.make_policy()
+        self.run_operation("Применение изменений", self.engine.commit, session, policy,
+                           on_done=lambda result, archive_name=session.archive_name: self.on_session_committed(archive_name, result, policy.report))
+
+    def on_session_committed(self, archive_name, result, report):
+        self.on_folder_synced(archive_name, result, "Изменения применены.", report)
+        if self.verify_after_commit:
+            self.run_test(archive_name)
+
+    def on_rename(self, event):
+        if not self.archive_name:
+            self.show_error_dialog(self.get_translation("Сначала откройте архив."))
+            return
+        selected_paths = self.get_selected_paths()
+        if len(selected_paths) != 1:
+            self.show_error_dialog(self.get_translation("Выберите один файл или папку для переименования."))
+            return
+        old_path = selected_paths[0]
+        is_folder = old_path.endswith('/')
+        parent, _, old_name = old_path.rstrip('/').rpartition('/')
+        dialog = wx.TextEntryDialog(self, self.get_translation("Введите новое имя:"), self.get_translation("Переименование"), old_name)
+        if dialog.ShowModal() == wx.ID_OK and dialog.GetValue() and dialog.GetValue() != old_name:
+            new_path = (parent + '/' if parent else '') + dialog.GetValue() + ('/' if is_folder else '')
+            if self.staging():
+                self.session.rename(old_path, new_path)
+                self.show_pending_changes()
+            else:
+                self.run_operation("Переименование", self.engine.rename, self.archive_name, old_path, new_path,
+                                   on_done=lambda result, archive_name=self.archive_name: self.on_folder_synced(archive_name, result, "Файл переименован."))
+        dialog.Destroy()
+
     def on_add_file_or_folder(self, event):
         if not self.archive_name:
             self.show_error_dialog(self.get_translation("Сначала откройте архив."))
@@ -374,43 +619,62 @@ class Archiver(wx.Frame):
             with wx.FileDialog(self, self.get_translation("Выберите файл для добавления"), wildcard="*.*", style=wx.FD_OPEN | wx.FD_MULTIPLE) as fileDialog:
                 if fileDialog.ShowModal() == wx.ID_OK:
                     paths = fileDialog.GetPaths()
-                    try:
-                        if self.archive_name.lower().endswith('.zip'):
-                            with zipfile.ZipFile(self.archive_name, 'a') as archive:
-                                for file_path in paths:
-                                    arcname = os.path.join(self.current_folder, os.path.basename(file_path))
-                                    archive.write(file_path, arcname)
-                        elif self.archive_name.lower().endswith('.tar'):
-                            with tarfile.open(self.archive_name, 'a') as archive:
-                                for file_path in paths:
-                                    archive.add(file_path, os.path.join(self.current_folder, os.path.basename(file_path)))
-                        self.show_info_dialog(self.get_translation("Файлы добавлены в архив."))
-                    except Exception as e:
-                        self.show_error_dialog(str(e))
+                    if self.staging():
+                        self.session.add_files(paths, self.current_folder)
+                        self.show_pending_changes()
+                        return
+                    policy = self.make_policy()
+                    self.run_operation("Добавление файлов", self.engine.add_files, self.archive_name, paths, self.current_folder, policy=policy,
+                                       on_done=lambda result, archive_name=self.archive_name: self.on_files_added(archive_name, result, "Файлы добавлены в архив.", policy.report))
         elif options == wx.CANCEL:
             with wx.DirDialog(self, self.get_translation("Выберите папку для добавления"), style=wx.DD_DEFAULT_STYLE) as dirDialog:
                 if dirDialog.ShowModal() == wx.ID_OK:
                     folder_path = dirDialog.GetPath()
-                    try:
-                        if self.archive_name.lower().endswith('.zip'):
-                            with zipfile.ZipFile(self.archive_name, 'a') as archive:
-                                for root, dirs, files in os.walk(folder_path):
-                                    for file in files:
-                                        file_path = os.path.join(root, file)
-                                        arcname = os.path.relpath(file_path, start=folder_path)
-                                        archive.write(file_path, os.path.join(self.current_folder, arcname))
-                        elif self.archive_name.lower().endswith('.tar'):
-                            with tarfile.open(self.archive_name, 'a') as archive:
-                                for root, dirs, files in os.walk(folder_path):
-                                    for file in files:
-                                        file_path = os.path.join(root, file)
-                                        arcname = os.path.relpath(file_path, start=folder_path)
-                                        archive.add(file_path, os.path.join(self.current_folder, arcname))
-                        self.show_info_dialog(self.get_translation("Папка и файлы добавлены в архив."))
-                    except Exception as e:
-                        self.show_error_dialog(str(e))
+                    if self.staging():
+                        self.session.add_folder(folder_path, self.current_folder, self.include, self.exclude, self.symlinks)
+                        self.show_pending_changes()
+                        return
+                    policy = self.make_policy()
+                    self.run_operation("Добавление файлов", self.engine.add_folder, self.archive_name, folder_path, self.current_folder, policy=policy,
+                                       on_done=lambda result, archive_name=self.archive_name: self.on_folder_synced(archive_name, result, "Папка и файлы добавлены в архив.", policy.report))
+
+    def on_files_added(self, archive_name, added, message, report=None):
+        self.patch_index(archive_name, added=added)
+        self.show_info_dialog(self.get_translation(message) + self.format_report(report))
         self.update_file_list()
 
+    def on_sync_folder(self, event):
+        if not self.archive_name:
+            self.show_error_dialog(self.get_translation("Сначала откройте архив."))
+            return
+        with wx.DirDialog(self, self.get_translation("Выберите папку для синхронизации"), style=wx.DD_DEFAULT_STYLE) as dirDialog:
+            if dirDialog.ShowModal() == wx.ID_OK:
+                policy = self.make_policy()
+                self.run_operation("Синхронизация", self.engine.sync, self.archive_name, dirDialog.GetPath(), self.current_folder, policy=policy,
+                                   on_done=lambda result, archive_name=self.archive_name: self.on_folder_synced(archive_name, result, "Архив синхронизирован.", policy.report))
+
+    def on_folder_synced(self, archive_name, result, message, report=None):
+        added, removed = result
+        self.patch_index(archive_name, added=added, removed=removed)
+        added_names = {name for name, size, mtime, is_dir in added}
+        deleted = [name for name in removed if name not in added_names]
+        self.show_info_dialog(f"{self.get_translation(message)} {self.get_translation('Добавлено или обновлено:')} {len(added)}, "
+                              f"{self.get_translation('удалено:')} {len(deleted)}{self.format_report(report)}")
+        self.update_file_list()
+
+    def make_policy(self):
+        try:
+            return self.engine.make_policy()
+        except (ValueError, TypeError, AttributeError) as e:
+            self.show_error_dialog(f"{self.get_translation('Некорректная политика сжатия в конфиге:')} {e}")
+            return self.engine.default_policy()
+
+    def format_report(self, report):
+        if report is None or not report.bytes_in:
+            return ""
+        return (f"\n{self.get_translation('Сжатие:')} {report.ratio * 100:.0f}% · "
+                f"{report.throughput / 1048576:.1f} {self.get_translation('МБ/с')}")
+
     def on_extract_all(self, event):
         if not self.archive_name:
             self.show_error_dialog(self.get_translation("Сначала откройте архив."))
@@ -419,18 +683,59 @@ class Archiver(wx.Frame):
             if dirDialog.ShowModal() == wx.ID_CANCEL:
                 return
             extract_path = dirDialog.GetPath()
-            try:
-                if self.archive_name.lower().endswith('.zip'):
-                    with zipfile.ZipFile(self.archive_name, 'r') as archive:
-                        archive.extractall(extract_path)
-                elif self.archive_name.lower().endswith('.tar'):
-                    with tarfile.open(self.archive_name, 'r') as archive:
-                        archive.extractall(extract_path)
-                self.show_info_dialog(f"{self.get_translation('Все файлы извлечены в')} {extract_path}.")
-            except zipfile.BadZipFile:
-                self.show_error_dialog(self.get_translation("Некорректный zip файл."))
-            except Exception as e:
-                self.show_error_dialog(str(e))
+            if self.verify_before_extract:
+                self.run_test(self.archive_name, then=lambda archive_name=self.archive_name: self.extract_all(archive_name, extract_path))
+            else:
+                self.extract_all(self.archive_name, extract_path)
+
+    def extract_all(self, archive_name, extract_path):
+        self.run_operation("Извлечение файлов", self.engine.extract, archive_name, extract_path,
+                           on_done=lambda result: self.show_info_dialog(f"{self.get_translation('Все файлы извлечены в')} {result}."))
+
+    def on_test_archive(self, event):
+        if not self.archive_name:
+            self.show_error_dialog(self.get_translation("Сначала откройте архив."))
+            return
+        self.run_test(self.archive_name)
+
+    def run_test(self, archive_name, then=None):
+        self.run_operation("Проверка архива", self.engine.test, archive_name,
+                           on_done=lambda report: self.on_archive_tested(report, then))
+
+    def format_test_report(self, report):
+        speed = f"{report.throughput / 1048576:.1f} {self.get_translation('МБ/с')}"
+        if report.ok:
+            return f"{self.get_translation('Ошибок не найдено.')} {self.get_translation('Проверено файлов:')} {report.members} · {speed}"
+        lines = [f"{self.get_translation('Найдены ошибки:')} {len(report.failures)} · {speed}",
+                 f"{self.get_translation('Первая ошибка через')} {report.first_error:.1f} {self.get_translation('с')}"]
+        for name, message in report.failures[:TEST_FAILURES_SHOWN]:
+            lines.append(f"{name or report.archive_name}: {message}")
+        if len(report.failures) > TEST_FAILURES_SHOWN:
+            lines.append("...")
+        return "\n".join(lines)
+
+    def on_archive_tested(self, report, then=None):
+        if then is None:
+            if report.ok:
+                self.show_info_dialog(self.format_test_report(report))
+            else:
+                self.show_error_dialog(self.format_test_report(report))
+            return
+        if report.ok or wx.MessageBox(f"{self.format_test_report(report)}\n\n{self.get_translation('Всё равно продолжить?')}",
+                                      self.get_translation("Проверка архива"), wx.YES_NO | wx.ICON_WARNING) == wx.YES:
+            then()
+
+    def on_convert_archive(self, event):
+        if not self.archive_name:
+            self.show_error_dialog(self.get_translation("Сначала откройте архив."))
+            return
+        with wx.FileDialog(self, self.get_translation("Конвертировать архив"), wildcard=ARCHIVE_WILDCARD, style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT) as fileDialog:
+            if fileDialog.ShowModal() == wx.ID_CANCEL:
+                return
+            target = fileDialog.GetPath()
+        self.commit_session()
+        self.run_operation("Конвертирование", self.engine.convert, self.archive_name, target,
+                           on_done=lambda result: self.show_info_dialog(f"{self.get_translation('Архив сохранён как')} {target}."))
 
     def on_extract_selected(self, event):
         if not self.archive_name:
@@ -444,122 +749,143 @@ class Archiver(wx.Frame):
             if dirDialog.ShowModal() == wx.ID_CANCEL:
                 return
             extract_path = dirDialog.GetPath()
-            try:
-                if self.archive_name.lower().endswith('.zip'):
-                    with zipfile.ZipFile(self.archive_name, 'r') as archive:
-                        for index in range(self.list_ctrl.GetItemCount()):
-                            if self.list_ctrl.IsSelected(index):
-                                file_name = os.path.join(self.current_folder, self.list_ctrl.GetItemText(index))
-                                archive.extract(file_name, extract_path)
-                elif self.archive_name.lower().endswith('.tar'):
-                    with tarfile.open(self.archive_name, 'r') as archive:
-                        for index in range(self.list_ctrl.GetItemCount()):
-                            if self.list_ctrl.IsSelected(index):
-                                file_name = os.path.join(self.current_folder, self.list_ctrl.GetItemText(index))
-                                archive.extract(file_name, extract_path)
-                self.show_info_dialog(f"{self.get_translation('Файлы извлечены в')} {extract_path}.")
-            except zipfile.BadZipFile:
-                self.show_error_dialog(self.get_translation("Некорректный zip файл."))
-            except Exception as e:
-                self.show_error_dialog(str(e))
+            file_names = self.get_selected_paths()
+            self.run_operation("Извлечение файлов", self.engine.extract, self.archive_name, extract_path, file_names,
+                               on_done=lambda result: self.show_info_dialog(f"{self.get_translation('Файлы извлечены в')} {result}."))
 
     def delete_selected_file(self, event):
         selected_items = self.list_ctrl.GetSelectedItemCount()
         if selected_items == 0:
             self.show_error_dialog(self.get_translation("Выберите файл для удаления."))
             return
-        selected_file_names = [os.path.join(self.current_folder, self.list_ctrl.GetItemText(i)) for i in range(self.list_ctrl.GetItemCount()) if self.list_ctrl.IsSelected(i)]
-        if wx.MessageBox(f"{self.get_translation('Вы уверены, что хотите удалить')} {len(selected_file_names)} {self.get_translation('файл(ов)?')}", self.get_translation("Удаление"), wx.YES_NO | wx.ICON_WARNING) == wx.NO:
+        selected_paths = self.get_selected_paths()
+        if wx.MessageBox(f"{self.get_translation('Вы уверены, что хотите удалить')} {len(selected_paths)} {self.get_translation('файл(ов)?')}", self.get_translation("Удаление"), wx.YES_NO | wx.ICON_WARNING) == wx.NO:
             return
-        temp_archive = self.archive_name + ".tmp"
-        try:
-            if self.archive_name.lower().endswith('.zip'):
-                with zipfile.ZipFile(self.archive_name, 'r') as archive:
-                    with zipfile.ZipFile(temp_archive, 'w') as temp_zip:
-                        for file_info in archive.infolist():
-                            if file_info.filename not in selected_file_names:
-                                temp_zip.writestr(file_info.filename, archive.read(file_info.filename))
-            elif self.archive_name.lower().endswith('.tar'):
-                with tarfile.open(self.archive_name, 'r') as archive:
-                    with tarfile.open(temp_archive, 'w') as temp_tar:
-                        for file_info in archive.getmembers():
-                            if file_info.name not in selected_file_names:
-                                temp_tar.addfile(file_info, archive.extractfile(file_info))
-            os.remove(self.archive_name)
-            os.rename(temp_archive, self.archive_name)
-            self.show_info_dialog(self.get_translation("Файлы удалены."))
-            self.update_file_list()
-        except Exception as e:
-            self.show_error_dialog(str(e))
+        if self.staging():
+            self.session.delete(selected_paths)
+            self.show_pending_changes()
+            return
+        self.run_operation("Удаление файлов", self.engine.delete, self.archive_name, selected_paths,
+                           on_done=lambda result, archive_name=self.archive_name: self.on_files_deleted(archive_name, selected_paths))
+
+    def on_files_deleted(self, archive_name, removed):
+        self.patch_index(archive_name, removed=removed)
+        self.show_info_dialog(self.get_translation("Файлы удалены."))
+        self.update_file_list()
+
+    def get_selected_paths(self):
+        return [self.row_path(row) for row in self.list_ctrl.get_selected_rows() if not self.file_model.is_parent(row)]
+
+    def patch_index(self, archive_name, added=(), removed=()):
+        if self.archive_index is None or archive_name != self.archive_name:
+            return
+        self.engine.patch_index(self.archive_index, archive_name, added, removed)
 
     def on_exit(self, event):
         self.Close(True)
 
     def update_file_list(self):
-        self.list_ctrl.DeleteAllItems()
-        try:
-            if self.archive_name.lower().endswith('.zip'):
-                with zipfile.ZipFile(self.archive_name, 'r') as archive:
-                    for file_info in archive.infolist():
-                        if file_info.filename.startswith(self.current_folder):
-                            display_name = file_info.filename[len(self.current_folder):] if self.current_folder else file_info.filename
-                            index = self.list_ctrl.InsertItem(self.list_ctrl.GetItemCount(), display_name)
-                            if not display_name.endswith('/'):
-                                self.list_ctrl.SetItem(index, 1, str(file_info.file_size))
-                                date_time = datetime(*file_info.date_time)
-                                self.list_ctrl.SetItem(index, 2, date_time.strftime("%Y-%m-%d %H:%M:%S"))
-            elif self.archive_name.lower().endswith('.tar'):
-                with tarfile.open(self.archive_name, 'r') as archive:
-                    for file_info in archive.getmembers():
-                        if file_info.name.startswith(self.current_folder):
-                            display_name = file_info.name[len(self.current_folder):] if self.current_folder else file_info.name
-                            index = self.list_ctrl.InsertItem(self.list_ctrl.GetItemCount(), display_name)
-                            if not display_name.endswith('/'):
-                                self.list_ctrl.SetItem(index, 1, str(file_info.size))
-                                date_time = datetime.fromtimestamp(file_info.mtime)
-                                self.list_ctrl.SetItem(index, 2, date_time.strftime("%Y-%m-%d %H:%M:%S"))
-            self.status_bar.SetStatusText(f"{self.get_translation('Файлы загружены из')} {self.archive_name}.")
-        except Exception as e:
-            self.show_error_dialog(str(e))
+        if not self.archive_name:
+            self.file_model.clear()
+            self.list_ctrl.refresh()
+            return
+        if self.archive_index is not None and self.archive_index.is_current(self.archive_name):
+            self.show_file_list()
+            return
+        self.run_operation("Загрузка списка файлов", self.engine.load_index, self.archive_name,
+                           on_done=lambda result, archive_name=self.archive_name: self.on_index_built(archive_name, result))
 
-    def on_search_file(self, event):
-        dialog = wx.TextEntryDialog(self, self.get_translation("Введите имя файла для поиска:"), self.get_translation("Поиск файла"), "")
-        if dialog.ShowModal() == wx.ID_OK:
-            search_text = dialog.GetValue().lower()
-            self.search_in_archive(search_text)
-        dialog.Destroy()
+    def on_index_built(self, archive_name, archive_index, then=None):
+        if archive_name != self.archive_name:
+            return
+        self.archive_index = archive_index
+        if self.archive_index.find(self.current_folder) is None:
+            self.current_folder = ""
+        self.show_file_list()
+        if then is not None:
+            then()
+
+    def show_file_list(self):
+        self.file_model.set_nodes(self.archive_index.listdir(self.current_folder), with_parent=bool(self.current_folder))
+        self.list_ctrl.refresh()
+        self.status_bar.SetStatusText(f"{self.get_translation('Файлы загружены из')} {self.archive_name}.")
 
-    def search_in_archive(self, search_text):
+    def on_search_file(self, event):
         if not self.archive_name:
             self.show_error_dialog(self.get_translation("Сначала откройте архив."))
             return
-        self.list_ctrl.DeleteAllItems()
+        modes = ['substring', 'glob', 'regex', 'content']
+        choice = wx.SingleChoiceDialog(self, self.get_translation("Выберите тип поиска:"), self.get_translation("Поиск файла"),
+                                       [self.get_translation("Имя содержит текст"), self.get_translation("Имя по шаблону (*, ?)"),
+                                        self.get_translation("Имя по регулярному выражению"), self.get_translation("Содержимое файлов")])
+        if choice.ShowModal() != wx.ID_OK:
+            choice.Destroy()
+            return
+        mode = modes[choice.GetSelection()]
+        choice.Destroy()
+        prompt = "Введите текст для поиска:" if mode == 'content' else "Введите имя файла для поиска:"
+        dialog = wx.TextEntryDialog(self, self.get_translation(prompt), self.get_translation("Поиск файла"), "")
+        if dialog.ShowModal() == wx.ID_OK and dialog.GetValue():
+            if mode == 'content':
+                self.search_content(dialog.GetValue())
+            else:
+                self.search_in_archive(dialog.GetValue(), mode)
+        dialog.Destroy()
+
+    def result_name(self, path):
+        # Search results can live outside the current folder; those are
+        # shown with their full path from the archive root.
+        if path.startswith(self.current_folder):
+            return path[len(self.current_folder):]
+        return '/' + path
+
+    def row_path(self, row):
+        name = self.file_model.name(row)
+        return name[1:] if name.startswith('/') else self.current_folder + name
+
+    def search_in_archive(self, search_text, mode='substring'):
+        if self.archive_index is None or not self.archive_index.is_current(self.archive_name):
+            self.run_operation("Загрузка списка файлов", self.engine.load_index, self.archive_name,
+                               on_done=lambda result, archive_name=self.archive_name: self.on_index_built(
+                                   archive_name, result, then=lambda: self.search_in_archive(search_text, mode)))
+            return
         try:
-            found = False
-            if self.archive_name.lower().endswith('.zip'):
-                with zipfile.ZipFile(self.archive_name, 'r') as archive:
-                    for file_info in archive.infolist():
-                        if search_text in file_info.filename.lower():
-                            found = True
-                            display_name = file_info.filename[len(self.current_folder):] if self.current_folder else file_info.filename
-                            index = self.list_ctrl.InsertItem(self.list_ctrl.GetItemCount(), display_name)
-                            self.list_ctrl.SetItem(index, 1, str(file_info.file_size))
-                            date_time = datetime(*file_info.date_time)
-                            self.list_ctrl.SetItem(index, 2, date_time.strftime("%Y-%m-%d %H:%M:%S"))
-            elif self.archive_name.lower().endswith('.tar'):
-                with tarfile.open(self.archive_name, 'r') as archive:
-                    for file_info in archive.getmembers():
-                        if search_text in file_info.name.lower():
-                            found = True
-                            display_name = file_info.name[len(self.current_folder):] if self.current_folder else file_info.name
-                            index = self.list_ctrl.InsertItem(self.list_ctrl.GetItemCount(), display_name)
-                            self.list_ctrl.SetItem(index, 1, str(file_info.size))
-                            date_time = datetime.fromtimestamp(file_info.mtime)
-                            self.list_ctrl.SetItem(index, 2, date_time.strftime("%Y-%m-%d %H:%M:%S"))
-            if not found:
-                self.show_info_dialog(self.get_translation("Файл не найден."))
-        except Exception as e:
-            self.show_error_dialog(str(e))
+            nodes = self.archive_index.name_index().search(search_text, mode)
+        except re.error as e:
+            self.show_error_dialog(f"{self.get_translation('Некорректное регулярное выражение:')} {e}")
+            return
+        entries = [(self.result_name(node.path() + ('/' if node.is_dir else '')), node.size, node.mtime, node.is_dir) for node in nodes]
+        self.file_model.set_entries(entries)
+        self.list_ctrl.refresh()
+        self.status_bar.SetStatusText(f"{self.get_translation('Найдено:')} {len(entries)}")
+        if not entries:
+            self.show_info_dialog(self.get_translation("Файл не найден."))
+
+    def search_content(self, text):
+        self.content_hits = {}
+        self.file_model.set_entries([])
+        self.list_ctrl.refresh()
+        self.run_operation("Поиск в содержимом", self.engine.grep, self.archive_name, text, max_hits=CONTENT_SEARCH_HITS,
+                           selection=[self.current_folder] if self.current_folder else None,
+                           on_match=lambda hit: wx.CallAfter(self.on_content_match, hit),
+                           on_done=self.on_content_search_done)
+
+    def on_content_match(self, hit):
+        name, line_number, text = hit
+        self.content_hits[name] = self.content_hits.get(name, 0) + 1
+        entries = []
+        for member_name in self.content_hits:
+            node = self.archive_index.find(member_name) if self.archive_index is not None else None
+            entries.append((self.result_name(member_name), node.size if node is not None else 0, node.mtime if node is not None else None, False))
+        self.file_model.set_entries(entries)
+        self.list_ctrl.refresh()
+        self.status_bar.SetStatusText(f"{name}:{line_number}: {text}")
+
+    def on_content_search_done(self, hits):
+        if not hits:
+            self.show_info_dialog(self.get_translation("Файл не найден."))
+            return
+        self.show_info_dialog(f"{self.get_translation('Найдено совпадений:')} {len(hits)}")
 
 if __name__ == "__main__":
     app = wx.App(False)
@@ -0,0 +1,331 @@
+import bisect
+import bz2
+import collections
+import gzip
+import lzma
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import Metrics
+
+BLOCK_SIZE = 4 * 1024 * 1024
+RAW_CHUNK = 256 * 1024
+OUTPUT_CHUNK = 1024 * 1024
+SKIP_CHUNK = 1024 * 1024
+
+TAR_SUFFIXES = {
+    '.tar.gz': 'gz',
+    '.tgz': 'gz',
+    '.tar.bz2': 'bz2',
+    '.tbz2': 'bz2',
+    '.tar.xz': 'xz',
+    '.txz': 'xz',
+}
+
+
+def tar_codec(archive_name):
+    lower = archive_name.lower()
+    for suffix, codec in TAR_SUFFIXES.items():
+        if lower.endswith(suffix):
+            return codec
+    return None
+
+
+def compress_block(data, codec, level=None):
+    if codec == 'gz':
+        return gzip.compress(data, 6 if level is None else level, mtime=0)
+    if codec == 'bz2':
+        return bz2.compress(data, 9 if level is None else level)
+    if codec == 'xz':
+        return lzma.compress(data, lzma.FORMAT_XZ, preset=6 if level is None else level)
+    raise ValueError(f'unknown codec {codec!r}')
+
+
+# A bare gzip member header: deflate, no flags, mtime 0, OS unknown.
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+GZIP_TRAILER = struct.Struct('<LL')
+GZIP_FLAGS = {'text': 1, 'hcrc': 2, 'extra': 4, 'name': 8, 'comment': 16}
+
+
+def gzip_member(pieces, crc, size):
+    # Wraps an existing raw deflate stream (a ZIP member's data, say) as a
+    # gzip member without touching the compressed bytes.
+    yield GZIP_HEADER
+    yield from pieces
+    yield GZIP_TRAILER.pack(crc, size & 0xFFFFFFFF)
+
+
+def gzip_payload(fp, start, end):
+    # Locates the raw deflate data of the gzip member at [start, end) and
+    # returns (payload_start, payload_end, crc, size mod 2**32).
+    fp.seek(start)
+    header = fp.read(10)
+    if len(header) < 10 or header[:3] != b'\x1f\x8b\x08':
+        raise ValueError('not a gzip member')
+    flags = header[3]
+    position = start + 10
+    if flags & GZIP_FLAGS['extra']:
+        fp.seek(position)
+        position += 2 + struct.unpack('<H', fp.read(2))[0]
+    for flag in ('name', 'comment'):
+        if flags & GZIP_FLAGS[flag]:
+            fp.seek(position)
+            while True:
+                chunk = fp.read(256)
+                if not chunk:
+                    raise ValueError('truncated gzip header')
+                terminator = chunk.find(b'\0')
+                if terminator != -1:
+                    position += terminator + 1
+                    break
+                position += len(chunk)
+    if flags & GZIP_FLAGS['hcrc']:
+        position += 2
+    fp.seek(end - GZIP_TRAILER.size)
+    crc, size = GZIP_TRAILER.unpack(fp.read(GZIP_TRAILER.size))
+    return position, end - GZIP_TRAILER.size, crc, size
+
+
+class _Stream:
+    def __init__(self, codec):
+        self.codec = codec
+        if codec == 'gz':
+            self._decompressor = zlib.decompressobj(31)
+        elif codec == 'bz2':
+            self._decompressor = bz2.BZ2Decompressor()
+        elif codec == 'xz':
+            self._decompressor = lzma.LZMADecompressor(lzma.FORMAT_XZ)
+        else:
+            raise ValueError(f'unknown codec {codec!r}')
+
+    @property
+    def eof(self):
+        return self._decompressor.eof
+
+    @property
+    def needs_input(self):
+        if self.codec == 'gz':
+            return True
+        return self._decompressor.needs_input
+
+    def decompress(self, raw, max_length):
+        decompressor = self._decompressor
+        data = decompressor.decompress(raw, max_length)
+        if decompressor.eof:
+            return data, decompressor.unused_data
+        if self.codec == 'gz':
+            return data, decompressor.unconsumed_tail
+        return data, b''
+
+
+class BlockCompressor:
+    def __init__(self, fileobj, codec, level=None, workers=None, block_size=BLOCK_SIZE, position=0, policy=None, metrics=None):
+        self.fileobj = fileobj
+        self.codec = codec
+        self.level = level
+        self.policy = policy
+        self.metrics = metrics or Metrics()
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count() or 1
+        self.position = position
+        self.checkpoints = []
+        self.closed = False
+        self._offset = fileobj.tell()
+        self._buffer = bytearray()
+        self._block_start = position
+        self._window = collections.deque()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='archiver-block')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self._buffer += data
+        self.position += len(data)
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def mark(self):
+        # Close the current block so the next byte starts a new,
+        # independently decompressible one.
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+
+    def _submit(self, data):
+        level = self.level
+        if self.policy is not None:
+            level = self.policy.block_level(data, self.codec, level)
+        future = self._executor.submit(self.metrics.timed('compress', compress_block), data, self.codec, level)
+        self._window.append((future, self._block_start, len(data), level == self.level))
+        self._block_start += len(data)
+        self.metrics.set_depth('blocks', len(self._window))
+        while len(self._window) > 2 * self.workers:
+            self._write_next()
+
+    def write_block(self, pieces, size):
+        # Appends an already compressed stream that decodes to `size` bytes
+        # as a block of its own, after everything buffered so far.
+        self.flush()
+        self.checkpoints.append((self._offset, self._block_start))
+        written = 0
+        for piece in pieces:
+            with self.metrics.phase('write', len(piece)):
+                self.fileobj.write(piece)
+            written += len(piece)
+        self._offset += written
+        self.position += size
+        self._block_start += size
+        if self.policy is not None:
+            self.policy.report.record(size, written)
+
+    def _write_next(self):
+        future, start, size, compressed = self._window.popleft()
+        with self.metrics.phase('wait'):
+            data = future.result()
+        if self.policy is not None:
+            self.policy.report.record(size, len(data), compressed)
+        self.checkpoints.append((self._offset, start))
+        with self.metrics.phase('write', len(data)):
+            self.fileobj.write(data)
+        self._offset += len(data)
+
+    def flush(self):
+        self.mark()
+        while self._window:
+            self._write_next()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.closed = True
+            self._executor.shutdown(wait=True)
+
+    def abort(self):
+        if self.closed:
+            return
+        for future, start, size, compressed in self._window:
+            future.cancel()
+        self._window.clear()
+        self.closed = True
+        self._executor.shutdown(wait=True)
+
+
+class BlockReader:
+    def __init__(self, path, codec, checkpoints=None):
+        self.codec = codec
+        self._fp = open(path, 'rb')
+        self._offsets = [0]
+        self._positions = [0]
+        for offset, position in sorted(checkpoints or ()):
+            self._add_checkpoint(offset, position)
+        self._restart(0, 0)
+
+    @property
+    def checkpoints(self):
+        return list(zip(self._offsets, self._positions))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._fp.close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def _add_checkpoint(self, offset, position):
+        index = bisect.bisect_left(self._positions, position)
+        if index < len(self._positions) and self._positions[index] == position:
+            return
+        self._positions.insert(index, position)
+        self._offsets.insert(index, offset)
+
+    def _restart(self, offset, position):
+        self._fp.seek(offset)
+        self._raw = b''
+        self._raw_end = offset
+        self._stream = _Stream(self.codec)
+        self._buffer = b''
+        self._position = position
+        self._finished = False
+
+    def _read_raw(self):
+        data = self._fp.read(RAW_CHUNK)
+        self._raw_end += len(data)
+        self._raw += data
+        return bool(data)
+
+    def _produce(self):
+        while not self._finished:
+            if self._stream.eof:
+                if not self._raw and not self._read_raw():
+                    self._finished = True
+                    break
+                if not self._raw.strip(b'\0') and not self._read_raw():
+                    self._finished = True
+                    break
+                # Every concatenated gzip member / bz2 or xz stream starts a
+                # point we can later resume decompression from.
+                self._add_checkpoint(self._raw_end - len(self._raw), self._position + len(self._buffer))
+                self._stream = _Stream(self.codec)
+            if not self._raw and self._stream.needs_input and not self._read_raw():
+                raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+            data, self._raw = self._stream.decompress(self._raw, OUTPUT_CHUNK)
+            if data:
+                return data
+        return b''
+
+    def read(self, size=-1):
+        chunks = []
+        remaining = size
+        while remaining != 0:
+            if not self._buffer:
+                self._buffer = self._produce()
+                if not self._buffer:
+                    break
+            take = len(self._buffer) if remaining < 0 else min(remaining, len(self._buffer))
+            chunks.append(self._buffer[:take])
+            self._buffer = self._buffer[take:]
+            self._position += take
+            if remaining > 0:
+                remaining -= take
+        return b''.join(chunks)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            raise OSError('seeking from the end is not supported on compressed archives')
+        index = bisect.bisect_right(self._positions, offset) - 1
+        if offset < self._position or self._positions[index] > self._position:
+            self._restart(self._offsets[index], self._positions[index])
+        while self._position < offset:
+            if not self.read(min(SKIP_CHUNK, offset - self._position)):
+                break
+        return self._position
@@ -0,0 +1,341 @@
+import argparse
+import json
+import os
+import re
+import shlex
+import sys
+import tarfile
+import time
+import zipfile
+
+from .engine import ArchiveEngine
+from .operations import Operation, OperationCancelled, OperationQueue
+from .preview import PREVIEW_SIZE
+from .scanner import SYMLINK_POLICIES
+from .stream import FORMATS
+from .zipwriter import METHODS
+
+PROG = 'python -m archiver'
+PROGRESS_WIDTH = 79
+ERRORS = (OSError, ValueError, zipfile.BadZipFile, zipfile.LargeZipFile, tarfile.TarError, re.error, EOFError, NotImplementedError)
+
+
+class _Output:
+    def append(self, line):
+        print(line)
+
+
+def _time(mtime):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime)) if mtime is not None else ' ' * 16
+
+
+def _list(op, engine, args, out):
+    archive_index = engine.load_index(op, args.archive)
+    folder = archive_index.find(args.folder)
+    if folder is None or not folder.is_dir:
+        raise ValueError(f'no folder {args.folder!r} in {args.archive}')
+    nodes = archive_index.walk(folder) if args.recursive else archive_index.listdir(args.folder)
+    for node in sorted((node for node in nodes if node.parent is not None), key=lambda node: node.path()):
+        name = node.path() + ('/' if node.is_dir else '')
+        out.append(f'{node.size:>14} {_time(node.mtime)} {name}' if args.long else name)
+    return 0
+
+
+def _summary(out, result):
+    added, removed = result
+    added_names = {name for name, size, mtime, is_dir in added}
+    out.append(f'added or updated: {len(added)}, removed: {len([name for name in removed if name not in added_names])}')
+
+
+def _create(op, engine, args, out):
+    engine.create(args.archive)
+    return 0
+
+
+def _folder(name):
+    # A folder of the archive ends in exactly one slash; none is the root.
+    name = name.replace(os.sep, '/').strip('/')
+    return name + '/' if name else ''
+
+
+def _add(op, engine, args, out):
+    if not os.path.exists(args.archive):
+        engine.create(args.archive)
+    _summary(out, engine.add(op, args.archive, args.paths, _folder(args.folder)))
+    return 0
+
+
+def _sync(op, engine, args, out):
+    if not os.path.exists(args.archive):
+        engine.create(args.archive)
+    _summary(out, engine.sync(op, args.archive, args.source, _folder(args.folder)))
+    return 0
+
+
+def _mkdir(op, engine, args, out):
+    engine.create_folder(op, args.archive, args.name.rstrip('/') + '/')
+    return 0
+
+
+def _extract(op, engine, args, out):
+    engine.extract(op, args.archive, args.destination, _member_names(op, engine, args.archive, args.names) if args.names else None)
+    return 0
+
+
+def _member_names(op, engine, archive_name, names):
+    # Folders are selected by their name with a trailing slash.
+    archive_index = engine.load_index(op, archive_name)
+    selection = []
+    for name in names:
+        node = archive_index.find(name)
+        if node is None:
+            raise ValueError(f'{name!r} is not in {archive_name}')
+        selection.append(name.rstrip('/') + '/' if node.is_dir else name)
+    return selection
+
+
+def _delete(op, engine, args, out):
+    if args.in_place:
+        print(f'{PROG}: warning: compacting {args.archive} in place; if this is interrupted the archive is lost', file=sys.stderr)
+    engine.delete(op, args.archive, _member_names(op, engine, args.archive, args.names), args.in_place)
+    return 0
+
+
+def _rename(op, engine, args, out):
+    old_name = _member_names(op, engine, args.archive, [args.old_name])[0]
+    engine.rename(op, args.archive, old_name, args.new_name.rstrip('/') + '/' if old_name.endswith('/') else args.new_name)
+    return 0
+
+
+def _search(op, engine, args, out):
+    nodes = engine.search(op, args.archive, args.query, args.mode)
+    for node in nodes:
+        out.append(node.path() + ('/' if node.is_dir else ''))
+    return 0 if nodes else 1
+
+
+def _grep(op, engine, args, out):
+    hits = engine.grep(op, args.archive, args.pattern, args.regex, not args.case_sensitive, args.max_count,
+                       [args.folder] if args.folder else None)
+    for name, line_number, text in hits:
+        out.append(f'{name}:{line_number}:{text}')
+    return 0 if hits else 1
+
+
+def _show(op, engine, args, out):
+    text, shown, size = engine.preview(op, args.archive, args.name, args.bytes)
+    out.append(text)
+    if shown < size:
+        out.append(f'[{shown} of {size} bytes shown]')
+    return 0
+
+
+def _test(op, engine, args, out):
+    status = 0
+    for archive_name in args.archives:
+        op.reset_progress()
+        report = engine.test(op, archive_name)
+        speed = f'{report.throughput / 1048576:.1f} MB/s'
+        if report.ok:
+            out.append(f'{archive_name}: OK, {report.members} files, {speed}')
+            continue
+        status = 1
+        out.append(f'{archive_name}: {len(report.failures)} errors, {speed}')
+        for name, message in report.failures:
+            out.append(f'  {name or archive_name}: {message}')
+    return status
+
+
+def _convert(op, engine, args, out):
+    engine.convert(op, args.source, args.target)
+    return 0
+
+
+def _stream(op, engine, args, out):
+    output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    try:
+        engine.stream(op, output, args.format, args.paths)
+        output.flush()
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog=PROG, description='Work with ZIP and TAR archives without the GUI.')
+    parser.add_argument('-j', '--jobs', type=int, help='worker threads per operation (default: one per CPU)')
+    parser.add_argument('-m', '--method', choices=sorted(METHODS), help='ZIP compression method (default: deflated)')
+    parser.add_argument('--config', help='JSON settings file in the format the GUI saves')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not show progress')
+    parser.add_argument('--log', metavar='FILE', help='append a JSON line of timings for every operation to FILE')
+    parser.add_argument('--profile', metavar='DIR', help='save a cProfile dump of every operation in DIR')
+    commands = parser.add_subparsers(dest='command', required=True, metavar='COMMAND')
+
+    def command(name, func, help_text):
+        subparser = commands.add_parser(name, help=help_text, description=help_text)
+        subparser.set_defaults(func=func)
+        return subparser
+
+    subparser = command('list', _list, 'list the members of an archive')
+    subparser.add_argument('archive')
+    subparser.add_argument('folder', nargs='?', default='')
+    subparser.add_argument('-l', '--long', action='store_true', help='show sizes and dates')
+    subparser.add_argument('-r', '--recursive', action='store_true')
+    subparser = command('create', _create, 'create an empty archive')
+    subparser.add_argument('archive')
+    subparser = command('add', _add, 'add files and folders, creating the archive if needed')
+    subparser.add_argument('archive')
+    subparser.add_argument('paths', nargs='+', metavar='PATH')
+    subparser.add_argument('--folder', default='', help='folder inside the archive to add to')
+    subparser = command('sync', _sync, 'make a folder of the archive match a folder on disk')
+    subparser.add_argument('archive')
+    subparser.add_argument('source')
+    subparser.add_argument('--folder', default='', help='folder inside the archive to sync')
+    subparser = command('mkdir', _mkdir, 'create a folder in an archive')
+    subparser.add_argument('archive')
+    subparser.add_argument('name')
+    subparser = command('extract', _extract, 'extract all or the named members')
+    subparser.add_argument('archive')
+    subparser.add_argument('destination')
+    subparser.add_argument('names', nargs='*', metavar='NAME')
+    subparser = command('delete', _delete, 'delete members and folders')
+    subparser.add_argument('archive')
+    subparser.add_argument('names', nargs='+', metavar='NAME')
+    subparser.add_argument('--in-place', action='store_true', help='compact a ZIP archive without a temporary copy; not crash-safe')
+    subparser = command('rename', _rename, 'rename a member or folder')
+    subparser.add_argument('archive')
+    subparser.add_argument('old_name')
+    subparser.add_argument('new_name')
+    subparser = command('search', _search, 'find members by name')
+    subparser.add_argument('archive')
+    subparser.add_argument('query')
+    subparser.add_argument('--glob', dest='mode', action='store_const', const='glob', default='substring')
+    subparser.add_argument('--regex', dest='mode', action='store_const', const='regex')
+    subparser = command('grep', _grep, 'search the contents of members')
+    subparser.add_argument('archive')
+    subparser.add_argument('pattern')
+    subparser.add_argument('-E', '--regex', action='store_true')
+    subparser.add_argument('-s', '--case-sensitive', action='store_true')
+    subparser.add_argument('--max-count', type=int, default=100, help='stop after this many matches, 0 for no limit')
+    subparser.add_argument('--folder', default='', help='only search members under this folder')
+    subparser = command('show', _show, 'print the start of a member as text, or as a hex dump if it is binary')
+    subparser.add_argument('archive')
+    subparser.add_argument('name')
+    subparser.add_argument('-n', '--bytes', type=int, default=PREVIEW_SIZE, help=f'bytes to show (default: {PREVIEW_SIZE})')
+    subparser = command('test', _test, 'check every member of one or more archives')
+    subparser.add_argument('archives', nargs='+', metavar='ARCHIVE')
+    subparser = command('convert', _convert, 'convert between ZIP and TAR formats')
+    subparser.add_argument('source')
+    subparser.add_argument('target')
+    subparser = command('stream', _stream, 'write a new archive to stdout or another non-seekable output')
+    subparser.add_argument('paths', nargs='+', metavar='PATH')
+    subparser.add_argument('-f', '--format', default='zip', choices=sorted(FORMATS))
+    subparser.add_argument('-o', '--output', default='-', help="output file, '-' (the default) for stdout")
+    subparser = command('batch', None, 'run commands from a file, one per line')
+    subparser.add_argument('script', help="command file, '-' for stdin")
+    subparser.add_argument('-P', '--parallel', type=int, default=1, help='commands to run at once; commands on the same archive '
+                                                                          'still run one after another')
+    subparser.add_argument('-k', '--keep-going', action='store_true', help='do not stop at the first failed command')
+    return parser
+
+
+def make_engine(args):
+    config = {}
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    engine = ArchiveEngine(config.get('compression', 'deflated'), config.get('compression_policy'), args.jobs,
+                           config.get('sync_hash', False), config.get('include'), config.get('exclude'),
+                           config.get('symlinks', 'follow'), args.log, args.profile, config.get('tar_index_cache', True))
+    if args.method:
+        engine.compression = args.method
+    if engine.symlinks not in SYMLINK_POLICIES:
+        raise ValueError(f'unknown symlink policy {engine.symlinks!r}')
+    return engine
+
+
+def _show_progress(operation, progress):
+    parts = [progress.title]
+    if progress.fraction is not None:
+        parts.append(f'{progress.fraction * 100:.0f}%')
+    if progress.members_total:
+        parts.append(f'{progress.members_done}/{progress.members_total} files')
+    if progress.bytes_done:
+        parts.append(f'{progress.throughput / 1048576:.1f} MB/s')
+    sys.stderr.write('\r' + ' · '.join(parts)[:PROGRESS_WIDTH].ljust(PROGRESS_WIDTH))
+    sys.stderr.flush()
+
+
+def _operation_key(args):
+    archive_name = getattr(args, 'archive', None) or getattr(args, 'source', None) or getattr(args, 'archives', [None])[0]
+    return os.path.abspath(archive_name) if archive_name else None
+
+
+def run_batch(engine, parser, args):
+    script = sys.stdin if args.script == '-' else open(args.script, 'r', encoding='utf-8')
+    try:
+        lines = script.read().splitlines()
+    finally:
+        if script is not sys.stdin:
+            script.close()
+    commands = []
+    for number, line in enumerate(lines, 1):
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        try:
+            command = parser.parse_args(shlex.split(line))
+        except SystemExit:
+            print(f'{PROG}: line {number}: invalid command', file=sys.stderr)
+            return 2
+        if command.func is None:
+            print(f'{PROG}: line {number}: batches cannot be nested', file=sys.stderr)
+            return 2
+        commands.append((number, command))
+    # Commands on different archives run side by side; the queue keeps the
+    # ones sharing an archive in script order.
+    queue = OperationQueue(workers=max(1, args.parallel))
+    operations = []
+    for number, command in commands:
+        out = []
+        operation = engine.instrument(Operation(command.command, command.func, engine, command, out, key=_operation_key(command)))
+        if not args.keep_going:
+            operation.on_error = lambda operation: queue.cancel_all()
+        operations.append((number, operation, out))
+        queue.submit(operation)
+    queue.shutdown(wait=True, cancel=False)
+    status = 0
+    for number, operation, out in operations:
+        for line in out:
+            print(line)
+        if operation.state == 'failed':
+            print(f'{PROG}: line {number}: {operation.error}', file=sys.stderr)
+            status = 1
+        elif operation.state == 'cancelled':
+            status = 1
+        elif operation.result:
+            status = max(status, operation.result)
+    return status
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        engine = make_engine(args)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    try:
+        if args.func is None:
+            return run_batch(engine, parser, args)
+        progress = None if args.quiet or args.command == 'stream' or not sys.stderr.isatty() else _show_progress
+        try:
+            return engine.run(args.func, engine, args, _Output(), title=args.command, on_progress=progress)
+        finally:
+            if progress is not None:
+                sys.stderr.write('\r' + ' ' * PROGRESS_WIDTH + '\r')
+    except ERRORS as e:
+        print(f'{PROG}: {e}', file=sys.stderr)
+        return 1
+    except (KeyboardInterrupt, OperationCancelled):
+        return 130
@@ -0,0 +1,331 @@
+import contextlib
+import functools
+import os
+import stat
+import tarfile
+import zipfile
+import zlib
+
+from .blockcodec import BlockCompressor, gzip_member, gzip_payload
+from .jobs import archive_kind
+from .metrics import TimedFile
+from .rewrite import write_tar_end
+from .tarindex import TarIndex, index_path
+from .zipformat import FLAG_LZMA_EOS, ZipEntry
+from .zipreader import FLAG_ENCRYPTED, ZipDirectory
+from .zipwriter import ParallelZipWriter
+
+COPY_CHUNK = 1024 * 1024
+UNIX_SYSTEM = 3
+# Codecs whose streams a ZIP member of the given method can carry as is.
+RAW_CODECS = {zipfile.ZIP_DEFLATED: 'gz', zipfile.ZIP_BZIP2: 'bz2'}
+
+
+class _Member:
+    # What a source archive knows about one member, in a form either writer
+    # can consume. zip_raw and block are set when the compressed bytes can
+    # be reused: (method, crc, csize, flags, pieces) for a ZIP member, and
+    # (start, end) of a compressed-tar block holding exactly its data.
+    __slots__ = ('name', 'kind', 'mtime', 'mode', 'size', 'linkname', 'open', 'zip_raw', 'block', 'tarinfo')
+
+    def __init__(self, name, kind, mtime, mode, size=0, linkname=''):
+        self.name = name
+        self.kind = kind
+        self.mtime = mtime
+        self.mode = mode
+        self.size = size
+        self.linkname = linkname
+        self.open = None
+        self.zip_raw = None
+        self.block = None
+        self.tarinfo = None
+
+
+def _view_pieces(view):
+    try:
+        for offset in range(0, len(view), COPY_CHUNK):
+            yield view[offset:offset + COPY_CHUNK]
+    finally:
+        view.release()
+
+
+def _zip_pieces(directory, index):
+    return _view_pieces(directory.raw_data(index))
+
+
+def _file_pieces(fp, start, end):
+    fp.seek(start)
+    while start < end:
+        data = fp.read(min(COPY_CHUNK, end - start))
+        if not data:
+            raise EOFError('compressed data is truncated')
+        start += len(data)
+        yield data
+
+
+def _zip_members(directory):
+    for index in range(len(directory)):
+        name = directory.name(index)
+        mode = directory.external_attrs[index] >> 16 if directory.create_systems[index] == UNIX_SYSTEM else 0
+        if directory.is_dir(index):
+            kind = 'dir'
+        elif stat.S_ISLNK(mode):
+            kind = 'symlink'
+        else:
+            kind = 'file'
+        member = _Member(name, kind, directory.mtime(index) or 0, stat.S_IMODE(mode) or (0o755 if kind == 'dir' else 0o644),
+                         directory.usizes[index] if kind == 'file' else 0)
+        if kind == 'symlink':
+            member.linkname = os.fsdecode(bytes(directory.read(index)))
+        elif kind == 'file':
+            member.open = functools.partial(directory.open, index)
+            if not directory.flags[index] & FLAG_ENCRYPTED:
+                member.zip_raw = (directory.methods[index], directory.crcs[index], directory.csizes[index], directory.flags[index],
+                                  functools.partial(_zip_pieces, directory, index))
+        yield member
+
+
+def _tar_blocks(tar_index):
+    # Maps the uncompressed start of every block to its compressed span and
+    # uncompressed end.
+    checkpoints = sorted(tar_index.checkpoints, key=lambda checkpoint: checkpoint[1])
+    return {start: (offset, following[0], following[1])
+            for (offset, start), following in zip(checkpoints, checkpoints[1:])}
+
+
+def _open_tar_member(tar_index, archive, position):
+    return archive.extractfile(tar_index.read_tarinfo(archive, position))
+
+
+def _tar_members(tar_index, archive, raw_file):
+    blocks = _tar_blocks(tar_index) if tar_index.codec is not None else {}
+    for position in range(len(tar_index)):
+        tarinfo = tar_index.read_tarinfo(archive, position)
+        if tarinfo.isreg():
+            kind = 'file'
+        elif tarinfo.isdir():
+            kind = 'dir'
+        elif tarinfo.issym():
+            kind = 'symlink'
+        elif tarinfo.islnk():
+            kind = 'hardlink'
+        else:
+            kind = 'special'
+        member = _Member(tarinfo.name + ('/' if kind == 'dir' else ''), kind, tarinfo.mtime, tarinfo.mode, tarinfo.size, tarinfo.linkname)
+        member.tarinfo = tarinfo
+        if kind == 'file':
+            member.open = functools.partial(archive.extractfile, tarinfo)
+            block = blocks.get(tarinfo.offset_data)
+            if tarinfo.size and block is not None and block[2] == tarinfo.offset_data + tarinfo.size:
+                member.block = block[:2]
+        elif kind == 'hardlink':
+            # tarfile would look the target up by reading every header; the
+            # index already knows where it is.
+            linked = tar_index.find(tarinfo.linkname)
+            if linked is not None and tar_index.is_regular(linked):
+                member.size = tar_index.sizes[linked]
+                member.open = functools.partial(_open_tar_member, tar_index, archive, linked)
+        yield member
+
+
+@contextlib.contextmanager
+def _source(archive_name, persist=True):
+    kind = archive_kind(archive_name)
+    if kind == 'zip':
+        with ZipDirectory(archive_name) as directory:
+            sizes = [directory.usizes[index] for index in range(len(directory)) if not directory.is_dir(index)]
+            yield sum(sizes), len(directory), None, _zip_members(directory)
+    elif kind == 'tar':
+        tar_index = TarIndex.load(archive_name, persist=persist)
+        sizes = [tar_index.sizes[position] for position in range(len(tar_index)) if tar_index.is_regular(position)]
+        with tar_index.open() as archive, open(archive_name, 'rb') as raw_file:
+            yield sum(sizes), len(tar_index), (tar_index.codec, raw_file), _tar_members(tar_index, archive, raw_file)
+    else:
+        raise ValueError(f'unsupported archive type: {archive_name}')
+
+
+def convert_archive(op, source, target, method=zipfile.ZIP_DEFLATED, level=None):
+    # Members go straight from the source reader into the target writer a
+    # chunk at a time; nothing is extracted to disk on the way.
+    if os.path.abspath(source) == os.path.abspath(target):
+        raise ValueError('source and target are the same archive')
+    kind = archive_kind(target)
+    if kind is None:
+        raise ValueError(f'unsupported archive type: {target}')
+    temp_archive = target + '.tmp'
+    tar_index = None
+    try:
+        with _source(source, op.tar_index_cache) as (bytes_total, members_total, raw_source, members):
+            op.set_total(bytes_total=bytes_total, members_total=members_total)
+            if kind == 'zip':
+                count = _write_zip(op, members, raw_source, temp_archive, method, level)
+            else:
+                tar_index = TarIndex(target, op.tar_index_cache)
+                count = _write_tar(op, members, raw_source, temp_archive, tar_index, level)
+    except BaseException:
+        _remove_quietly(temp_archive)
+        raise
+    os.replace(temp_archive, target)
+    if tar_index is not None:
+        tar_index.refresh()
+        tar_index.save(index_path(target))
+    return count
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _crc_of(op, member):
+    crc = 0
+    with member.open() as src:
+        while True:
+            op.check()
+            data = src.read(COPY_CHUNK)
+            if not data:
+                return crc
+            crc = zlib.crc32(data, crc)
+
+
+def _raw_zip_entry(op, member, method, raw_source):
+    # Returns (entry, pieces) when the member's compressed bytes are valid
+    # as ZIP data of the target method, else None.
+    entry = ZipEntry(member.name, method, member.mtime, ((stat.S_IFREG | member.mode) & 0xFFFF) << 16)
+    entry.usize = member.size
+    if member.zip_raw is not None:
+        raw_method, crc, csize, flags, pieces = member.zip_raw
+        if raw_method != method or method == zipfile.ZIP_STORED:
+            return None
+        entry.flags = (entry.flags & ~FLAG_LZMA_EOS) | (flags & FLAG_LZMA_EOS)
+        entry.crc = crc
+        entry.csize = csize
+        return entry, pieces()
+    if member.block is None or raw_source is None or RAW_CODECS.get(method) != raw_source[0]:
+        return None
+    codec, raw_file = raw_source
+    start, end = member.block
+    if codec == 'gz':
+        start, end, crc, size = gzip_payload(raw_file, start, end)
+        if size != member.size & 0xFFFFFFFF:
+            return None
+        entry.crc = crc
+    else:
+        # A bzip2 stream carries no CRC-32; reading the member once is
+        # still far cheaper than compressing it again.
+        entry.crc = _crc_of(op, member)
+    entry.csize = end - start
+    return entry, _file_pieces(raw_file, start, end)
+
+
+def _write_zip(op, members, raw_source, path, method, level):
+    count = 0
+    with ParallelZipWriter(path, 'w', method=method, level=level, op=op) as writer:
+        for member in members:
+            op.check()
+            count += 1
+            if member.kind == 'dir':
+                writer.add_directory(member.name, member.mtime, stat.S_IFDIR | member.mode)
+            elif member.kind == 'symlink':
+                writer.add_symlink(member.name, member.linkname, member.mtime, stat.S_IFLNK | member.mode)
+            elif member.open is None:
+                # Devices, FIFOs and dangling hard links have no ZIP form.
+                count -= 1
+                op.advance(members=1)
+            else:
+                raw = _raw_zip_entry(op, member, method, raw_source)
+                if raw is not None:
+                    writer.add_compressed(*raw)
+                elif member.size <= writer.large_file:
+                    with member.open() as src:
+                        writer.add_bytes(member.name, src.read(), member.mtime, mode=member.mode)
+                else:
+                    with member.open() as src:
+                        writer.add_stream(member.name, src, member.size, member.mtime, mode=member.mode)
+    return count
+
+
+def _tarinfo(member):
+    if member.tarinfo is not None:
+        return member.tarinfo
+    tarinfo = tarfile.TarInfo(member.name.rstrip('/'))
+    tarinfo.mtime = int(member.mtime)
+    tarinfo.mode = member.mode
+    if member.kind == 'dir':
+        tarinfo.type = tarfile.DIRTYPE
+    elif member.kind == 'symlink':
+        tarinfo.type = tarfile.SYMTYPE
+        tarinfo.linkname = member.linkname
+    else:
+        tarinfo.size = member.size
+    return tarinfo
+
+
+def _raw_tar_block(member, codec, raw_source):
+    if codec is None:
+        return None
+    if member.zip_raw is not None:
+        method, crc, csize, flags, pieces = member.zip_raw
+        if RAW_CODECS.get(method) != codec or not member.size:
+            return None
+        return gzip_member(pieces(), crc, member.size) if codec == 'gz' else pieces()
+    if member.block is not None and raw_source is not None and raw_source[0] == codec:
+        return _file_pieces(raw_source[1], *member.block)
+    return None
+
+
+def _copy_member(op, member, dst):
+    remaining = member.size
+    with member.open() as src:
+        while remaining:
+            op.check()
+            data = src.read(min(COPY_CHUNK, remaining))
+            if not data:
+                raise EOFError(f'{member.name!r} is truncated')
+            dst.write(data)
+            remaining -= len(data)
+            op.advance(len(data), check=False)
+
+
+def _write_tar(op, members, raw_source, path, tar_index, level):
+    codec = tar_index.codec
+    count = 0
+    with open(path, 'wb') as fp:
+        compressor = BlockCompressor(fp, codec, level, metrics=op.metrics) if codec is not None else None
+        dst = compressor or TimedFile(fp, op.metrics)
+        try:
+            for member in members:
+                op.check()
+                tarinfo = _tarinfo(member)
+                header_offset = dst.tell()
+                dst.write(tarinfo.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'))
+                data_offset = dst.tell()
+                if tarinfo.isreg() and tarinfo.size:
+                    pieces = _raw_tar_block(member, codec, raw_source)
+                    if pieces is not None:
+                        compressor.write_block(pieces, tarinfo.size)
+                        op.advance(tarinfo.size)
+                    else:
+                        _copy_member(op, member, dst)
+                    remainder = tarinfo.size % tarfile.BLOCKSIZE
+                    if remainder:
+                        dst.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+                tar_index.add(tarinfo.name, header_offset, data_offset, tarinfo.size, tarinfo.mtime, tarinfo.type)
+                count += 1
+                op.advance(members=1)
+            tar_index.end = dst.tell()
+            if compressor is not None:
+                # The end marker gets a block of its own so later appends can
+                # replace it.
+                compressor.mark()
+            write_tar_end(dst, tar_index.end)
+        except BaseException:
+            if compressor is not None:
+                compressor.abort()
+            raise
+        if compressor is not None:
+            compressor.close()
+            tar_index.checkpoints = compressor.checkpoints
+    return count
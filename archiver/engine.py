@@ -0,0 +1,167 @@
+import os
+import zipfile
+
+from . import jobs
+from .convert import convert_archive
+from .index import build_index
+from .metrics import OperationLog, Profiler
+from .operations import Operation, OperationCancelled
+from .policy import CompressionPolicy
+from .preview import PREVIEW_SIZE, PreviewCache, preview_text
+from .search import grep_archive
+from .session import Session
+from .stream import stream_records, write_stream
+from .sync import sync_folder
+from .verify import test_archive
+from .zipwriter import METHODS
+
+
+def patch_index(archive_index, archive_name, added=(), removed=()):
+    # Folds the (name, size, mtime, is_dir) records an edit reports back into
+    # an already built index instead of reading the archive again.
+    for path in removed:
+        archive_index.remove(path)
+    for name, size, mtime, is_dir in added:
+        archive_index.add(name, size, mtime, is_dir)
+    archive_index.refresh_signature(archive_name)
+
+
+class ArchiveEngine:
+    # Everything the application does to an archive, with no UI attached.
+    # Methods that do real work take the Operation they run under first:
+    # the wx frame queues them on its OperationQueue, the command line runs
+    # them inline through run().
+    def __init__(self, compression='deflated', compression_policy=None, workers=None, sync_hash=False, include=None, exclude=None,
+                 symlinks='follow', log_path=None, profile_dir=None, tar_index_cache=True):
+        self.compression = compression
+        self.compression_policy = compression_policy or {}
+        self.workers = workers
+        self.sync_hash = sync_hash
+        self.include = include or []
+        self.exclude = exclude or []
+        self.symlinks = symlinks
+        self.log = OperationLog(log_path) if log_path else None
+        self.profiler = Profiler(profile_dir) if profile_dir else None
+        self.previews = PreviewCache()
+        self.tar_index_cache = tar_index_cache
+
+    @property
+    def method(self):
+        return METHODS.get(self.compression, zipfile.ZIP_DEFLATED)
+
+    def make_policy(self):
+        return CompressionPolicy.from_config(self.compression_policy, self.method)
+
+    def default_policy(self):
+        return CompressionPolicy(self.method)
+
+    def session(self, archive_name):
+        return Session(archive_name)
+
+    def patch_index(self, archive_index, archive_name, added=(), removed=()):
+        patch_index(archive_index, archive_name, added, removed)
+
+    def is_corrupt(self, error):
+        return isinstance(error, zipfile.BadZipFile)
+
+    def instrument(self, operation):
+        # Every operation keeps phase timers; the log line and the profile
+        # are only written when the engine was given somewhere to put them.
+        if self.log is not None:
+            operation.on_finish = self.log.write
+        operation.profiler = self.profiler
+        operation.tar_index_cache = self.tar_index_cache
+        return operation
+
+    def run(self, func, *args, title='', on_progress=None, **kwargs):
+        operation = self.instrument(Operation(title, func, *args, **kwargs))
+        operation.on_progress = on_progress
+        result = operation.run()
+        if operation.state == 'failed':
+            raise operation.error
+        if operation.state == 'cancelled':
+            raise OperationCancelled(title)
+        return result
+
+    def create(self, archive_name):
+        jobs.create_archive(archive_name)
+
+    def load_index(self, op, archive_name):
+        return build_index(op, archive_name)
+
+    def list(self, op, archive_name, folder=''):
+        return build_index(op, archive_name).listdir(folder)
+
+    def search(self, op, archive_name, query, mode='substring', archive_index=None):
+        if archive_index is None or not archive_index.is_current(archive_name):
+            archive_index = build_index(op, archive_name)
+        return archive_index.name_index().search(query, mode)
+
+    def add_files(self, op, archive_name, paths, folder='', policy=None):
+        return jobs.add_files(op, archive_name, paths, folder, self.method, policy or self.make_policy(), self.workers)
+
+    def add_folder(self, op, archive_name, folder_path, folder='', delete_missing=False, policy=None):
+        # Adding a folder is a sync that keeps what is already there, so
+        # unchanged files are not compressed again.
+        return sync_folder(op, archive_name, folder_path, folder, self.method, delete_missing, self.sync_hash, self.include,
+                           self.exclude, self.symlinks, policy or self.make_policy(), self.workers)
+
+    def add(self, op, archive_name, paths, folder='', policy=None):
+        policy = policy or self.make_policy()
+        files = [path for path in paths if not os.path.isdir(path)]
+        added = self.add_files(op, archive_name, files, folder, policy) if files else []
+        removed = []
+        prefix = folder.rstrip('/') + '/' if folder else ''
+        for path in paths:
+            if os.path.isdir(path):
+                op.reset_progress()
+                result = self.add_folder(op, archive_name, path, prefix + os.path.basename(os.path.normpath(path)) + '/', policy=policy)
+                added += result[0]
+                removed += result[1]
+        return added, removed
+
+    def sync(self, op, archive_name, folder_path, folder='', policy=None):
+        return self.add_folder(op, archive_name, folder_path, folder, delete_missing=True, policy=policy)
+
+    def create_folder(self, op, archive_name, arcname):
+        return jobs.create_folder(op, archive_name, arcname)
+
+    def extract(self, op, archive_name, extract_path, names=None):
+        return jobs.extract_members(op, archive_name, names, extract_path, self.workers)
+
+    def delete(self, op, archive_name, names, in_place=False):
+        # In place needs no free space for a copy, but a ZIP archive cut
+        # off halfway through is left without a central directory.
+        return jobs.delete_members(op, archive_name, names, in_place)
+
+    def rename(self, op, archive_name, old_name, new_name):
+        session = Session(archive_name)
+        session.rename(old_name, new_name)
+        return self.commit(op, session)
+
+    def commit(self, op, session, policy=None):
+        return session.commit(op, self.method, policy or self.make_policy())
+
+    def grep(self, op, archive_name, pattern, regex=False, ignore_case=True, max_hits=100, selection=None, on_match=None):
+        return grep_archive(op, archive_name, pattern, regex, ignore_case, max_hits, selection, on_match, self.workers)
+
+    def test(self, op, archive_name):
+        return test_archive(op, archive_name, self.workers)
+
+    def convert(self, op, source, target):
+        return convert_archive(op, source, target, self.method)
+
+    def stream(self, op, fileobj, archive_format, paths, policy=None):
+        return write_stream(op, fileobj, archive_format, stream_records(paths, self.symlinks, op), self.method, policy=policy)
+
+    def preview(self, op, archive_name, name, limit=PREVIEW_SIZE, crc=None):
+        # Returns the member's first limit bytes as text, or as a hex dump
+        # for binary data, with how many bytes that is and the member's size.
+        data, size = self.previews.head(op, archive_name, name, limit, crc)
+        return preview_text(data), len(data), size
+
+    def open_member(self, op, archive_name, name, crc=None):
+        return self.previews.extract(op, archive_name, name, crc)
+
+    def close(self):
+        self.previews.clear()
@@ -0,0 +1,450 @@
+import os
+import tarfile
+import threading
+import zipfile
+import zlib
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+from . import zipformat
+from .operations import OperationCancelled
+from .rewrite import member_matches, split_selection, tar_member_matches
+from .tarindex import TarIndex
+
+COPY_BUFFER = 1024 * 1024
+RANGE_SIZE = 16 * 1024 * 1024
+RANGED_FILE = 4 * RANGE_SIZE
+HAS_PWRITE = hasattr(os, 'pread') and hasattr(os, 'pwrite')
+BINARY = getattr(os, 'O_BINARY', 0)
+# Python's own path and link checks, where this version has them.
+EXTRACT_FILTER = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+FILTER_ERRORS = getattr(tarfile, 'FilterError', ())
+
+
+def target_path(dest, member_name):
+    parts = [part for part in member_name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    if parts:
+        parts[0] = os.path.splitdrive(parts[0])[1].lstrip(':') or '_'
+    return os.path.join(dest, *parts)
+
+
+def _gf2_times(matrix, vector):
+    total = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[row]
+        vector >>= 1
+        row += 1
+    return total
+
+
+def _gf2_square(matrix):
+    return [_gf2_times(matrix, value) for value in matrix]
+
+
+def crc32_combine(crc1, crc2, length2):
+    # zlib's crc32_combine(): CRC of A+B from crc(A), crc(B) and len(B),
+    # so ranges checked on different threads still verify the whole file.
+    if length2 <= 0:
+        return crc1
+    odd = [0xEDB88320] + [1 << bit for bit in range(31)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+    while True:
+        even = _gf2_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+        odd = _gf2_square(even)
+        if length2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+    return crc1 ^ crc2
+
+
+def preallocate(fd, size):
+    if size <= 0:
+        return
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, size)
+
+
+def make_directories(targets):
+    # One pass over the distinct parents, shallowest first, instead of a
+    # makedirs() call per extracted file.
+    for directory in sorted(set(targets), key=len):
+        os.makedirs(directory, exist_ok=True)
+
+
+class Handles:
+    def __init__(self, opener):
+        self._opener = opener
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened = []
+
+    def get(self):
+        handle = getattr(self._local, 'handle', None)
+        if handle is None:
+            handle = self._local.handle = self._opener()
+            with self._lock:
+                self._opened.append(handle)
+        return handle
+
+    def close(self):
+        for handle in self._opened:
+            handle.close()
+        self._opened = []
+
+
+class _RangedFile:
+    __slots__ = ('target', 'fd', 'size', 'crc', 'crcs', 'mode', 'mtime')
+
+    def __init__(self, target, size, crc=None, mode=None, mtime=None):
+        self.target = target
+        self.size = size
+        self.crc = crc
+        self.mode = mode
+        self.mtime = mtime
+        self.crcs = {}
+        self.fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | BINARY, 0o666)
+        preallocate(self.fd, size)
+
+    def ranges(self, data_offset):
+        for start in range(0, self.size, RANGE_SIZE):
+            yield data_offset + start, start, min(RANGE_SIZE, self.size - start)
+
+    def finish(self):
+        os.close(self.fd)
+        self.fd = None
+        if self.crc is not None:
+            crc = 0
+            for start in sorted(self.crcs):
+                crc = crc32_combine(crc, self.crcs[start], min(RANGE_SIZE, self.size - start))
+            if crc != self.crc:
+                raise zipfile.BadZipFile(f"Bad CRC-32 for file {os.path.basename(self.target)!r}")
+        if self.mode is not None:
+            os.chmod(self.target, self.mode)
+        if self.mtime is not None:
+            os.utime(self.target, (self.mtime, self.mtime))
+
+    def discard(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        _remove_quietly(self.target)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _copy(op, src, dst, length=None):
+    while length is None or length:
+        with op.metrics.phase('read') as phase:
+            chunk = src.read(COPY_BUFFER if length is None else min(COPY_BUFFER, length))
+            phase.bytes = len(chunk)
+        if not chunk:
+            if length is not None:
+                raise EOFError('unexpected end of archive')
+            break
+        with op.metrics.phase('write', len(chunk)):
+            dst.write(chunk)
+        op.advance(len(chunk))
+        if length is not None:
+            length -= len(chunk)
+
+
+def _copy_range(op, src_fd, ranged, src_offset, dst_offset, length):
+    crc = 0
+    position = dst_offset
+    while length:
+        with op.metrics.phase('read') as phase:
+            chunk = os.pread(src_fd, min(COPY_BUFFER, length), src_offset)
+            phase.bytes = len(chunk)
+        if not chunk:
+            raise EOFError('unexpected end of archive')
+        view = memoryview(chunk)
+        with op.metrics.phase('write', len(chunk)):
+            while view:
+                written = os.pwrite(ranged.fd, view, position)
+                view = view[written:]
+                position += written
+        crc = zlib.crc32(chunk, crc)
+        src_offset += len(chunk)
+        length -= len(chunk)
+        op.advance(len(chunk))
+    ranged.crcs[dst_offset] = crc
+
+
+class _TaskOperation:
+    # The operation as the tasks of one run_tasks() call see it: it also
+    # stops them once a sibling has failed, without marking the operation
+    # itself as cancelled, so the error is reported as what it was and
+    # later phases can still use the operation.
+    def __init__(self, op, stop):
+        self._op = op
+        self._stop = stop
+
+    def __getattr__(self, name):
+        return getattr(self._op, name)
+
+    def check(self):
+        if self._stop.is_set():
+            raise OperationCancelled(self._op.title)
+        self._op.check()
+
+    def advance(self, nbytes=0, members=0, check=True):
+        self._op.advance(nbytes, members, check=False)
+        if check:
+            self.check()
+
+
+def run_tasks(op, tasks, workers):
+    # Largest tasks first so a big member does not end up running alone
+    # after every other worker has gone idle.
+    tasks.sort(key=lambda task: task[0], reverse=True)
+    stop = threading.Event()
+    task_op = _TaskOperation(op, stop)
+    with ThreadPoolExecutor(workers, thread_name_prefix='archiver-extract') as executor:
+        futures = [executor.submit(func, *[task_op if arg is op else arg for arg in args]) for size, func, args in tasks]
+        try:
+            # The first failure counts, not the first task in the list, so a
+            # big member is not left running after a small one failed.
+            done = wait(futures, return_when=FIRST_EXCEPTION)[0]
+            for future in futures:
+                if future in done:
+                    future.result()
+        except BaseException:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def _finish_ranged(ranged_files, ok):
+    error = None
+    for ranged in ranged_files:
+        try:
+            if ok:
+                ranged.finish()
+            else:
+                ranged.discard()
+        except Exception as e:
+            ranged.discard()
+            error = error or e
+    if error is not None:
+        raise error
+
+
+def extract_zip(op, archive_name, selection, dest, workers=None):
+    workers = workers or os.cpu_count() or 1
+    with zipfile.ZipFile(archive_name, 'r') as archive:
+        infos = archive.infolist()
+    if selection is not None:
+        names, prefixes = split_selection(selection)
+        known = {info.filename for info in infos}
+        missing = [name for name in names if name not in known and not name.endswith('/')]
+        if missing:
+            raise KeyError(f"There is no item named {missing[0]!r} in the archive")
+        infos = [info for info in infos if member_matches(info.filename, names, prefixes)]
+    op.set_total(bytes_total=sum(info.file_size for info in infos), members_total=len(infos))
+    targets = [target_path(dest, info.filename) for info in infos]
+    make_directories([target if info.is_dir() else os.path.dirname(target) for info, target in zip(infos, targets)])
+    handles = Handles(lambda: zipfile.ZipFile(archive_name, 'r'))
+    tasks = []
+    ranged_files = []
+    src_fd = os.open(archive_name, os.O_RDONLY | BINARY)
+    ok = False
+    try:
+        for info, target in zip(infos, targets):
+            if info.is_dir():
+                op.advance(members=1)
+            elif HAS_PWRITE and info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1 and info.file_size >= RANGED_FILE:
+                header = zipformat.LOCAL_HEADER.unpack(os.pread(src_fd, zipformat.LOCAL_HEADER.size, info.header_offset))
+                data_offset = info.header_offset + zipformat.LOCAL_HEADER.size + header[10] + header[11]
+                ranged = _RangedFile(target, info.file_size, info.CRC)
+                ranged_files.append(ranged)
+                for src_offset, dst_offset, length in ranged.ranges(data_offset):
+                    tasks.append((length, _copy_range, (op, src_fd, ranged, src_offset, dst_offset, length)))
+                op.advance(members=1)
+            else:
+                tasks.append((info.compress_size, _extract_zip_member, (op, handles, info, target)))
+        run_tasks(op, tasks, workers)
+        ok = True
+    finally:
+        handles.close()
+        os.close(src_fd)
+        _finish_ranged(ranged_files, ok)
+    return dest
+
+
+def _extract_zip_member(op, handles, info, target):
+    op.check()
+    try:
+        with handles.get().open(info) as src, open(target, 'wb') as dst:
+            preallocate(dst.fileno(), info.file_size)
+            _copy(op, src, dst)
+            dst.truncate()
+    except BaseException:
+        _remove_quietly(target)
+        raise
+    op.advance(members=1)
+
+
+def _select_tar(tar_index, selection):
+    if selection is None:
+        return list(range(len(tar_index)))
+    names, prefixes = split_selection(selection)
+    for name in names:
+        if not name.endswith('/') and tar_index.find(name) is None:
+            raise KeyError(f"filename {name!r} not found")
+    return [position for position in range(len(tar_index)) if tar_member_matches(tar_index, position, names, prefixes)]
+
+
+def extract_tar(op, archive_name, selection, dest, workers=None):
+    workers = workers or os.cpu_count() or 1
+    tar_index = TarIndex.load(archive_name, persist=op.tar_index_cache)
+    positions = _select_tar(tar_index, selection)
+    regular = [position for position in positions if tar_index.is_regular(position)]
+    special = [position for position in positions if not tar_index.is_regular(position)]
+    op.set_total(bytes_total=sum(tar_index.sizes[position] for position in regular), members_total=len(positions))
+    targets = {position: target_path(dest, tar_index.names[position]) for position in positions}
+    make_directories([targets[position] if tar_index.is_dir(position) else os.path.dirname(targets[position])
+                      for position in positions])
+    if tar_index.codec is None:
+        _extract_plain_tar(op, tar_index, regular, targets, workers)
+    else:
+        _extract_compressed_tar(op, tar_index, regular, targets, workers)
+    # Links, devices and folder attributes go last, once every file they
+    # may point at is in place.
+    if special:
+        with tar_index.open() as archive:
+            for position in special:
+                op.check()
+                _extract_special(archive, tar_index.read_tarinfo(archive, position), dest, targets[position])
+                op.advance(members=1)
+    return dest
+
+
+def _inside(dest, path):
+    dest = os.path.realpath(dest)
+    return os.path.commonpath([dest, os.path.realpath(path)]) == dest
+
+
+def _extract_special(archive, tarinfo, dest, target):
+    # The member goes where target_path() put it, like regular files do, and
+    # a link that would reach outside dest is left out rather than made.
+    if tarinfo.issym() and not _inside(dest, os.path.join(os.path.dirname(target), tarinfo.linkname)):
+        return
+    if tarinfo.islnk() and not _inside(dest, target_path(dest, tarinfo.linkname)):
+        return
+    tarinfo.name = os.path.relpath(target, dest).replace(os.sep, '/')
+    if tarinfo.islnk():
+        tarinfo.linkname = os.path.relpath(target_path(dest, tarinfo.linkname), dest).replace(os.sep, '/')
+    try:
+        archive.extract(tarinfo, dest, **EXTRACT_FILTER)
+    except FILTER_ERRORS:
+        # Devices and anything else the 'data' filter refuses are skipped.
+        pass
+
+
+def _extract_plain_tar(op, tar_index, positions, targets, workers):
+    tasks = []
+    ranged_files = []
+    handles = Handles(lambda: open(tar_index.archive_name, 'rb'))
+    src_fd = os.open(tar_index.archive_name, os.O_RDONLY | BINARY)
+    ok = False
+    try:
+        with tar_index.open() as archive:
+            for position in positions:
+                op.check()
+                member = tar_index.read_tarinfo(archive, position)
+                if member.sparse is not None:
+                    tasks.append((member.size, _extract_tar_members, (op, tar_index, [position], targets)))
+                elif HAS_PWRITE and member.size >= RANGED_FILE:
+                    ranged = _RangedFile(targets[position], member.size, mode=member.mode & 0o777, mtime=member.mtime)
+                    ranged_files.append(ranged)
+                    for src_offset, dst_offset, length in ranged.ranges(member.offset_data):
+                        tasks.append((length, _copy_range, (op, src_fd, ranged, src_offset, dst_offset, length)))
+                    op.advance(members=1)
+                else:
+                    tasks.append((member.size, _copy_tar_member, (op, handles, member, targets[position])))
+        run_tasks(op, tasks, workers)
+        ok = True
+    finally:
+        handles.close()
+        os.close(src_fd)
+        _finish_ranged(ranged_files, ok)
+
+
+def _copy_tar_member(op, handles, member, target):
+    op.check()
+    src = handles.get()
+    src.seek(member.offset_data)
+    try:
+        with open(target, 'wb') as dst:
+            preallocate(dst.fileno(), member.size)
+            _copy(op, src, dst, member.size)
+    except BaseException:
+        _remove_quietly(target)
+        raise
+    os.chmod(target, member.mode & 0o777)
+    os.utime(target, (member.mtime, member.mtime))
+    op.advance(members=1)
+
+
+def member_runs(tar_index, positions, workers):
+    # Split members into runs of consecutive ones; each run is meant for a
+    # private reader that starts at the checkpoint nearest to it.
+    positions = sorted(positions, key=lambda position: tar_index.data_offsets[position])
+    total = sum(tar_index.sizes[position] for position in positions)
+    share = max(total // (workers * 4), RANGE_SIZE)
+    runs = []
+    run = []
+    run_size = 0
+    for position in positions:
+        run.append(position)
+        run_size += tar_index.sizes[position]
+        if run_size >= share:
+            runs.append((run_size, run))
+            run = []
+            run_size = 0
+    if run:
+        runs.append((run_size, run))
+    return runs
+
+
+def _extract_compressed_tar(op, tar_index, positions, targets, workers):
+    run_tasks(op, [(size, _extract_tar_members, (op, tar_index, run, targets))
+                   for size, run in member_runs(tar_index, positions, workers)], workers)
+
+
+def _extract_tar_members(op, tar_index, positions, targets):
+    with tar_index.open() as archive:
+        for position in positions:
+            op.check()
+            member = tar_index.read_tarinfo(archive, position)
+            target = targets[position]
+            try:
+                with archive.extractfile(member) as src, open(target, 'wb') as dst:
+                    preallocate(dst.fileno(), member.size)
+                    _copy(op, src, dst)
+            except BaseException:
+                _remove_quietly(target)
+                raise
+            os.chmod(target, member.mode & 0o777)
+            os.utime(target, (member.mtime, member.mtime))
+            op.advance(members=1)
@@ -0,0 +1,309 @@
+from types import MappingProxyType
+
+# Texts of the GUI keyed by their Russian source. The catalog is built and
+# frozen once at import; switching language only swaps which mapping the
+# window looks texts up in.
+_TRANSLATIONS = {
+    'ru': {
+        "Имя файла/папки": "Имя файла/папки",
+        "Размер": "Размер",
+        "Дата изменения": "Дата изменения",
+        "Готово": "Готово",
+        "Обратная связь": "Обратная связь",
+        "Выбор": "Выбор",
+        "Поиск файла": "Поиск файла",
+        "Удаление": "Удаление",
+        "Файлы загружены из": "Файлы загружены из",
+        "Файлы добавлены в архив.": "Файлы добавлены в архив.",
+        "Файл не найден.": "Файл не найден.",
+        "Настройки": "Настройки",
+        "Новый архив\tCtrl+N": "Новый архив\tCtrl+N",
+        "Открыть архив\tCtrl+O": "Открыть архив\tCtrl+O",
+        "Выход\tCtrl+Q": "Выход\tCtrl+Q",
+        "Файл": "Файл",
+        "Добавить файл или папку\tCtrl+A": "Добавить файл или папку\tCtrl+A",
+        "Извлечь всё\tCtrl+E": "Извлечь всё\tCtrl+E",
+        "Извлечь выбранное\tCtrl+Shift+E": "Извлечь выбранное\tCtrl+Shift+E",
+        "Создать папку": "Создать папку",
+        "Инструменты": "Инструменты",
+        "Новый": "Новый",
+        "Открыть": "Открыть",
+        "Добавить": "Добавить",
+        "Извлечь": "Извлечь",
+        "Поиск": "Поиск",
+        "Удалить": "Удалить",
+        "Поиск файла в архиве": "Поиск файла в архиве",
+        "Удалить выбранный файл": "Удалить выбранный файл",
+        "Ошибка сохранения конфига: ": "Ошибка сохранения конфига: ",
+        "Некорректный zip файл.": "Некорректный zip файл.",
+        "Сначала откройте архив.": "Сначала откройте архив.",
+        "Выберите хотя бы один файл для извлечения.": "Выберите хотя бы один файл для извлечения.",
+        "Выберите файл для удаления.": "Выберите файл для удаления.",
+        "Файлы удалены.": "Файлы удалены.",
+        "Папка и файлы добавлены в архив.": "Папка и файлы добавлены в архив.",
+        "Введите имя файла для поиска:": "Введите имя файла для поиска:",
+        "Создать новый архив": "Создать новый архив",
+        "Открыть существующий архив": "Открыть существующий архив",
+        "Выход из приложения": "Выход из приложения",
+        "Связь с разработчиком": "Связь с разработчиком",
+        "Настройки приложения": "Настройки приложения",
+        "Архиватор": "Архиватор",
+        "Выберите язык:": "Выберите язык:",
+        "Настройки языка": "Настройки языка",
+        "Информация": "Информация",
+        "Ошибка": "Ошибка",
+        "Добавить файл или папку в архив": "Добавить файл или папку в архив",
+        "Извлечь все файлы из архива": "Извлечь все файлы из архива",
+        "Извлечь выбранный файл": "Извлечь выбранный файл",
+        "Создать папку в архиве": "Создать папку в архиве",
+        "Введите имя папки:": "Введите имя папки:",
+        "Создание папки": "Создание папки",
+        "Папка": "Папка",
+        "создана.": "создана.",
+        "Выберите архив": "Выберите архив",
+        "Открыт архив:": "Открыт архив:",
+        "Создать архив": "Создать архив",
+        "Создание архива:": "Создание архива:",
+        "Архив": "Архив",
+        "создан.": "создан.",
+        "Добавить файл (OK) или папку (Cancel)?": "Добавить файл (OK) или папку (Cancel)?",
+        "Выберите файл для добавления": "Выберите файл для добавления",
+        "Выберите папку для добавления": "Выберите папку для добавления",
+        "Выберите папку для извлечения": "Выберите папку для извлечения",
+        "Все файлы извлечены в": "Все файлы извлечены в",
+        "Файлы извлечены в": "Файлы извлечены в",
+        "Вы уверены, что хотите удалить": "Вы уверены, что хотите удалить",
+        "файл(ов)?": "файл(ов)?",
+        "Отменить операцию\tEsc": "Отменить операцию\tEsc",
+        "Отменить текущую операцию": "Отменить текущую операцию",
+        "Операция отменена.": "Операция отменена.",
+        "Загрузка списка файлов": "Загрузка списка файлов",
+        "Добавление файлов": "Добавление файлов",
+        "Извлечение файлов": "Извлечение файлов",
+        "Удаление файлов": "Удаление файлов",
+        "файлов": "файлов",
+        "МБ/с": "МБ/с",
+        "осталось": "осталось",
+        "Метод сжатия": "Метод сжатия",
+        "Выбрать метод сжатия ZIP": "Выбрать метод сжатия ZIP",
+        "Выберите метод сжатия:": "Выберите метод сжатия:",
+        "Без сжатия": "Без сжатия",
+        "Синхронизировать с папкой": "Синхронизировать с папкой",
+        "Обновить архив из папки и удалить отсутствующие файлы": "Обновить архив из папки и удалить отсутствующие файлы",
+        "Выберите папку для синхронизации": "Выберите папку для синхронизации",
+        "Синхронизация": "Синхронизация",
+        "Архив синхронизирован.": "Архив синхронизирован.",
+        "Добавлено или обновлено:": "Добавлено или обновлено:",
+        "удалено:": "удалено:",
+        "Выберите тип поиска:": "Выберите тип поиска:",
+        "Имя содержит текст": "Имя содержит текст",
+        "Имя по шаблону (*, ?)": "Имя по шаблону (*, ?)",
+        "Имя по регулярному выражению": "Имя по регулярному выражению",
+        "Содержимое файлов": "Содержимое файлов",
+        "Введите текст для поиска:": "Введите текст для поиска:",
+        "Поиск в содержимом": "Поиск в содержимом",
+        "Некорректное регулярное выражение:": "Некорректное регулярное выражение:",
+        "Найдено:": "Найдено:",
+        "Найдено совпадений:": "Найдено совпадений:",
+        "Пакетный режим": "Пакетный режим",
+        "Накапливать изменения и записывать их в архив за один проход": "Накапливать изменения и записывать их в архив за один проход",
+        "Применить изменения\tCtrl+S": "Применить изменения\tCtrl+S",
+        "Записать накопленные изменения в архив": "Записать накопленные изменения в архив",
+        "Переименовать\tF2": "Переименовать\tF2",
+        "Переименовать выбранный файл или папку": "Переименовать выбранный файл или папку",
+        "Изменений в очереди:": "Изменений в очереди:",
+        "Нет изменений для применения.": "Нет изменений для применения.",
+        "Применение изменений": "Применение изменений",
+        "Изменения применены.": "Изменения применены.",
+        "Выберите один файл или папку для переименования.": "Выберите один файл или папку для переименования.",
+        "Введите новое имя:": "Введите новое имя:",
+        "Переименование": "Переименование",
+        "Файл переименован.": "Файл переименован.",
+        "Некорректная политика сжатия в конфиге:": "Некорректная политика сжатия в конфиге:",
+        "Сжатие:": "Сжатие:",
+        "Проверить архив\tCtrl+T": "Проверить архив\tCtrl+T",
+        "Проверить контрольные суммы всех файлов архива": "Проверить контрольные суммы всех файлов архива",
+        "Проверка архива": "Проверка архива",
+        "Ошибок не найдено.": "Ошибок не найдено.",
+        "Проверено файлов:": "Проверено файлов:",
+        "Найдены ошибки:": "Найдены ошибки:",
+        "Первая ошибка через": "Первая ошибка через",
+        "с": "с",
+        "Всё равно продолжить?": "Всё равно продолжить?",
+        "Конвертировать архив": "Конвертировать архив",
+        "Сохранить архив в другом формате": "Сохранить архив в другом формате",
+        "Конвертирование": "Конвертирование",
+        "Архив сохранён как": "Архив сохранён как",
+        "файлов/с": "файлов/с",
+        "обход папок": "обход папок",
+        "чтение": "чтение",
+        "сжатие": "сжатие",
+        "ожидание сжатия": "ожидание сжатия",
+        "запись": "запись",
+        "сброс на диск": "сброс на диск",
+        "в очереди": "в очереди",
+        "операций ждёт": "операций ждёт",
+        "Просмотр": "Просмотр",
+        "Открытие файла": "Открытие файла",
+        "Показать ещё": "Показать ещё",
+        "Открыть в программе": "Открыть в программе",
+        "Показано байт:": "Показано байт:",
+        "из": "из",
+        "Не удалось открыть файл:": "Не удалось открыть файл:"
+    },
+    'en': {
+        "Имя файла/папки": "File/Folder Name",
+        "Размер": "Size",
+        "Дата изменения": "Date Modified",
+        "Готово": "Ready",
+        "Обратная связь": "Feedback",
+        "Выбор": "Selection",
+        "Поиск файла": "Search File",
+        "Удаление": "Deletion",
+        "Файлы загружены из": "Files loaded from",
+        "Файлы добавлены в архив.": "Files added to archive.",
+        "Файл не найден.": "File not found.",
+        "Настройки": "Settings",
+        "Новый архив\tCtrl+N": "New Archive\tCtrl+N",
+        "Открыть архив\tCtrl+O": "Open Archive\tCtrl+O",
+        "Выход\tCtrl+Q": "Exit\tCtrl+Q",
+        "Файл": "File",
+        "Добавить файл или папку\tCtrl+A": "Add File or Folder\tCtrl+A",
+        "Извлечь всё\tCtrl+E": "Extract All\tCtrl+E",
+        "Извлечь выбранное\tCtrl+Shift+E": "Extract Selected\tCtrl+Shift+E",
+        "Создать папку": "Create Folder",
+        "Инструменты": "Tools",
+        "Новый": "New",
+        "Открыть": "Open",
+        "Добавить": "Add",
+        "Извлечь": "Extract",
+        "Поиск": "Search",
+        "Удалить": "Delete",
+        "Поиск файла в архиве": "Search file in archive",
+        "Удалить выбранный файл": "Delete selected file",
+        "Ошибка сохранения конфига: ": "Error saving config: ",
+        "Некорректный zip файл.": "Invalid zip file.",
+        "Сначала откройте архив.": "Open the archive first.",
+        "Выберите хотя бы один файл для извлечения.": "Select at least one file to extract.",
+        "Выберите файл для удаления.": "Select a file to delete.",
+        "Файлы удалены.": "Files deleted.",
+        "Папка и файлы добавлены в архив.": "Folder and files added to archive.",
+        "Введите имя файла для поиска:": "Enter the file name to search:",
+        "Создать новый архив": "Create new archive",
+        "Открыть существующий архив": "Open existing archive",
+        "Выход из приложения": "Exit application",
+        "Связь с разработчиком": "Contact developer",
+        "Настройки приложения": "Application settings",
+        "Архиватор": "Archiver",
+        "Выберите язык:": "Select language:",
+        "Настройки языка": "Language settings",
+        "Информация": "Information",
+        "Ошибка": "Error",
+        "Добавить файл или папку в архив": "Add file or folder to archive",
+        "Извлечь все файлы из архива": "Extract all files from archive",
+        "Извлечь выбранный файл": "Extract selected file",
+        "Создать папку в архиве": "Create folder in archive",
+        "Введите имя папки:": "Enter folder name:",
+        "Создание папки": "Create folder",
+        "Папка": "Folder",
+        "создана.": "created.",
+        "Выберите архив": "Select archive",
+        "Открыт архив:": "Archive opened:",
+        "Создать архив": "Create archive",
+        "Создание архива:": "Creating archive:",
+        "Архив": "Archive",
+        "создан.": "created.",
+        "Добавить файл (OK) или папку (Cancel)?": "Add file (OK) or folder (Cancel)?",
+        "Выберите файл для добавления": "Select file to add",
+        "Выберите папку для добавления": "Select folder to add",
+        "Выберите папку для извлечения": "Select folder for extraction",
+        "Все файлы извлечены в": "All files extracted to",
+        "Файлы извлечены в": "Files extracted to",
+        "Вы уверены, что хотите удалить": "Are you sure you want to delete",
+        "файл(ов)?": "file(s)?",
+        "Отменить операцию\tEsc": "Cancel operation\tEsc",
+        "Отменить текущую операцию": "Cancel the current operation",
+        "Операция отменена.": "Operation cancelled.",
+        "Загрузка списка файлов": "Loading file list",
+        "Добавление файлов": "Adding files",
+        "Извлечение файлов": "Extracting files",
+        "Удаление файлов": "Deleting files",
+        "файлов": "files",
+        "МБ/с": "MB/s",
+        "осталось": "left",
+        "Метод сжатия": "Compression method",
+        "Выбрать метод сжатия ZIP": "Choose the ZIP compression method",
+        "Выберите метод сжатия:": "Select compression method:",
+        "Без сжатия": "No compression",
+        "Синхронизировать с папкой": "Sync with folder",
+        "Обновить архив из папки и удалить отсутствующие файлы": "Update the archive from a folder and remove missing files",
+        "Выберите папку для синхронизации": "Select a folder to sync",
+        "Синхронизация": "Syncing",
+        "Архив синхронизирован.": "Archive synchronized.",
+        "Добавлено или обновлено:": "Added or updated:",
+        "удалено:": "removed:",
+        "Выберите тип поиска:": "Select search type:",
+        "Имя содержит текст": "Name contains text",
+        "Имя по шаблону (*, ?)": "Name matches pattern (*, ?)",
+        "Имя по регулярному выражению": "Name matches regular expression",
+        "Содержимое файлов": "File contents",
+        "Введите текст для поиска:": "Enter text to search for:",
+        "Поиск в содержимом": "Searching contents",
+        "Некорректное регулярное выражение:": "Invalid regular expression:",
+        "Найдено:": "Found:",
+        "Найдено совпадений:": "Matches found:",
+        "Пакетный режим": "Batch mode",
+        "Накапливать изменения и записывать их в архив за один проход": "Collect changes and write them to the archive in one pass",
+        "Применить изменения\tCtrl+S": "Apply changes\tCtrl+S",
+        "Записать накопленные изменения в архив": "Write the collected changes to the archive",
+        "Переименовать\tF2": "Rename\tF2",
+        "Переименовать выбранный файл или папку": "Rename the selected file or folder",
+        "Изменений в очереди:": "Changes queued:",
+        "Нет изменений для применения.": "No changes to apply.",
+        "Применение изменений": "Applying changes",
+        "Изменения применены.": "Changes applied.",
+        "Выберите один файл или папку для переименования.": "Select one file or folder to rename.",
+        "Введите новое имя:": "Enter the new name:",
+        "Переименование": "Renaming",
+        "Файл переименован.": "File renamed.",
+        "Некорректная политика сжатия в конфиге:": "Invalid compression policy in config:",
+        "Сжатие:": "Compression:",
+        "Проверить архив\tCtrl+T": "Test archive\tCtrl+T",
+        "Проверить контрольные суммы всех файлов архива": "Check the checksums of every file in the archive",
+        "Проверка архива": "Testing archive",
+        "Ошибок не найдено.": "No errors found.",
+        "Проверено файлов:": "Files checked:",
+        "Найдены ошибки:": "Errors found:",
+        "Первая ошибка через": "First error after",
+        "с": "s",
+        "Всё равно продолжить?": "Continue anyway?",
+        "Конвертировать архив": "Convert archive",
+        "Сохранить архив в другом формате": "Save the archive in another format",
+        "Конвертирование": "Converting",
+        "Архив сохранён как": "Archive saved as",
+        "файлов/с": "files/s",
+        "обход папок": "scan",
+        "чтение": "read",
+        "сжатие": "compress",
+        "ожидание сжатия": "compress wait",
+        "запись": "write",
+        "сброс на диск": "fsync",
+        "в очереди": "queued",
+        "операций ждёт": "operations waiting",
+        "Просмотр": "Preview",
+        "Открытие файла": "Opening file",
+        "Показать ещё": "Show more",
+        "Открыть в программе": "Open in default program",
+        "Показано байт:": "Bytes shown:",
+        "из": "of",
+        "Не удалось открыть файл:": "Could not open file:"
+    }
+}
+
+LANGUAGES = ('ru', 'en')
+CATALOG = MappingProxyType({language: MappingProxyType(texts) for language, texts in _TRANSLATIONS.items()})
+del _TRANSLATIONS
+
+
+def catalog(language):
+    return CATALOG.get(language, CATALOG['ru'])
@@ -0,0 +1,163 @@
+import os
+import sys
+
+from .jobs import archive_kind
+from .search import NameIndex
+from .tarindex import TarIndex
+from .zipreader import ZipDirectory
+
+
+class Node:
+    __slots__ = ('name', 'parent', 'children', 'size', 'mtime', 'crc', 'explicit')
+
+    def __init__(self, name, parent, is_dir, size=0, mtime=None, crc=None, explicit=True):
+        self.name = name
+        self.parent = parent
+        self.children = {} if is_dir else None
+        self.size = size
+        self.mtime = mtime
+        self.crc = crc
+        self.explicit = explicit
+
+    @property
+    def is_dir(self):
+        return self.children is not None
+
+    @property
+    def display_name(self):
+        return self.name + '/' if self.children is not None else self.name
+
+    def path(self):
+        parts = []
+        node = self
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        return '/'.join(reversed(parts))
+
+
+def archive_signature(archive_name):
+    stat = os.stat(archive_name)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ArchiveIndex:
+    def __init__(self, kind='zip', signature=None):
+        self.kind = kind
+        self.signature = signature
+        self.root = Node('', None, True)
+        self.count = 0
+        self._name_index = None
+
+    @classmethod
+    def build(cls, archive_name, op=None):
+        kind = archive_kind(archive_name)
+        index = cls(kind, archive_signature(archive_name))
+        if kind == 'zip':
+            with ZipDirectory(archive_name) as directory:
+                if op is not None:
+                    op.set_total(members_total=len(directory))
+                for position in range(len(directory)):
+                    index.add(directory.name(position), directory.usizes[position], directory.mtime(position),
+                              directory.is_dir(position), directory.crcs[position])
+                    if op is not None and position % 1024 == 1023:
+                        op.advance(members=1024)
+        elif kind == 'tar':
+            for name, size, mtime, is_dir in TarIndex.load(archive_name, op=op, persist=op.tar_index_cache).entries():
+                index.add(name, size, mtime, is_dir)
+        return index
+
+    def is_current(self, archive_name):
+        try:
+            return self.signature == archive_signature(archive_name)
+        except OSError:
+            return False
+
+    def refresh_signature(self, archive_name):
+        self.signature = archive_signature(archive_name)
+
+    def member_name(self, node):
+        path = node.path()
+        return path + '/' if node.is_dir and self.kind == 'zip' else path
+
+    def find(self, path):
+        node = self.root
+        for part in path.split('/'):
+            if not part:
+                continue
+            if node.children is None:
+                return None
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def listdir(self, folder):
+        node = self.find(folder)
+        if node is None or node.children is None:
+            return []
+        return list(node.children.values())
+
+    def walk(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.children:
+                stack.extend(node.children.values())
+
+    def member_names(self, path):
+        node = self.find(path)
+        if node is None:
+            return []
+        return [self.member_name(child) for child in self.walk(node) if child.explicit and child.parent is not None]
+
+    def name_index(self):
+        if self._name_index is None:
+            nodes = [node for node in self.walk(self.root) if node.parent is not None]
+            self._name_index = NameIndex([self.member_name(node) for node in nodes], nodes)
+        return self._name_index
+
+    def add(self, name, size=0, mtime=None, is_dir=False, crc=None):
+        self._name_index = None
+        parts = [sys.intern(part) for part in name.split('/') if part]
+        if not parts:
+            return None
+        is_dir = is_dir or name.endswith('/')
+        node = self.root
+        for part in parts[:-1]:
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = Node(part, node, True, explicit=False)
+            elif child.children is None:
+                child.children = {}
+            node = child
+        leaf = node.children.get(parts[-1])
+        if leaf is None:
+            leaf = node.children[parts[-1]] = Node(parts[-1], node, is_dir, size, mtime, crc)
+            self.count += 1
+        else:
+            if not leaf.explicit:
+                self.count += 1
+            leaf.explicit = True
+            leaf.size = size
+            leaf.mtime = mtime
+            leaf.crc = crc
+            if is_dir and leaf.children is None:
+                leaf.children = {}
+        return leaf
+
+    def remove(self, name):
+        self._name_index = None
+        node = self.find(name)
+        if node is None or node.parent is None:
+            return 0
+        removed = sum(1 for child in self.walk(node) if child.explicit)
+        del node.parent.children[node.name]
+        node.parent = None
+        self.count -= removed
+        return removed
+
+
+def build_index(op, archive_name):
+    return ArchiveIndex.build(archive_name, op)
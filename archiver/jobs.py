@@ -0,0 +1,279 @@
+import functools
+import os
+import stat
+import tarfile
+import time
+import zipfile
+
+try:
+    import grp
+    import pwd
+except ImportError:
+    grp = pwd = None
+
+from .blockcodec import BlockCompressor, TAR_SUFFIXES, tar_codec
+from .extractor import extract_tar, extract_zip
+from .metrics import TimedFile
+from .rewrite import copy_range, delete_tar_members, delete_zip_members, write_tar_end
+from .tarindex import TarIndex
+from .zipwriter import ParallelZipWriter
+
+
+def archive_kind(archive_name):
+    lower = archive_name.lower()
+    if lower.endswith('.zip'):
+        return 'zip'
+    if lower.endswith('.tar') or lower.endswith(tuple(TAR_SUFFIXES)):
+        return 'tar'
+    return None
+
+
+def create_archive(archive_name):
+    kind = archive_kind(archive_name)
+    if kind == 'zip':
+        with zipfile.ZipFile(archive_name, 'w'):
+            pass
+    elif kind == 'tar':
+        codec = tar_codec(archive_name)
+        with open(archive_name, 'wb') as fp:
+            if codec is None:
+                write_tar_end(fp, 0)
+            else:
+                with BlockCompressor(fp, codec, workers=1) as compressor:
+                    write_tar_end(compressor, 0)
+
+
+class _ProgressReader:
+    def __init__(self, fileobj, op):
+        self._fileobj = fileobj
+        self._op = op
+
+    def read(self, size=-1):
+        with self._op.metrics.phase('read') as phase:
+            data = self._fileobj.read(size)
+            phase.bytes = len(data)
+        self._op.advance(len(data))
+        return data
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def add_files(op, archive_name, paths, folder, method=zipfile.ZIP_DEFLATED, policy=None, workers=None):
+    records = [(file_path, os.path.join(folder, os.path.basename(file_path)), os.stat(file_path)) for file_path in paths]
+    return add_items(op, archive_name, records, method, policy, workers)
+
+
+def create_folder(op, archive_name, arcname):
+    return add_items(op, archive_name, [(None, arcname, None)])
+
+
+def _record_size(st):
+    return st.st_size if st is not None and stat.S_ISREG(st.st_mode) else 0
+
+
+def counted_records(op, records):
+    for record in records:
+        op.add_total(_record_size(record[2]), 1)
+        yield record
+
+
+def add_items(op, archive_name, records, method=zipfile.ZIP_DEFLATED, policy=None, workers=None):
+    # Records are (path, arcname, stat) tuples; a None path stands for an
+    # empty folder entry. A generator is consumed as it goes, so writing
+    # starts while the scanner is still walking the source tree.
+    if isinstance(records, list):
+        op.set_total(bytes_total=sum(_record_size(st) for file_path, arcname, st in records), members_total=len(records))
+    else:
+        records = counted_records(op, records)
+    kind = archive_kind(archive_name)
+    if kind == 'zip':
+        return _zip_append(op, archive_name, records, method, policy, workers)
+    if kind == 'tar':
+        return _tar_append(op, archive_name, records, policy, workers)
+    return []
+
+
+def _zip_append(op, archive_name, records, method, policy=None, workers=None):
+    with ParallelZipWriter(archive_name, 'a', method=method, workers=workers, op=op, policy=policy) as writer:
+        for file_path, arcname, st in records:
+            if file_path is None:
+                writer.add_directory(arcname, time.time())
+            else:
+                writer.add_file(file_path, arcname, st)
+    return [(entry.name, entry.usize, entry.mtime, entry.is_dir) for entry in writer.entries]
+
+
+@functools.lru_cache(maxsize=None)
+def _user_name(uid):
+    try:
+        return pwd.getpwuid(uid)[0] if pwd is not None else ''
+    except KeyError:
+        return ''
+
+
+@functools.lru_cache(maxsize=None)
+def _group_name(gid):
+    try:
+        return grp.getgrgid(gid)[0] if grp is not None else ''
+    except KeyError:
+        return ''
+
+
+def tarinfo_from_stat(archive, file_path, arcname, st):
+    # TarFile.gettarinfo() without its own lstat(): the scanner already
+    # has the stat result for every entry.
+    arcname = os.path.splitdrive(arcname)[1].replace(os.sep, '/').lstrip('/')
+    tarinfo = archive.tarinfo(arcname)
+    mode = st.st_mode
+    if stat.S_ISREG(mode):
+        key = (st.st_ino, st.st_dev)
+        if st.st_nlink > 1 and key in archive.inodes and arcname != archive.inodes[key]:
+            tarinfo.type = tarfile.LNKTYPE
+            tarinfo.linkname = archive.inodes[key]
+        else:
+            tarinfo.type = tarfile.REGTYPE
+            tarinfo.size = st.st_size
+            if st.st_ino > 0:
+                archive.inodes[key] = arcname
+    elif stat.S_ISDIR(mode):
+        tarinfo.type = tarfile.DIRTYPE
+    elif stat.S_ISLNK(mode):
+        tarinfo.type = tarfile.SYMTYPE
+        tarinfo.linkname = os.readlink(file_path)
+    elif stat.S_ISFIFO(mode):
+        tarinfo.type = tarfile.FIFOTYPE
+    elif stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
+        tarinfo.type = tarfile.CHRTYPE if stat.S_ISCHR(mode) else tarfile.BLKTYPE
+        tarinfo.devmajor = os.major(st.st_rdev)
+        tarinfo.devminor = os.minor(st.st_rdev)
+    else:
+        return None
+    tarinfo.mode = stat.S_IMODE(mode)
+    tarinfo.uid = st.st_uid
+    tarinfo.gid = st.st_gid
+    tarinfo.mtime = st.st_mtime
+    tarinfo.uname = _user_name(st.st_uid)
+    tarinfo.gname = _group_name(st.st_gid)
+    return tarinfo
+
+
+def add_to_tar(op, archive, records, added):
+    for file_path, arcname, st in records:
+        op.check()
+        if file_path is None:
+            tarinfo = tarfile.TarInfo(arcname.rstrip('/'))
+            tarinfo.type = tarfile.DIRTYPE
+            tarinfo.mode = 0o755
+            tarinfo.mtime = int(time.time())
+        else:
+            tarinfo = tarinfo_from_stat(archive, file_path, arcname, st)
+            if tarinfo is None:
+                op.advance(members=1)
+                continue
+        if tarinfo.isreg():
+            with open(file_path, 'rb') as src:
+                archive.addfile(tarinfo, _ProgressReader(src, op))
+        else:
+            archive.addfile(tarinfo)
+        added.append((tarinfo.name, tarinfo.size, tarinfo.mtime, tarinfo.isdir()))
+        op.advance(members=1)
+
+
+def _tar_append(op, archive_name, records, policy=None, workers=None):
+    added = []
+    tar_index = TarIndex.load(archive_name, persist=op.tar_index_cache)
+    if tar_index.codec is not None:
+        if tar_index.end_offset() is None:
+            return _tar_rewrite_append(op, tar_index, records, policy, workers)
+        return _compressed_tar_append(op, tar_index, records, policy, workers)
+    start = tar_index.end
+    with open(archive_name, 'r+b') as fp:
+        fp.seek(start)
+        archive = tarfile.open(fileobj=TimedFile(fp, op.metrics), mode='w')
+        try:
+            add_to_tar(op, archive, records, added)
+        except BaseException:
+            fp.seek(start)
+            archive.offset = start
+            archive.close()
+            fp.truncate()
+            raise
+        archive.close()
+        fp.truncate()
+    return added
+
+
+def _compressed_tar_append(op, tar_index, records, policy=None, workers=None):
+    # Only the block holding the end-of-archive marker is replaced; every
+    # block before it is an independent stream and stays as it is.
+    added = []
+    start = tar_index.end_offset()
+    with open(tar_index.archive_name, 'r+b') as fp:
+        fp.seek(start)
+        end_block = fp.read()
+        fp.seek(start)
+        compressor = BlockCompressor(fp, tar_index.codec, workers=workers, position=tar_index.end, policy=policy, metrics=op.metrics)
+        try:
+            archive = tarfile.open(fileobj=compressor, mode='w')
+            add_to_tar(op, archive, records, added)
+            compressor.mark()
+            archive.close()
+            compressor.close()
+        except BaseException:
+            compressor.abort()
+            fp.seek(start)
+            fp.write(end_block)
+            fp.truncate()
+            raise
+        fp.truncate()
+    return added
+
+
+def _tar_rewrite_append(op, tar_index, records, policy=None, workers=None):
+    # Archives made by other tools usually hold one long compressed stream,
+    # so the end marker cannot be cut off; rewrite into independent blocks,
+    # which also makes every later append an in-place one.
+    added = []
+    archive_name = tar_index.archive_name
+    temp_archive = archive_name + '.tmp'
+    try:
+        with tar_index.open() as src, open(temp_archive, 'wb') as dst:
+            with BlockCompressor(dst, tar_index.codec, workers=workers, policy=policy, metrics=op.metrics) as compressor:
+                copy_range(src.fileobj, compressor, 0, tar_index.end)
+                compressor.mark()
+                archive = tarfile.open(fileobj=compressor, mode='w')
+                add_to_tar(op, archive, records, added)
+                compressor.mark()
+                archive.close()
+    except BaseException:
+        _remove_quietly(temp_archive)
+        raise
+    os.replace(temp_archive, archive_name)
+    return added
+
+
+def extract_all(op, archive_name, extract_path, workers=None):
+    return extract_members(op, archive_name, None, extract_path, workers)
+
+
+def extract_members(op, archive_name, names, extract_path, workers=None):
+    kind = archive_kind(archive_name)
+    if kind == 'zip':
+        return extract_zip(op, archive_name, names, extract_path, workers)
+    if kind == 'tar':
+        return extract_tar(op, archive_name, names, extract_path, workers)
+    return extract_path
+
+
+def delete_members(op, archive_name, names, in_place=False):
+    kind = archive_kind(archive_name)
+    if kind == 'zip':
+        return delete_zip_members(archive_name, names, op, in_place)
+    if kind == 'tar':
+        return delete_tar_members(archive_name, names, op)
+    return 0
@@ -0,0 +1,101 @@
+import collections
+import math
+from array import array
+from datetime import datetime
+
+PARENT_ROW = "../"
+DIR_FLAG = 1
+PARENT_FLAG = 2
+COLUMN_NAME = 0
+COLUMN_SIZE = 1
+COLUMN_DATE = 2
+
+
+class FileListModel:
+    cache_size = 2048
+
+    def __init__(self):
+        self.sort_column = COLUMN_NAME
+        self.sort_ascending = True
+        self.clear()
+
+    def clear(self):
+        self.names = []
+        self.sizes = array('q')
+        self.mtimes = array('d')
+        self.flags = bytearray()
+        self.order = array('l')
+        self._cache = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.order)
+
+    def set_nodes(self, nodes, with_parent=False):
+        self.set_entries(((node.display_name, node.size, node.mtime, node.is_dir) for node in nodes), with_parent)
+
+    def set_entries(self, entries, with_parent=False):
+        self.clear()
+        if with_parent:
+            self._append(PARENT_ROW, 0, None, PARENT_FLAG)
+        for name, size, mtime, is_dir in entries:
+            self._append(name, size or 0, mtime, DIR_FLAG if is_dir else 0)
+        self.order = array('l', range(len(self.names)))
+        self.sort(self.sort_column, self.sort_ascending)
+
+    def _append(self, name, size, mtime, flags):
+        self.names.append(name)
+        self.sizes.append(size)
+        self.mtimes.append(math.nan if mtime is None else mtime)
+        self.flags.append(flags)
+
+    def sort(self, column, ascending=True):
+        self.sort_column = column
+        self.sort_ascending = ascending
+        names, sizes, mtimes, flags = self.names, self.sizes, self.mtimes, self.flags
+        pinned = [i for i in range(len(names)) if flags[i] & PARENT_FLAG]
+        rows = [i for i in range(len(names)) if not flags[i] & PARENT_FLAG]
+        if column == COLUMN_SIZE:
+            key = lambda i: sizes[i]
+        elif column == COLUMN_DATE:
+            key = lambda i: -math.inf if mtimes[i] != mtimes[i] else mtimes[i]
+        else:
+            key = lambda i: names[i].lower()
+        rows.sort(key=key, reverse=not ascending)
+        rows.sort(key=lambda i: not flags[i] & DIR_FLAG)
+        self.order = array('l', pinned + rows)
+
+    def toggle_sort(self, column):
+        ascending = not self.sort_ascending if column == self.sort_column else True
+        self.sort(column, ascending)
+
+    def name(self, row):
+        return self.names[self.order[row]]
+
+    def is_dir(self, row):
+        return bool(self.flags[self.order[row]] & DIR_FLAG)
+
+    def is_parent(self, row):
+        return bool(self.flags[self.order[row]] & PARENT_FLAG)
+
+    def text(self, row, column):
+        index = self.order[row]
+        if column == COLUMN_NAME:
+            return self.names[index]
+        # Least recently shown rows are dropped first, so the rows on screen
+        # stay cached while the list scrolls.
+        cached = self._cache.get(index)
+        if cached is None:
+            cached = self._format(index)
+            self._cache[index] = cached
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(index)
+        return cached[column - 1]
+
+    def _format(self, index):
+        if self.flags[index]:
+            return "", ""
+        mtime = self.mtimes[index]
+        date_text = "" if mtime != mtime else datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S")
+        return str(self.sizes[index]), date_text
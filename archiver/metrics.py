@@ -0,0 +1,183 @@
+import contextlib
+import cProfile
+import json
+import os
+import re
+import threading
+import time
+
+# Where the time of an operation goes: walking the source tree, reading
+# source data, compressing, waiting on the compression pool, writing and
+# syncing the result.
+PHASES = ('scan', 'read', 'compress', 'wait', 'write', 'fsync')
+LOG_NAME = 'operations.jsonl'
+LOG_LIMIT = 4 * 1024 * 1024
+PROFILE_DIR = 'profiles'
+
+
+class _Phase:
+    __slots__ = ('metrics', 'name', 'bytes', 'started')
+
+    def __init__(self, metrics, name, nbytes):
+        self.metrics = metrics
+        self.name = name
+        self.bytes = nbytes
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.add(self.name, time.perf_counter() - self.started, self.bytes)
+
+
+class Metrics:
+    # Phase timers and queue depths of one operation. A phase's time is
+    # summed over every thread spending it, so with parallel compression
+    # 'compress' can add up to more than the wall time.
+    # Timers sit on per-chunk and per-member paths, so they take no lock:
+    # every thread adds to totals of its own, which snapshot() merges, and
+    # a queue's depth is only ever set by the thread feeding it.
+    def __init__(self):
+        self._phases = {}
+        self._queues = {}
+
+    def add(self, name, seconds, nbytes=0):
+        key = (name, threading.get_ident())
+        totals = self._phases.get(key)
+        if totals is None:
+            totals = self._phases[key] = [0.0, 0, 0]
+        totals[0] += seconds
+        totals[1] += 1
+        totals[2] += nbytes
+
+    def phase(self, name, nbytes=0):
+        # The returned context manager's .bytes can be set inside the block
+        # once the amount is known. Phases must not nest: code writing into
+        # a BlockCompressor leaves 'write' to it.
+        return _Phase(self, name, nbytes)
+
+    def timed(self, name, func):
+        def call(*args):
+            with _Phase(self, name, 0):
+                return func(*args)
+        return call
+
+    def set_depth(self, queue, depth):
+        current = self._queues.get(queue)
+        if current is None:
+            self._queues[queue] = [depth, depth]
+        else:
+            current[0] = depth
+            if depth > current[1]:
+                current[1] = depth
+
+    def snapshot(self):
+        phases = {}
+        for (name, thread), totals in list(self._phases.items()):
+            merged = phases.setdefault(name, {'seconds': 0.0, 'calls': 0, 'bytes': 0})
+            merged['seconds'] += totals[0]
+            merged['calls'] += totals[1]
+            merged['bytes'] += totals[2]
+        queues = {name: {'depth': depths[0], 'max': depths[1]} for name, depths in list(self._queues.items())}
+        return phases, queues
+
+
+def operation_record(operation):
+    progress = operation.progress()
+    return {
+        'time': time.time(),
+        'id': operation.id,
+        'title': operation.title,
+        'operation': getattr(operation.func, '__name__', None),
+        'state': operation.state,
+        'error': str(operation.error) if operation.error is not None else None,
+        'duration': progress.elapsed,
+        'bytes': progress.bytes_done,
+        'members': progress.members_done,
+        'bytes_per_second': progress.throughput,
+        'members_per_second': progress.member_rate,
+        'phases': progress.phases,
+        'queues': progress.queues,
+        'profile': operation.profile_path,
+    }
+
+
+def timing_record(name, seconds, **fields):
+    # Log line for a measured step that is not an Operation, such as the
+    # GUI's start-up.
+    return dict({'time': time.time(), 'operation': name, 'duration': seconds}, **fields)
+
+
+class OperationLog:
+    # One JSON line per finished operation. Past limit bytes the file is
+    # moved aside to a single .1 backup and started again.
+    def __init__(self, path, limit=LOG_LIMIT):
+        self.path = path
+        self.limit = limit
+        self._lock = threading.Lock()
+
+    def write(self, operation):
+        self.write_record(operation_record(operation))
+
+    def write_record(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.limit:
+                    os.replace(self.path, self.path + '.1')
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            except OSError:
+                # A log that cannot be written must not fail the operation.
+                pass
+
+
+class Profiler:
+    # Opt-in cProfile of every operation, saved as a .prof file for pstats
+    # or snakeviz. cProfile only sees the thread running the operation;
+    # time spent on the compression and extraction pools shows up in the
+    # phase timers instead.
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, operation):
+        name = re.sub(r'[^\w-]+', '-', getattr(operation.func, '__name__', '') or 'operation').strip('-')
+        return os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{operation.id}-{name}.prof")
+
+    @contextlib.contextmanager
+    def profile(self, operation):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this interpreter.
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            path = self.path(operation)
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                profile.dump_stats(path)
+            except OSError:
+                pass
+            else:
+                operation.profile_path = path
+
+
+class TimedFile:
+    # Books the writes to a file object to the 'write' phase; everything
+    # else passes straight through.
+    def __init__(self, fileobj, metrics):
+        self.fileobj = fileobj
+        self.metrics = metrics
+
+    def write(self, data):
+        with self.metrics.phase('write', len(data)):
+            return self.fileobj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
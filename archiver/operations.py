@@ -0,0 +1,247 @@
+import collections
+import contextlib
+import itertools
+import threading
+import time
+
+from .metrics import Metrics
+
+
+class OperationCancelled(Exception):
+    pass
+
+
+class Progress:
+    __slots__ = ('title', 'bytes_done', 'bytes_total', 'members_done', 'members_total', 'elapsed', 'phases', 'queues')
+
+    def __init__(self, title, bytes_done, bytes_total, members_done, members_total, elapsed, phases=None, queues=None):
+        self.title = title
+        self.bytes_done = bytes_done
+        self.bytes_total = bytes_total
+        self.members_done = members_done
+        self.members_total = members_total
+        self.elapsed = elapsed
+        self.phases = phases or {}
+        self.queues = queues or {}
+
+    @property
+    def throughput(self):
+        return self.bytes_done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def member_rate(self):
+        return self.members_done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def fraction(self):
+        if self.bytes_total:
+            return min(self.bytes_done / self.bytes_total, 1.0)
+        if self.members_total:
+            return min(self.members_done / self.members_total, 1.0)
+        return None
+
+    @property
+    def eta(self):
+        fraction = self.fraction
+        if not fraction or self.elapsed <= 0:
+            return None
+        return self.elapsed * (1.0 - fraction) / fraction
+
+
+def _call_now(func, *args):
+    func(*args)
+
+
+class Operation:
+    _ids = itertools.count(1)
+    report_interval = 0.1
+
+    def __init__(self, title, func, *args, key=None, **kwargs):
+        self.id = next(Operation._ids)
+        self.title = title
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.state = 'queued'
+        self.result = None
+        self.error = None
+        self.on_progress = None
+        self.on_done = None
+        self.on_error = None
+        self.on_cancel = None
+        # Called on the thread that ran the operation once it has finished,
+        # before the dispatched callbacks.
+        self.on_finish = None
+        self.metrics = Metrics()
+        self.profiler = None
+        self.profile_path = None
+        # Whether tar indexes read under this operation are saved for the
+        # next one; the engine sets it from its own setting.
+        self.tar_index_cache = True
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.members_done = 0
+        self.members_total = 0
+        self.started = None
+        self.finished = None
+        self._dispatch = _call_now
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        self._last_report = 0.0
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check(self):
+        if self._cancel_event.is_set():
+            raise OperationCancelled(self.title)
+
+    def set_total(self, bytes_total=None, members_total=None):
+        with self._lock:
+            if bytes_total is not None:
+                self.bytes_total = bytes_total
+            if members_total is not None:
+                self.members_total = members_total
+        self._report(force=True)
+
+    def add_total(self, nbytes=0, members=0):
+        with self._lock:
+            self.bytes_total += nbytes
+            self.members_total += members
+
+    def reset_progress(self):
+        with self._lock:
+            self.bytes_done = self.bytes_total = 0
+            self.members_done = self.members_total = 0
+
+    def advance(self, nbytes=0, members=0, check=True):
+        with self._lock:
+            self.bytes_done += nbytes
+            self.members_done += members
+        if check:
+            self.check()
+        self._report()
+
+    def progress(self):
+        phases, queues = self.metrics.snapshot()
+        with self._lock:
+            elapsed = (self.finished or time.monotonic()) - self.started if self.started else 0.0
+            return Progress(self.title, self.bytes_done, self.bytes_total, self.members_done, self.members_total, elapsed, phases, queues)
+
+    def _report(self, force=False):
+        if self.on_progress is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_report < self.report_interval:
+            return
+        self._last_report = now
+        self._dispatch(self.on_progress, self, self.progress())
+
+    def run(self, dispatch=_call_now):
+        self._dispatch = dispatch
+        self.started = time.monotonic()
+        self.state = 'running'
+        try:
+            self.check()
+            with self.profiler.profile(self) if self.profiler is not None else contextlib.nullcontext():
+                self.result = self.func(self, *self.args, **self.kwargs)
+        except OperationCancelled:
+            self.state = 'cancelled'
+        except Exception as e:
+            self.state = 'failed'
+            self.error = e
+        else:
+            self.state = 'done'
+        self.finished = time.monotonic()
+        if self.on_finish is not None:
+            self.on_finish(self)
+        callback = {'done': self.on_done, 'failed': self.on_error, 'cancelled': self.on_cancel}[self.state]
+        if callback is not None:
+            dispatch(callback, self)
+        return self.result
+
+
+class OperationQueue:
+    def __init__(self, dispatch=None, workers=1):
+        self.dispatch = dispatch or _call_now
+        self._pending = collections.deque()
+        self._running = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._threads = []
+        for number in range(max(1, workers)):
+            thread = threading.Thread(target=self._worker, name=f'archiver-worker-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, operation):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('operation queue is shut down')
+            self._pending.append(operation)
+            self._cond.notify()
+        return operation
+
+    @property
+    def busy(self):
+        with self._cond:
+            return bool(self._pending or self._running)
+
+    def pending(self):
+        with self._cond:
+            return list(self._running) + list(self._pending)
+
+    def cancel(self, operation):
+        with self._cond:
+            if operation in self._pending:
+                self._pending.remove(operation)
+                operation.cancel()
+                operation.state = 'cancelled'
+                if operation.on_cancel is not None:
+                    self.dispatch(operation.on_cancel, operation)
+                return
+        operation.cancel()
+
+    def cancel_all(self):
+        for operation in self.pending():
+            self.cancel(operation)
+
+    def shutdown(self, wait=True, cancel=True):
+        if cancel:
+            self.cancel_all()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _next_operation(self):
+        busy_keys = {operation.key for operation in self._running if operation.key is not None}
+        for operation in self._pending:
+            if operation.key is None or operation.key not in busy_keys:
+                self._pending.remove(operation)
+                return operation
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                operation = self._next_operation()
+                while operation is None:
+                    if self._closed and not self._pending:
+                        return
+                    self._cond.wait()
+                    operation = self._next_operation()
+                self._running.append(operation)
+            try:
+                operation.run(self.dispatch)
+            finally:
+                with self._cond:
+                    self._running.remove(operation)
+                    self._cond.notify_all()
@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+import zipfile
+import zlib
+
+from .zipwriter import METHODS
+
+SAMPLE_SIZE = 64 * 1024
+MIN_GAIN = 0.05
+# Below this size the headers alone outweigh anything compression saves.
+MIN_SIZE = 64
+# Levels used for compressed-tar blocks that turned out incompressible;
+# deflate level 0 just wraps the data in stored blocks.
+FAST_LEVELS = {'gz': 0, 'bz2': 1, 'xz': 0}
+
+STORE_EXTENSIONS = frozenset((
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'heif', 'avif', 'jxl',
+    'mp3', 'm4a', 'aac', 'ogg', 'oga', 'opus', 'flac', 'wma',
+    'mp4', 'm4v', 'mkv', 'webm', 'avi', 'mov', 'wmv', 'flv',
+    'zip', 'gz', 'tgz', 'bz2', 'tbz2', 'xz', 'txz', 'lzma', 'zst', '7z', 'rar', 'cab', 'lz4', 'br',
+    'jar', 'apk', 'aar', 'whl', 'nupkg', 'deb', 'rpm', 'dmg', 'msi',
+    'docx', 'xlsx', 'pptx', 'odt', 'ods', 'odp', 'epub',
+    'woff', 'woff2',
+))
+
+MAGIC_PREFIXES = (
+    b'\xff\xd8\xff',            # JPEG
+    b'\x89PNG\r\n\x1a\n',
+    b'GIF87a', b'GIF89a',
+    b'PK\x03\x04',              # zip and everything built on it
+    b'\x1f\x8b',                # gzip
+    b'BZh',
+    b'\xfd7zXZ\x00',
+    b'7z\xbc\xaf\x27\x1c',
+    b'Rar!\x1a\x07',
+    b'\x28\xb5\x2f\xfd',        # zstd
+    b'\x04\x22\x4d\x18',        # lz4
+    b'OggS',
+    b'fLaC',
+    b'ID3',
+    b'\x1a\x45\xdf\xa3',        # Matroska / WebM
+    b'wOFF', b'wOF2',
+)
+
+
+def extension(name):
+    return os.path.splitext(name.rstrip('/'))[1].lstrip('.').lower()
+
+
+def looks_compressed(sample):
+    if sample.startswith(MAGIC_PREFIXES):
+        return True
+    # ISO media (mp4, mov, heic) and RIFF WebP keep their tag a little later.
+    if sample[4:8] == b'ftyp':
+        return True
+    return sample[:4] == b'RIFF' and sample[8:12] == b'WEBP'
+
+
+def parse_method(value):
+    # Config values look like "lzma" or "deflated:9".
+    name, _, level = str(value).partition(':')
+    if name not in METHODS:
+        raise ValueError(f'unknown compression method {name!r}')
+    return METHODS[name], int(level) if level else None
+
+
+class CompressionReport:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self.files = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def record(self, usize, csize, compressed=True):
+        with self._lock:
+            self.files += 1
+            self.skipped += not compressed
+            self.bytes_in += usize
+            self.bytes_out += csize
+            self.finished = time.monotonic()
+
+    @property
+    def ratio(self):
+        return self.bytes_out / self.bytes_in if self.bytes_in else None
+
+    @property
+    def throughput(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.bytes_in / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            'files': self.files,
+            'skipped': self.skipped,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': self.ratio,
+            'throughput': self.throughput,
+        }
+
+
+class CompressionPolicy:
+    def __init__(self, method=zipfile.ZIP_DEFLATED, level=None, min_gain=MIN_GAIN, sample_size=SAMPLE_SIZE,
+                 store_extensions=(), methods=None):
+        self.method = method
+        self.level = level
+        self.min_gain = min_gain
+        self.sample_size = sample_size
+        self.store_extensions = STORE_EXTENSIONS | {name.lower().lstrip('.') for name in store_extensions}
+        self.methods = {name.lower().lstrip('.'): parse_method(value) for name, value in (methods or {}).items()}
+        self.report = CompressionReport()
+
+    @classmethod
+    def from_config(cls, config, method=zipfile.ZIP_DEFLATED):
+        config = config or {}
+        return cls(method, config.get('level'), config.get('min_gain', MIN_GAIN), config.get('sample_size', SAMPLE_SIZE),
+                   config.get('store_extensions', ()), config.get('methods'))
+
+    def worth_compressing(self, sample):
+        if looks_compressed(sample):
+            return False
+        sample = sample[:self.sample_size]
+        if not sample:
+            return True
+        # A level-1 deflate of the first block is a cheap stand-in for how
+        # well the whole file compresses.
+        return len(zlib.compress(sample, 1)) <= len(sample) * (1 - self.min_gain)
+
+    def choose(self, name, sample, size):
+        if self.method == zipfile.ZIP_STORED or size < MIN_SIZE:
+            return zipfile.ZIP_STORED, None
+        ext = extension(name)
+        if ext in self.methods:
+            return self.methods[ext]
+        if ext in self.store_extensions or not self.worth_compressing(sample):
+            return zipfile.ZIP_STORED, None
+        return self.method, self.level
+
+    def choose_file(self, path, name, size):
+        with open(path, 'rb') as f:
+            sample = f.read(min(size, self.sample_size))
+        return self.choose(name, sample, size)
+
+    def accept(self, usize, csize):
+        return csize <= usize * (1 - self.min_gain)
+
+    def block_level(self, data, codec, level):
+        return level if self.worth_compressing(data) else FAST_LEVELS[codec]
@@ -0,0 +1,246 @@
+import collections
+import contextlib
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+
+from .extractor import target_path
+from .index import archive_signature
+from .jobs import archive_kind
+from .search import BINARY_SNIFF
+from .tarindex import TarIndex
+from .zipreader import ZipDirectory
+
+PREVIEW_SIZE = 64 * 1024
+# Members up to this size are read whole on the first preview, so showing
+# more of them or opening them in another program needs no second pass.
+MEMORY_MEMBER_LIMIT = 1024 * 1024
+MEMORY_LIMIT = 64 * 1024 * 1024
+DISK_LIMIT = 1024 * 1024 * 1024
+COPY_BUFFER = 1024 * 1024
+HEX_WIDTH = 16
+TEXT_CONTROLS = b'\t\n\r\f\b\x1b'
+
+
+@contextlib.contextmanager
+def open_member(archive_name, name, persist=True):
+    # Yields a reader at the start of one member's data and the member's
+    # size, without touching any other member.
+    kind = archive_kind(archive_name)
+    if kind == 'zip':
+        with ZipDirectory(archive_name) as directory:
+            position = directory.find(name)
+            if position is None or directory.is_dir(position):
+                raise ValueError(f'{name!r} is not a file in {archive_name}')
+            with directory.open(position) as src:
+                yield src, directory.usizes[position]
+    elif kind == 'tar':
+        tar_index = TarIndex.load(archive_name, persist=persist)
+        position = tar_index.find(name)
+        if position is None or not tar_index.is_regular(position):
+            raise ValueError(f'{name!r} is not a file in {archive_name}')
+        if tar_index.codec is None:
+            with open(archive_name, 'rb') as src:
+                src.seek(tar_index.data_offsets[position])
+                yield src, tar_index.sizes[position]
+        else:
+            with tar_index.open() as archive, archive.extractfile(tar_index.read_tarinfo(archive, position)) as src:
+                yield src, tar_index.sizes[position]
+    else:
+        raise ValueError(f'unsupported archive type: {archive_name}')
+
+
+def _copy(op, src, dst, length):
+    while length:
+        with op.metrics.phase('read') as phase:
+            chunk = src.read(min(COPY_BUFFER, length))
+            phase.bytes = len(chunk)
+        if not chunk:
+            raise EOFError('unexpected end of archive')
+        with op.metrics.phase('write', len(chunk)):
+            dst.write(chunk)
+        op.advance(len(chunk))
+        length -= len(chunk)
+
+
+def is_text(data):
+    # UTF-8 counts as text, even when cut off mid-character at the end;
+    # other encodings do as long as control characters stay rare.
+    sample = data[:BINARY_SNIFF]
+    if b'\0' in sample:
+        return False
+    try:
+        sample.decode('utf-8')
+        return True
+    except UnicodeDecodeError as e:
+        if e.reason == 'unexpected end of data':
+            return True
+    controls = sum(1 for byte in sample if byte < 32 and byte not in TEXT_CONTROLS)
+    return controls * 20 < len(sample)
+
+
+def hex_dump(data, offset=0):
+    lines = []
+    for start in range(0, len(data), HEX_WIDTH):
+        row = data[start:start + HEX_WIDTH]
+        text = ''.join(chr(byte) if 32 <= byte < 127 else '.' for byte in row)
+        lines.append(f"{offset + start:08x}  {row.hex(' '):<{HEX_WIDTH * 3 - 1}}  {text}")
+    return '\n'.join(lines)
+
+
+def preview_text(data):
+    return data.decode('utf-8', 'replace') if is_text(data) else hex_dump(data)
+
+
+class _Entry:
+    __slots__ = ('size', 'data', 'path')
+
+    def __init__(self, size):
+        self.size = size
+        # Leading bytes read for a preview; all of them for a small member.
+        self.data = None
+        # The whole member, extracted to open it in another program.
+        self.path = None
+
+
+class PreviewCache:
+    # LRU of members opened from an archive: leading bytes in memory for
+    # the in-app preview, whole members in a temporary folder for other
+    # programs, each bounded by its own limit. A ZIP member is keyed by its
+    # CRC, so edits elsewhere in the archive keep it cached; tar headers
+    # carry no checksum, so a tar member is keyed by the archive's size and
+    # mtime instead.
+    def __init__(self, memory_limit=MEMORY_LIMIT, disk_limit=DISK_LIMIT):
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.memory_used = 0
+        self.disk_used = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._directory = None
+        self._folders = itertools.count()
+
+    def key(self, archive_name, name, crc=None):
+        archive_name = os.path.abspath(archive_name)
+        if crc is not None:
+            return archive_name, name, crc
+        return (archive_name, name) + archive_signature(archive_name)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def head(self, op, archive_name, name, limit=PREVIEW_SIZE, crc=None):
+        # The first limit bytes of a member and its size. Asking for more
+        # than is cached reads the member again from its start.
+        key = self.key(archive_name, name, crc)
+        entry = self._lookup(key)
+        if entry is not None:
+            if entry.data is not None and len(entry.data) >= min(limit, entry.size):
+                return entry.data[:limit], entry.size
+            if entry.path is not None:
+                try:
+                    with open(entry.path, 'rb') as f:
+                        return f.read(limit), entry.size
+                except OSError:
+                    pass
+        with open_member(archive_name, name, op.tar_index_cache) as (src, size):
+            wanted = size if size <= MEMORY_MEMBER_LIMIT else min(limit, size)
+            op.set_total(bytes_total=wanted, members_total=1)
+            with op.metrics.phase('read', wanted):
+                data = src.read(wanted)
+        if len(data) < wanted:
+            raise EOFError('unexpected end of archive')
+        op.advance(len(data), members=1)
+        self._store(key, size, data=data)
+        return data[:limit], size
+
+    def extract(self, op, archive_name, name, crc=None):
+        # The whole member as a file of its own, named like the member so
+        # the system picks the program that opens it.
+        key = self.key(archive_name, name, crc)
+        entry = self._lookup(key)
+        if entry is not None and entry.path is not None and os.path.exists(entry.path):
+            return entry.path
+        folder = os.path.join(self._make_directory(), str(next(self._folders)))
+        os.makedirs(folder)
+        path = target_path(folder, name.rpartition('/')[2])
+        if path == folder:
+            path = os.path.join(folder, 'member')
+        try:
+            if entry is not None and entry.data is not None and len(entry.data) == entry.size:
+                size = entry.size
+                op.set_total(bytes_total=size, members_total=1)
+                with open(path, 'wb') as dst:
+                    dst.write(entry.data)
+                op.advance(size)
+            else:
+                with open_member(archive_name, name, op.tar_index_cache) as (src, size), open(path, 'wb') as dst:
+                    op.set_total(bytes_total=size, members_total=1)
+                    _copy(op, src, dst, size)
+        except BaseException:
+            shutil.rmtree(folder, ignore_errors=True)
+            raise
+        op.advance(members=1)
+        self._store(key, size, path=path)
+        return path
+
+    def _make_directory(self):
+        with self._lock:
+            if self._directory is None:
+                self._directory = tempfile.mkdtemp(prefix='archiver-preview-')
+            return self._directory
+
+    def _store(self, key, size, data=None, path=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(size)
+            self._entries.move_to_end(key)
+            if data is not None and (entry.data is None or len(data) > len(entry.data)):
+                self.memory_used += len(data) - len(entry.data or b'')
+                entry.data = data
+            if path is not None:
+                self._drop_file(entry)
+                entry.path = path
+                self.disk_used += size
+            self._evict(key)
+
+    def _drop_file(self, entry):
+        if entry.path is not None:
+            shutil.rmtree(os.path.dirname(entry.path), ignore_errors=True)
+            self.disk_used -= entry.size
+            entry.path = None
+
+    def _evict(self, keep):
+        # Oldest first, never the entry just used: a member larger than a
+        # limit on its own still has to be shown.
+        for key in list(self._entries):
+            if self.memory_used <= self.memory_limit and self.disk_used <= self.disk_limit:
+                return
+            if key == keep:
+                continue
+            entry = self._entries[key]
+            if self.memory_used > self.memory_limit and entry.data is not None:
+                self.memory_used -= len(entry.data)
+                entry.data = None
+            if self.disk_used > self.disk_limit:
+                self._drop_file(entry)
+            if entry.data is None and entry.path is None:
+                del self._entries[key]
+
+    def clear(self):
+        # Files still open in another program may stay behind; they live in
+        # the system's temporary folder.
+        with self._lock:
+            self._entries.clear()
+            self.memory_used = 0
+            self.disk_used = 0
+            if self._directory is not None:
+                shutil.rmtree(self._directory, ignore_errors=True)
+                self._directory = None
@@ -0,0 +1,202 @@
+import os
+import tarfile
+import time
+
+from . import zipformat
+from .blockcodec import BlockCompressor
+from .metrics import Metrics
+from .tarindex import TarIndex, index_path
+
+COPY_BUFFER = 1024 * 1024
+
+
+def member_matches(name, names, prefixes):
+    if name in names:
+        return True
+    return any(name.startswith(prefix) for prefix in prefixes)
+
+
+def split_selection(selection):
+    names = set()
+    prefixes = []
+    for name in selection:
+        if name.endswith('/'):
+            prefixes.append(name)
+        names.add(name)
+    return names, tuple(prefixes)
+
+
+def copy_range(src, dst, start, length, op=None, check=True):
+    # Runs once per member on rewrites, so it reads the clock directly
+    # instead of going through metrics.phase(). A block compressor books its
+    # own waits and writes.
+    timed_write = not isinstance(dst, BlockCompressor)
+    src.seek(start)
+    while length:
+        started = time.perf_counter()
+        chunk = src.read(min(COPY_BUFFER, length))
+        if not chunk:
+            raise EOFError('unexpected end of archive')
+        read = time.perf_counter()
+        dst.write(chunk)
+        length -= len(chunk)
+        if op is not None:
+            op.metrics.add('read', read - started, len(chunk))
+            if timed_write:
+                op.metrics.add('write', time.perf_counter() - read, len(chunk))
+            op.advance(len(chunk), check=check)
+
+
+def _move_range(fp, read_position, write_position, length, op=None):
+    # In-place compaction: data only ever moves towards the start of the
+    # file, so reading ahead of the write position never clobbers input.
+    metrics = op.metrics if op is not None else Metrics()
+    while length:
+        with metrics.phase('read') as phase:
+            fp.seek(read_position)
+            chunk = fp.read(min(COPY_BUFFER, length))
+            phase.bytes = len(chunk)
+        if not chunk:
+            raise EOFError('unexpected end of archive')
+        with metrics.phase('write', len(chunk)):
+            fp.seek(write_position)
+            fp.write(chunk)
+        read_position += len(chunk)
+        write_position += len(chunk)
+        length -= len(chunk)
+        if op is not None:
+            op.advance(len(chunk), check=False)
+
+
+def zip_layout(fp):
+    end = zipformat.read_end_record(fp)
+    fp.seek(end.cd_position)
+    central = fp.read(end.cd_size)
+    records = []
+    for position, size, fields in zipformat.iter_central_directory(central):
+        record = central[position:position + size]
+        name = zipformat.decode_name(record[zipformat.CENTRAL_HEADER.size:zipformat.CENTRAL_HEADER.size + fields[12]], fields[5])
+        usize, csize, offset = zipformat.record_values(record, fields)
+        records.append([name, record, offset + end.concat, usize])
+    # A member's span runs from its local header to the next member's local
+    # header, which also picks up any data descriptor.
+    starts = sorted({record[2] for record in records} | {end.cd_position})
+    following = {start: starts[index + 1] for index, start in enumerate(starts[:-1])}
+    for record in records:
+        record.append(following[record[2]] - record[2])
+    return end, records
+
+
+def delete_zip_members(archive_name, selection, op=None, in_place=False):
+    names, prefixes = split_selection(selection)
+    with open(archive_name, 'rb') as fp:
+        end, records = zip_layout(fp)
+    kept = [record for record in records if not member_matches(record[0], names, prefixes)]
+    removed = len(records) - len(kept)
+    if not removed:
+        return 0
+    if op is not None:
+        op.set_total(bytes_total=sum(record[4] for record in kept), members_total=len(kept))
+    first = min([record[2] for record in records] + [end.cd_position])
+    if in_place:
+        with open(archive_name, 'r+b') as fp:
+            _write_zip(fp, fp, end, kept, first, op, in_place=True)
+            fp.truncate()
+        return removed
+    temp_archive = archive_name + '.tmp'
+    try:
+        with open(archive_name, 'rb') as src, open(temp_archive, 'wb') as dst:
+            _write_zip(src, dst, end, kept, first, op)
+    except BaseException:
+        _remove_quietly(temp_archive)
+        raise
+    os.replace(temp_archive, archive_name)
+    return removed
+
+
+def _write_zip(src, dst, end, kept, first, op, in_place=False):
+    if not in_place:
+        copy_range(src, dst, 0, first)
+    position = first
+    moved = {}
+    for record in sorted(kept, key=lambda record: record[2]):
+        name, raw, start, usize, length = record
+        if start not in moved:
+            moved[start] = position - end.concat
+            if in_place:
+                if start != position:
+                    _move_range(dst, start, position, length, op)
+                elif op is not None:
+                    op.advance(length, check=False)
+            else:
+                copy_range(src, dst, start, length, op)
+            position += length
+        if op is not None:
+            op.advance(members=1, check=not in_place)
+    dst.seek(position)
+    for name, raw, start, usize, length in kept:
+        dst.write(zipformat.patch_central_record(raw, offset=moved[start]))
+    cd_size = dst.tell() - position
+    dst.write(zipformat.end_records(len(kept), position - end.concat, cd_size, end.comment))
+
+
+def tar_member_matches(tar_index, position, names, prefixes):
+    name = tar_index.names[position]
+    return member_matches(name, names, prefixes) or (tar_index.is_dir(position) and name + '/' in names)
+
+
+def write_tar_end(dst, position):
+    dst.write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+    position += 2 * tarfile.BLOCKSIZE
+    remainder = position % tarfile.RECORDSIZE
+    if remainder:
+        dst.write(tarfile.NUL * (tarfile.RECORDSIZE - remainder))
+
+
+def delete_tar_members(archive_name, selection, op=None):
+    names, prefixes = split_selection(selection)
+    tar_index = TarIndex.load(archive_name, persist=op.tar_index_cache if op is not None else True)
+    kept = [span for span in tar_index.spans() if not tar_member_matches(tar_index, span[0], names, prefixes)]
+    removed = len(tar_index) - len(kept)
+    if not removed:
+        return 0
+    if op is not None:
+        op.set_total(bytes_total=sum(span[2] for span in kept), members_total=len(kept))
+    new_index = TarIndex(archive_name, tar_index.persist)
+    temp_archive = archive_name + '.tmp'
+    try:
+        if tar_index.codec is None:
+            with open(archive_name, 'rb') as src, open(temp_archive, 'wb') as dst:
+                _write_tar(src, dst, tar_index, new_index, kept, op)
+        else:
+            with tar_index.open() as src, open(temp_archive, 'wb') as dst:
+                with BlockCompressor(dst, tar_index.codec, metrics=op.metrics if op is not None else None) as compressor:
+                    _write_tar(src.fileobj, compressor, tar_index, new_index, kept, op)
+                new_index.checkpoints = compressor.checkpoints
+    except BaseException:
+        _remove_quietly(temp_archive)
+        raise
+    os.replace(temp_archive, archive_name)
+    new_index.refresh()
+    new_index.save(index_path(archive_name))
+    return removed
+
+
+def _write_tar(src, dst, tar_index, new_index, kept, op):
+    copy_range(src, dst, 0, tar_index.header_offsets[0])
+    for position, start, length in kept:
+        new_index.copy_member(tar_index, position, dst.tell())
+        copy_range(src, dst, start, length, op)
+        if op is not None:
+            op.advance(members=1)
+    new_index.end = dst.tell()
+    if isinstance(dst, BlockCompressor):
+        dst.mark()
+    write_tar_end(dst, new_index.end)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
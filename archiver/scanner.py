@@ -0,0 +1,92 @@
+import collections
+import fnmatch
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+SYMLINK_POLICIES = ('follow', 'skip', 'store')
+
+
+def compile_patterns(patterns):
+    # Patterns with a slash match the path relative to the scanned folder,
+    # the rest match the bare file or folder name, like .gitignore does.
+    patterns = tuple(patterns or ())
+    return (tuple(pattern.strip('/') for pattern in patterns if '/' in pattern),
+            tuple(pattern for pattern in patterns if '/' not in pattern))
+
+
+def matches(relative, name, patterns):
+    path_patterns, name_patterns = patterns
+    return (any(fnmatch.fnmatch(name, pattern) for pattern in name_patterns)
+            or any(fnmatch.fnmatch(relative, pattern) for pattern in path_patterns))
+
+
+def _list_directory(path, relative, symlinks):
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                child = relative + '/' + entry.name if relative else entry.name
+                try:
+                    if entry.is_symlink():
+                        if symlinks == 'skip':
+                            continue
+                        st = entry.stat(follow_symlinks=symlinks == 'follow')
+                    else:
+                        st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    # Dangling link or an entry that vanished mid-scan.
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    subdirs.append((entry.path, child, entry.name, st))
+                else:
+                    files.append((entry.path, child, entry.name, st))
+    except OSError:
+        pass
+    files.sort(key=lambda record: record[2])
+    subdirs.sort(key=lambda record: record[2])
+    return files, subdirs
+
+
+def scan_tree(folder_path, folder='', include=None, exclude=None, symlinks='follow', directories=False, workers=None, op=None):
+    if symlinks not in SYMLINK_POLICIES:
+        raise ValueError(f'unknown symlink policy {symlinks!r}')
+    include = compile_patterns(include)
+    exclude = compile_patterns(exclude)
+    filter_included = any(include)
+    workers = workers or min(32, 4 * (os.cpu_count() or 1))
+    root = os.stat(folder_path)
+    visited = {(root.st_dev, root.st_ino)}
+    with ThreadPoolExecutor(workers, thread_name_prefix='archiver-scan') as executor:
+        # Directories are listed concurrently, but results are consumed in
+        # submission order so the archive layout does not depend on timing.
+        pending = collections.deque([executor.submit(_list_directory, folder_path, '', symlinks)])
+        try:
+            while pending:
+                if op is not None:
+                    op.check()
+                    with op.metrics.phase('scan'):
+                        files, subdirs = pending.popleft().result()
+                    op.metrics.set_depth('scan', len(pending))
+                else:
+                    files, subdirs = pending.popleft().result()
+                for path, relative, name, st in subdirs:
+                    if matches(relative, name, exclude):
+                        continue
+                    key = (st.st_dev, st.st_ino)
+                    if key in visited:
+                        continue
+                    visited.add(key)
+                    pending.append(executor.submit(_list_directory, path, relative, symlinks))
+                    if directories:
+                        yield path, os.path.join(folder, relative), st
+                for path, relative, name, st in files:
+                    if matches(relative, name, exclude):
+                        continue
+                    if filter_included and not matches(relative, name, include):
+                        continue
+                    yield path, os.path.join(folder, relative), st
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,323 @@
+import bisect
+import fnmatch
+import os
+import re
+import threading
+import zipfile
+from array import array
+
+from .extractor import Handles, member_runs, run_tasks
+from .jobs import archive_kind
+from .rewrite import member_matches, split_selection, tar_member_matches
+from .tarindex import TarIndex
+
+GREP_CHUNK = 256 * 1024
+BINARY_SNIFF = 8192
+MAX_LINE = 4096
+MAX_LINE_TEXT = 200
+REGEX_SPECIAL = set('.^$*+?{}[]\\|()')
+GLOB_SPECIAL = set('*?[')
+CLASS_ESCAPES = set('dDsSwWbBAZ')
+
+
+def _longest_piece(literals):
+    pieces = [piece for literal in literals for piece in literal.split('/') if piece]
+    return max(pieces, key=len) if pieces else ''
+
+
+def glob_literals(pattern):
+    literals = []
+    current = []
+    position = 0
+    while position < len(pattern):
+        char = pattern[position]
+        if char in GLOB_SPECIAL:
+            literals.append(''.join(current))
+            current = []
+            if char == '[':
+                closing = pattern.find(']', position + 2)
+                position = closing if closing != -1 else len(pattern)
+        else:
+            current.append(char)
+        position += 1
+    literals.append(''.join(current))
+    return [literal for literal in literals if literal]
+
+
+def regex_literals(pattern):
+    # Only a conservative subset: plain runs outside of groups and
+    # alternations, minus any character made optional by a quantifier.
+    # Anything fancier simply falls back to checking every name.
+    if '|' in pattern or '(' in pattern:
+        return []
+    literals = []
+    current = []
+    position = 0
+    while position < len(pattern):
+        char = pattern[position]
+        if char == '\\':
+            # An escaped punctuation mark is itself; a class such as \d ends
+            # the run, and the other letter and digit escapes (\x41, \101,
+            # backreferences...) stand for text this does not decode.
+            escaped = pattern[position + 1:position + 2]
+            if escaped and not escaped.isalnum():
+                current.append(escaped)
+            elif escaped and escaped in CLASS_ESCAPES:
+                literals.append(''.join(current))
+                current = []
+            else:
+                return []
+            position += 2
+            continue
+        if char in REGEX_SPECIAL:
+            if char in '?*{' and current:
+                current.pop()
+            literals.append(''.join(current))
+            current = []
+            if char == '[':
+                # A ']' right after '[' or '[^' belongs to the set.
+                start = position + (3 if pattern.startswith('^', position + 1) else 2)
+                closing = pattern.find(']', start)
+                position = closing if closing != -1 else len(pattern)
+            elif char == '{':
+                # The bounds of a repeat are not text of the name.
+                closing = pattern.find('}', position + 1)
+                position = closing if closing != -1 else len(pattern)
+        else:
+            current.append(char)
+        position += 1
+    literals.append(''.join(current))
+    return [literal for literal in literals if literal]
+
+
+class NameIndex:
+    # Postings are kept per distinct, lowercased path component rather than
+    # per path: folder names repeat across millions of entries, so lookups
+    # only have to search the (much smaller) component table, and that is
+    # one newline-joined string scanned with str.find() at C speed.
+    def __init__(self, paths, items=None):
+        self.paths = paths
+        self.items = items if items is not None else paths
+        self.folded = [path.lower() for path in paths]
+        components = []
+        self.component_paths = []
+        component_ids = {}
+        for position, path in enumerate(self.folded):
+            for component in set(path.split('/')):
+                if not component:
+                    continue
+                component_id = component_ids.get(component)
+                if component_id is None:
+                    component_id = component_ids[component] = len(components)
+                    components.append(component)
+                    self.component_paths.append(array('l'))
+                self.component_paths[component_id].append(position)
+        self.components = components
+        self._blob = '\n'.join(components)
+        self._starts = array('l')
+        offset = 0
+        for component in components:
+            self._starts.append(offset)
+            offset += len(component) + 1
+
+    def __len__(self):
+        return len(self.paths)
+
+    def matching_components(self, literal):
+        blob = self._blob
+        starts = self._starts
+        found = []
+        position = blob.find(literal)
+        while position != -1:
+            component_id = bisect.bisect_right(starts, position) - 1
+            found.append(component_id)
+            if component_id + 1 >= len(starts):
+                break
+            position = blob.find(literal, starts[component_id + 1])
+        return found
+
+    def candidates(self, literal):
+        literal = literal.lower()
+        if not literal:
+            return range(len(self.paths))
+        positions = set()
+        for component_id in self.matching_components(literal):
+            positions.update(self.component_paths[component_id])
+        return sorted(positions)
+
+    def substring(self, text):
+        text = text.lower()
+        return [position for position in self.candidates(_longest_piece([text])) if text in self.folded[position]]
+
+    def glob(self, pattern):
+        regex = re.compile(fnmatch.translate(pattern.lower()))
+        by_name = '/' not in pattern
+        positions = []
+        for position in self.candidates(_longest_piece(glob_literals(pattern))):
+            path = self.folded[position].rstrip('/')
+            if regex.match(path.rpartition('/')[2] if by_name else path):
+                positions.append(position)
+        return positions
+
+    def regex(self, pattern):
+        regex = re.compile(pattern, re.IGNORECASE)
+        return [position for position in self.candidates(_longest_piece(regex_literals(pattern))) if regex.search(self.paths[position])]
+
+    def search(self, query, mode='substring'):
+        if mode == 'glob':
+            positions = self.glob(query)
+        elif mode == 'regex':
+            positions = self.regex(query)
+        else:
+            positions = self.substring(query)
+        return [self.items[position] for position in positions]
+
+
+class _Hits:
+    def __init__(self, limit, on_match):
+        self.limit = limit
+        self.on_match = on_match
+        self.hits = []
+        self.stopped = False
+        self._lock = threading.Lock()
+
+    def add(self, name, line_number, line):
+        with self._lock:
+            if self.stopped:
+                return
+            text = line[:MAX_LINE].decode('utf-8', 'replace').strip()[:MAX_LINE_TEXT]
+            hit = (name, line_number, text)
+            self.hits.append(hit)
+            if self.limit and len(self.hits) >= self.limit:
+                self.stopped = True
+        if self.on_match is not None:
+            self.on_match(hit)
+
+
+def compile_content_pattern(pattern, regex=False, ignore_case=True):
+    raw = pattern.encode('utf-8')
+    flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+    return re.compile(raw if regex else re.escape(raw), flags)
+
+
+def grep_stream(op, read, name, matcher, hits):
+    line_number = 0
+    carry = b''
+    first = True
+    while not hits.stopped:
+        chunk = read(GREP_CHUNK)
+        if first:
+            first = False
+            if b'\0' in chunk[:BINARY_SNIFF]:
+                return
+        if not chunk:
+            if carry and matcher.search(carry):
+                hits.add(name, line_number + 1, carry)
+            return
+        op.advance(len(chunk))
+        data = carry + chunk
+        cut = data.rfind(b'\n') + 1
+        block, carry = data[:cut], data[cut:]
+        if len(carry) > MAX_LINE * 64:
+            # A huge run without newlines (minified or generated text):
+            # check what we have as one line and keep going.
+            if matcher.search(carry):
+                hits.add(name, line_number + 1, carry)
+            carry = b''
+        # Most blocks have no match at all; only split into lines when the
+        # whole block does.
+        if block and matcher.search(block):
+            for line in block.split(b'\n')[:-1]:
+                line_number += 1
+                if matcher.search(line):
+                    hits.add(name, line_number, line)
+                    if hits.stopped:
+                        return
+        else:
+            line_number += block.count(b'\n')
+
+
+class _Limited:
+    def __init__(self, fileobj, size):
+        self._fileobj = fileobj
+        self._remaining = size
+
+    def read(self, size):
+        data = self._fileobj.read(min(size, self._remaining))
+        self._remaining -= len(data)
+        return data
+
+
+def grep_archive(op, archive_name, pattern, regex=False, ignore_case=True, max_hits=100, selection=None, on_match=None, workers=None):
+    workers = workers or os.cpu_count() or 1
+    matcher = compile_content_pattern(pattern, regex, ignore_case)
+    hits = _Hits(max_hits, on_match)
+    kind = archive_kind(archive_name)
+    if kind == 'zip':
+        _grep_zip(op, archive_name, matcher, hits, selection, workers)
+    elif kind == 'tar':
+        _grep_tar(op, archive_name, matcher, hits, selection, workers)
+    return hits.hits
+
+
+def _grep_zip(op, archive_name, matcher, hits, selection, workers):
+    with zipfile.ZipFile(archive_name, 'r') as archive:
+        infos = [info for info in archive.infolist() if not info.is_dir()]
+    if selection is not None:
+        names, prefixes = split_selection(selection)
+        infos = [info for info in infos if member_matches(info.filename, names, prefixes)]
+    op.set_total(bytes_total=sum(info.file_size for info in infos), members_total=len(infos))
+    handles = Handles(lambda: zipfile.ZipFile(archive_name, 'r'))
+    try:
+        run_tasks(op, [(info.compress_size, _grep_zip_member, (op, handles, info, matcher, hits)) for info in infos], workers)
+    finally:
+        handles.close()
+
+
+def _grep_zip_member(op, handles, info, matcher, hits):
+    if hits.stopped:
+        return
+    op.check()
+    with handles.get().open(info) as src:
+        grep_stream(op, src.read, info.filename, matcher, hits)
+    op.advance(members=1)
+
+
+def _grep_tar(op, archive_name, matcher, hits, selection, workers):
+    tar_index = TarIndex.load(archive_name, persist=op.tar_index_cache)
+    positions = [position for position in range(len(tar_index)) if tar_index.is_regular(position)]
+    if selection is not None:
+        names, prefixes = split_selection(selection)
+        positions = [position for position in positions if tar_member_matches(tar_index, position, names, prefixes)]
+    op.set_total(bytes_total=sum(tar_index.sizes[position] for position in positions), members_total=len(positions))
+    if tar_index.codec is not None:
+        tasks = [(size, _grep_tar_run, (op, tar_index, run, matcher, hits)) for size, run in member_runs(tar_index, positions, workers)]
+        run_tasks(op, tasks, workers)
+        return
+    handles = Handles(lambda: open(archive_name, 'rb'))
+    try:
+        run_tasks(op, [(tar_index.sizes[position], _grep_tar_member, (op, handles, tar_index, position, matcher, hits))
+                       for position in positions], workers)
+    finally:
+        handles.close()
+
+
+def _grep_tar_member(op, handles, tar_index, position, matcher, hits):
+    if hits.stopped:
+        return
+    op.check()
+    src = handles.get()
+    src.seek(tar_index.data_offsets[position])
+    grep_stream(op, _Limited(src, tar_index.sizes[position]).read, tar_index.names[position], matcher, hits)
+    op.advance(members=1)
+
+
+def _grep_tar_run(op, tar_index, positions, matcher, hits):
+    with tar_index.open() as archive:
+        for position in positions:
+            if hits.stopped:
+                return
+            op.check()
+            with archive.extractfile(tar_index.read_tarinfo(archive, position)) as src:
+                grep_stream(op, src.read, tar_index.names[position], matcher, hits)
+            op.advance(members=1)
@@ -0,0 +1,312 @@
+import itertools
+import os
+import stat
+import tarfile
+import time
+import zipfile
+
+from . import zipformat
+from .blockcodec import BlockCompressor
+from .jobs import add_to_tar, archive_kind
+from .rewrite import copy_range, zip_layout
+from .scanner import scan_tree
+from .tarindex import TarIndex, index_path
+from .zipreader import ZipDirectory
+from .zipwriter import ParallelZipWriter
+
+
+def _key(name):
+    return name.replace(os.sep, '/').strip('/')
+
+
+def _selected(key, selection):
+    for name in selection:
+        if key == name or key.startswith(name + '/'):
+            return True
+    return False
+
+
+def _record_size(st):
+    return st.st_size if st is not None and stat.S_ISREG(st.st_mode) else 0
+
+
+class Session:
+    # Edits are only journalled here; commit() replays the journal against
+    # the archive's member list and writes the result in a single pass to
+    # a temporary file that then replaces the archive atomically.
+    def __init__(self, archive_name):
+        self.archive_name = archive_name
+        self.journal = []
+
+    def __len__(self):
+        return len(self.journal)
+
+    def clear(self):
+        self.journal = []
+
+    def add_file(self, file_path, arcname):
+        self.journal.append(('add', file_path, arcname))
+
+    def add_files(self, paths, folder):
+        for file_path in paths:
+            self.add_file(file_path, os.path.join(folder, os.path.basename(file_path)))
+
+    def add_folder(self, folder_path, folder, include=None, exclude=None, symlinks='follow'):
+        self.journal.append(('add_folder', folder_path, folder, include, exclude, symlinks))
+
+    def add_members(self, source):
+        # Members of another ZIP archive, copied without recompressing.
+        self.journal.append(('add_members', source))
+
+    def mkdir(self, arcname):
+        self.journal.append(('mkdir', arcname))
+
+    def delete(self, names):
+        self.journal.append(('delete', list(names)))
+
+    def rename(self, old_name, new_name):
+        self.journal.append(('rename', old_name, new_name))
+
+    def plan(self, names, op=None):
+        # Maps the final member keys to where their data comes from: an
+        # existing member (by position, with its possibly new name), a new
+        # (path, arcname, stat) record or a member of another archive. Keys ignore trailing slashes, since
+        # tar stores folders without one.
+        state = {}
+        for position, name in enumerate(names):
+            state[_key(name)] = ('member', position, name)
+        for action in self.journal:
+            if op is not None:
+                op.check()
+            kind = action[0]
+            if kind == 'add':
+                file_path, arcname = action[1], action[2]
+                state.pop(_key(arcname), None)
+                state[_key(arcname)] = ('new', file_path, arcname, os.stat(file_path))
+            elif kind == 'add_folder':
+                for file_path, arcname, st in scan_tree(*action[1:], op=op):
+                    state.pop(_key(arcname), None)
+                    state[_key(arcname)] = ('new', file_path, arcname, st)
+            elif kind == 'add_members':
+                with ZipDirectory(action[1]) as directory:
+                    for position in range(len(directory)):
+                        name = directory.name(position)
+                        state.pop(_key(name), None)
+                        state[_key(name)] = ('copy', action[1], position, name)
+            elif kind == 'mkdir':
+                state.pop(_key(action[1]), None)
+                state[_key(action[1])] = ('new', None, action[1], None)
+            elif kind == 'delete':
+                selection = [_key(name) for name in action[1]]
+                for key in [key for key in state if _selected(key, selection)]:
+                    del state[key]
+            elif kind == 'rename':
+                old_key, new_key = _key(action[1]), _key(action[2])
+                if not old_key or not new_key or old_key == new_key:
+                    continue
+                moved = [(key, state.pop(key)) for key in [key for key in state if _selected(key, [old_key])]]
+                for key, item in moved:
+                    target = new_key + key[len(old_key):]
+                    if item[0] == 'member':
+                        name = item[2]
+                        item = ('member', item[1], target + ('/' if name.endswith('/') else ''))
+                    elif item[0] == 'copy':
+                        item = ('copy', item[1], item[2], target + ('/' if item[3].endswith('/') else ''))
+                    else:
+                        item = ('new', item[1], target + ('/' if item[2].endswith('/') else ''), item[3])
+                    state.pop(target, None)
+                    state[target] = item
+        kept = sorted((item[1], item[2]) for item in state.values() if item[0] == 'member')
+        records = [item[1:] for item in state.values() if item[0] == 'new']
+        copies = [item[1:] for item in state.values() if item[0] == 'copy']
+        return kept, records, copies
+
+    def commit(self, op, method=zipfile.ZIP_DEFLATED, policy=None):
+        kind = archive_kind(self.archive_name)
+        if kind == 'zip':
+            result = _commit_zip(op, self, method, policy)
+        elif kind == 'tar':
+            result = _commit_tar(op, self, policy)
+        else:
+            result = [], []
+        self.clear()
+        return result
+
+
+def _removed_names(names, kept):
+    survivors = {names[position] for position, name in kept if names[position] == name}
+    return [name for name in names if name not in survivors]
+
+
+def _sync_and_close(op, fp):
+    with op.metrics.phase('fsync'):
+        fp.flush()
+        os.fsync(fp.fileno())
+    fp.close()
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _commit_zip(op, session, method, policy=None):
+    archive_name = session.archive_name
+    with open(archive_name, 'rb') as fp:
+        end, layout = zip_layout(fp)
+    names = [record[0] for record in layout]
+    kept, records, copies = session.plan(names, op)
+    op.set_total(bytes_total=sum(layout[position][4] for position, name in kept) + sum(_record_size(st) for file_path, arcname, st in records),
+                 members_total=len(kept) + len(records))
+    added = []
+    temp_archive = archive_name + '.tmp'
+    try:
+        with open(archive_name, 'rb') as src:
+            dst = open(temp_archive, 'w+b')
+            try:
+                _write_zip_members(op, src, dst, end, layout, kept, added)
+                with ParallelZipWriter(dst, 'a', method=method, op=op, policy=policy) as writer:
+                    for file_path, arcname, st in records:
+                        if file_path is None:
+                            writer.add_directory(arcname, time.time())
+                        else:
+                            writer.add_file(file_path, arcname, st)
+                    _copy_members(op, writer, copies)
+                added.extend((entry.name, entry.usize, entry.mtime, entry.is_dir) for entry in writer.entries)
+            finally:
+                _sync_and_close(op, dst)
+    except BaseException:
+        _remove_quietly(temp_archive)
+        raise
+    os.replace(temp_archive, archive_name)
+    return added, _removed_names(names, kept)
+
+
+def _copy_members(op, writer, copies):
+    # Compressed data goes over as it is; the local header is written anew,
+    # so a data descriptor flag from a streamed source must not carry over.
+    for source, items in itertools.groupby(copies, key=lambda item: item[0]):
+        items = list(items)
+        with ZipDirectory(source) as directory:
+            op.add_total(sum(directory.usizes[position] for source, position, name in items), len(items))
+            for source, position, name in items:
+                entry = directory.entry(position)
+                entry.name = name
+                entry.flags &= ~zipformat.FLAG_DATA_DESCRIPTOR
+                if not name.isascii():
+                    entry.flags |= zipformat.FLAG_UTF8
+                with directory.raw_data(position) as raw:
+                    writer.add_compressed(entry, [raw])
+
+
+def append_members(op, archive_name, source):
+    # Adds every member of another ZIP archive to the end of this one in
+    # place; an interrupted append leaves the old central directory.
+    with ZipDirectory(source) as directory:
+        copies = [(source, position, directory.name(position)) for position in range(len(directory))]
+    with ParallelZipWriter(archive_name, 'a', op=op) as writer:
+        _copy_members(op, writer, copies)
+    return [(entry.name, entry.usize, entry.mtime, entry.is_dir) for entry in writer.entries]
+
+
+def _write_zip_members(op, src, dst, end, layout, kept, added):
+    first = min([record[2] for record in layout] + [end.cd_position])
+    copy_range(src, dst, 0, first)
+    moved = {}
+    central = []
+    for position, name in sorted(kept, key=lambda item: layout[item[0]][2]):
+        old_name, raw, start, usize, length = layout[position]
+        if start not in moved:
+            moved[start] = dst.tell() - end.concat
+            if name == old_name:
+                copy_range(src, dst, start, length, op)
+            else:
+                src.seek(start)
+                header = src.read(zipformat.LOCAL_HEADER.size)
+                fields = zipformat.LOCAL_HEADER.unpack(header)
+                if fields[0] != zipformat.LOCAL_SIGNATURE:
+                    raise zipfile.BadZipFile(f'Bad magic number for file header of {old_name!r}')
+                header_size = zipformat.LOCAL_HEADER.size + fields[10] + fields[11]
+                header += src.read(header_size - len(header))
+                dst.write(zipformat.patch_local_header(header, name))
+                copy_range(src, dst, start + header_size, length - header_size, op)
+        central.append((position, name))
+        if name != old_name:
+            fields = zipformat.CENTRAL_HEADER.unpack_from(raw)
+            added.append((name, usize, zipformat.dos_timestamp(zipformat.unpack_dos_datetime(fields[7], fields[8])), name.endswith('/')))
+        op.advance(members=1)
+    cd_position = dst.tell()
+    for position, name in sorted(central):
+        old_name, raw, start = layout[position][:3]
+        dst.write(zipformat.patch_central_record(raw, offset=moved[start], name=name if name != old_name else None))
+    cd_size = dst.tell() - cd_position
+    dst.write(zipformat.end_records(len(central), cd_position - end.concat, cd_size, end.comment))
+
+
+def _commit_tar(op, session, policy=None):
+    archive_name = session.archive_name
+    tar_index = TarIndex.load(archive_name, persist=op.tar_index_cache)
+    spans = {position: (start, length) for position, start, length in tar_index.spans()}
+    kept, records, copies = session.plan(tar_index.names, op)
+    if copies:
+        raise ValueError('only ZIP members can be copied between archives')
+    op.set_total(bytes_total=sum(spans[position][1] for position, name in kept) + sum(_record_size(st) for file_path, arcname, st in records),
+                 members_total=len(kept) + len(records))
+    new_index = TarIndex(archive_name, tar_index.persist)
+    added = []
+    temp_archive = archive_name + '.tmp'
+    try:
+        with tar_index.open() as src:
+            fp = open(temp_archive, 'wb')
+            try:
+                if tar_index.codec is None:
+                    _write_tar(op, src, fp, tar_index, new_index, spans, kept, records, added)
+                else:
+                    with BlockCompressor(fp, tar_index.codec, policy=policy, metrics=op.metrics) as compressor:
+                        _write_tar(op, src, compressor, tar_index, new_index, spans, kept, records, added)
+                    new_index.checkpoints = compressor.checkpoints
+            finally:
+                _sync_and_close(op, fp)
+    except BaseException:
+        _remove_quietly(temp_archive)
+        raise
+    os.replace(temp_archive, archive_name)
+    # The index of everything up to the new members is already known; only
+    # the freshly written tail still has to be read back.
+    new_index.refresh()
+    if not new_index.extend():
+        new_index = TarIndex.scan(archive_name, persist=tar_index.persist)
+    new_index.save(index_path(archive_name))
+    return added, _removed_names(tar_index.names, kept)
+
+
+def _write_tar(op, src, dst, tar_index, new_index, spans, kept, records, added):
+    for position, name in kept:
+        start, length = spans[position]
+        header_offset = dst.tell()
+        new_index.copy_member(tar_index, position, header_offset)
+        if name == tar_index.names[position]:
+            copy_range(src.fileobj, dst, start, length, op)
+        else:
+            tarinfo = tar_index.read_tarinfo(src, position)
+            tarinfo.name = name
+            # A pax 'path' record would otherwise win over the new name.
+            tarinfo.pax_headers.pop('path', None)
+            header = tarinfo.tobuf(src.format, src.encoding, src.errors)
+            dst.write(header)
+            data_offset = tar_index.data_offsets[position]
+            copy_range(src.fileobj, dst, data_offset, start + length - data_offset, op)
+            new_index.names[-1] = name
+            new_index.data_offsets[-1] = header_offset + len(header)
+            added.append((name, tar_index.sizes[position], tar_index.mtimes[position], tar_index.is_dir(position)))
+        op.advance(members=1)
+    new_index.end = dst.tell()
+    if isinstance(dst, BlockCompressor):
+        dst.mark()
+    archive = tarfile.open(fileobj=dst, mode='w')
+    add_to_tar(op, archive, records, added)
+    if isinstance(dst, BlockCompressor):
+        dst.mark()
+    archive.close()
@@ -0,0 +1,97 @@
+import argparse
+import os
+import stat
+import sys
+import tarfile
+import time
+import zipfile
+
+from .blockcodec import BlockCompressor, TAR_SUFFIXES
+from .jobs import add_to_tar, counted_records
+from .operations import Operation
+from .policy import parse_method
+from .scanner import SYMLINK_POLICIES, scan_tree
+from .metrics import TimedFile
+from .zipwriter import ParallelZipWriter, StreamSink
+
+FORMATS = {'zip': None, 'tar': None}
+FORMATS.update((suffix.lstrip('.'), codec) for suffix, codec in TAR_SUFFIXES.items())
+
+
+def stream_records(paths, symlinks='follow', op=None):
+    for path in paths:
+        st = os.stat(path) if symlinks == 'follow' else os.lstat(path)
+        if symlinks == 'skip' and stat.S_ISLNK(st.st_mode):
+            continue
+        name = os.path.basename(os.path.normpath(path))
+        yield path, name, st
+        if stat.S_ISDIR(st.st_mode):
+            yield from scan_tree(path, name, symlinks=symlinks, directories=True, op=op)
+
+
+def write_stream(op, fileobj, archive_format, records, method=zipfile.ZIP_DEFLATED, level=None, policy=None):
+    # Only ever writes forward, so fileobj can be a pipe or a socket; records
+    # are consumed as they come and memory stays bounded however big the
+    # archive gets.
+    if archive_format not in FORMATS:
+        raise ValueError(f'unknown archive format {archive_format!r}')
+    records = counted_records(op, records)
+    if archive_format == 'zip':
+        with ParallelZipWriter(fileobj, 'w', method=method, level=level, op=op, policy=policy) as writer:
+            for file_path, arcname, st in records:
+                if file_path is None:
+                    writer.add_directory(arcname, time.time())
+                else:
+                    writer.add_file(file_path, arcname, st)
+        return [(entry.name, entry.usize, entry.mtime, entry.is_dir) for entry in writer.entries]
+    added = []
+    sink = StreamSink(fileobj)
+    codec = FORMATS[archive_format]
+    if codec is None:
+        archive = tarfile.open(fileobj=TimedFile(sink, op.metrics), mode='w')
+        add_to_tar(op, archive, records, added)
+        archive.close()
+    else:
+        with BlockCompressor(sink, codec, level, policy=policy, metrics=op.metrics) as compressor:
+            archive = tarfile.open(fileobj=compressor, mode='w')
+            add_to_tar(op, archive, records, added)
+            archive.close()
+    sink.flush()
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m archiver.stream',
+                                     description='Write an archive of the given files and folders to a file or to stdout.')
+    parser.add_argument('paths', nargs='+', metavar='PATH')
+    parser.add_argument('-f', '--format', default='zip', choices=sorted(FORMATS))
+    parser.add_argument('-m', '--method', default='deflated', help='ZIP method with an optional level, e.g. deflated:9; '
+                                                                  'for compressed tar formats only the level is used')
+    parser.add_argument('-o', '--output', default='-', help="output file, '-' (the default) for stdout")
+    parser.add_argument('--symlinks', default='follow', choices=SYMLINK_POLICIES)
+    args = parser.parse_args(argv)
+    try:
+        method, level = parse_method(args.method)
+    except ValueError as e:
+        parser.error(str(e))
+    output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    try:
+        op = Operation('stream', None)
+        write_stream(op, output, args.format, stream_records(args.paths, args.symlinks, op), method, level)
+        output.flush()
+    except BrokenPipeError:
+        # The reading end went away; Python would otherwise complain again
+        # while flushing stdout at exit.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except (OSError, ValueError, tarfile.TarError, zipfile.LargeZipFile) as e:
+        print(f'{parser.prog}: {e}', file=sys.stderr)
+        return 1
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import os
+import stat
+import zipfile
+import zlib
+
+from .jobs import add_items, archive_kind, create_archive
+from .scanner import scan_tree
+from .session import Session, append_members
+from .tarindex import TarIndex
+from .zipreader import ZipDirectory
+
+HASH_BUFFER = 1024 * 1024
+# DOS timestamps only have two-second resolution, tar headers one second.
+MTIME_SLACK = {'zip': 2, 'tar': 1}
+SPOOL_SUFFIX = '.sync.zip'
+
+
+class _Entry:
+    __slots__ = ('size', 'mtime', 'crc', 'position', 'count')
+
+    def __init__(self, size, mtime, crc=None, position=None):
+        self.size = size
+        self.mtime = mtime
+        self.crc = crc
+        self.position = position
+        self.count = 1
+
+
+def archive_entries(archive_name, tar_index=None):
+    entries = {}
+    kind = archive_kind(archive_name)
+    if kind == 'zip':
+        with ZipDirectory(archive_name) as directory:
+            rows = [(directory.name(position), directory.usizes[position], directory.mtime(position), directory.crcs[position], None)
+                    for position in range(len(directory))]
+    elif kind == 'tar':
+        rows = [(name, tar_index.sizes[position], tar_index.mtimes[position], None, position)
+                for position, name in enumerate(tar_index.names)]
+    else:
+        rows = []
+    for name, size, mtime, crc, position in rows:
+        entry = entries.get(name)
+        if entry is None:
+            entries[name] = _Entry(size, mtime, crc, position)
+        else:
+            entry.count += 1
+    return entries
+
+
+def file_crc(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_BUFFER)
+            if not chunk:
+                return crc
+            crc = zlib.crc32(chunk, crc)
+
+
+def tar_member_crc(tar_index, position):
+    crc = 0
+    with tar_index.open() as archive, archive.extractfile(tar_index.read_tarinfo(archive, position)) as src:
+        while True:
+            chunk = src.read(HASH_BUFFER)
+            if not chunk:
+                return crc
+            crc = zlib.crc32(chunk, crc)
+
+
+def is_unchanged(entry, file_path, st, slack, tar_index=None, use_hash=False):
+    if entry.count > 1 or (stat.S_ISREG(st.st_mode) and entry.size != st.st_size):
+        return False
+    if entry.mtime is not None and abs(entry.mtime - st.st_mtime) <= slack:
+        return True
+    if not use_hash:
+        return False
+    if entry.crc is None:
+        entry.crc = tar_member_crc(tar_index, entry.position)
+    return entry.crc == file_crc(file_path)
+
+
+class _Diff:
+    # Passes on the new and changed files of a folder walk as they come,
+    # noting what was seen so stale members can be listed once it is over.
+    def __init__(self, entries, slack, tar_index=None, use_hash=False):
+        self.entries = entries
+        self.slack = slack
+        self.tar_index = tar_index
+        self.use_hash = use_hash
+        self.seen = set()
+        self.directories = set()
+        self.replaced = []
+
+    def changes(self, records):
+        for file_path, arcname, st in records:
+            name = arcname.replace(os.sep, '/')
+            if stat.S_ISDIR(st.st_mode):
+                self.directories.add(name)
+                continue
+            self.seen.add(name)
+            entry = self.entries.get(name)
+            if entry is not None:
+                if is_unchanged(entry, file_path, st, self.slack, self.tar_index, self.use_hash):
+                    continue
+                self.replaced.append(name)
+            yield file_path, arcname, st
+
+    def removed(self, prefix, delete_missing=False):
+        removed = list(self.replaced)
+        if delete_missing:
+            for name in self.entries:
+                if not name.startswith(prefix) or name in self.seen:
+                    continue
+                if name.rstrip('/') in self.directories:
+                    continue
+                removed.append(name)
+        return removed
+
+
+def sync_folder(op, archive_name, folder_path, folder, method=zipfile.ZIP_DEFLATED, delete_missing=False, use_hash=False,
+                include=None, exclude=None, symlinks='follow', policy=None, workers=None):
+    # Only names under the folder are compared, so a sibling that merely
+    # starts with the same characters is never touched.
+    folder = folder.replace(os.sep, '/').strip('/')
+    prefix = folder + '/' if folder else ''
+    kind = archive_kind(archive_name)
+    tar_index = TarIndex.load(archive_name, persist=op.tar_index_cache) if kind == 'tar' else None
+    diff = _Diff(archive_entries(archive_name, tar_index), MTIME_SLACK.get(kind, 2), tar_index, use_hash)
+    diff.directories.add(folder)
+    changes = diff.changes(scan_tree(folder_path, folder, include, exclude, symlinks, directories=True, op=op))
+    if kind == 'zip':
+        return _sync_zip(op, archive_name, diff, changes, prefix, method, delete_missing, policy, workers)
+    pending = list(changes)
+    removed = diff.removed(prefix, delete_missing)
+    if not removed:
+        return (add_items(op, archive_name, pending, method, policy, workers) if pending else []), []
+    # Replacing and dropping members happens in one pass over a temporary
+    # file, so a failed or cancelled sync leaves the archive as it was.
+    session = Session(archive_name)
+    session.delete(removed)
+    for file_path, arcname, st in pending:
+        session.add_file(file_path, arcname)
+    op.reset_progress()
+    return session.commit(op, method, policy)
+
+
+def _sync_zip(op, archive_name, diff, changes, prefix, method, delete_missing=False, policy=None, workers=None):
+    # Changed files are compressed into a spool archive while the walk is
+    # still going; which old members go away is only known once it is
+    # over. The spool's members are then copied over without recompressing,
+    # in place when nothing has to go and in one atomic rewrite otherwise.
+    spool = archive_name + SPOOL_SUFFIX
+    create_archive(spool)
+    try:
+        added = add_items(op, spool, changes, method, policy, workers)
+        removed = diff.removed(prefix, delete_missing)
+        op.reset_progress()
+        if not removed:
+            return (append_members(op, archive_name, spool) if added else []), []
+        session = Session(archive_name)
+        session.delete(removed)
+        session.add_members(spool)
+        return session.commit(op, method, policy)
+    finally:
+        _remove_quietly(spool)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,290 @@
+import contextlib
+import hashlib
+import json
+import os
+import struct
+import tarfile
+from array import array
+
+from .blockcodec import BlockReader, tar_codec
+
+MAGIC = b'ARTIDX1\n'
+HEADER_LENGTH = struct.Struct('<I')
+INDEX_SUFFIX = '.index'
+REGULAR_TYPES = frozenset(member_type[0] for member_type in tarfile.REGULAR_TYPES)
+
+
+def default_cache_dir():
+    base = os.getenv('LOCALAPPDATA') or os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'Archiver', 'tarindex')
+
+
+def index_path(archive_name, cache_dir=None, sidecar=False):
+    if sidecar:
+        return archive_name + INDEX_SUFFIX
+    key = hashlib.sha1(os.path.abspath(archive_name).encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(cache_dir or default_cache_dir(), key + INDEX_SUFFIX)
+
+
+def _block_hash(fp, offset):
+    fp.seek(offset)
+    return hashlib.sha1(fp.read(tarfile.BLOCKSIZE)).hexdigest()
+
+
+@contextlib.contextmanager
+def open_tar(archive_name, checkpoints=None):
+    codec = tar_codec(archive_name)
+    if codec is None:
+        with tarfile.open(archive_name, 'r:') as archive:
+            yield archive
+    else:
+        with BlockReader(archive_name, codec, checkpoints) as reader, tarfile.open(fileobj=reader, mode='r:') as archive:
+            yield archive
+
+
+class TarIndex:
+    def __init__(self, archive_name, persist=True):
+        self.archive_name = archive_name
+        # Whether save() keeps the index on disk between runs; off, every
+        # archive is scanned again the first time an operation needs it.
+        self.persist = persist
+        self.names = []
+        self.header_offsets = array('Q')
+        self.data_offsets = array('Q')
+        self.sizes = array('Q')
+        self.mtimes = array('q')
+        self.types = bytearray()
+        self.end = 0
+        self.size = 0
+        self.mtime_ns = 0
+        self.inode = None
+        self.head_hash = ''
+        self.tail_hash = ''
+        self.codec = tar_codec(archive_name)
+        self.checkpoints = []
+        self._positions = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def is_dir(self, position):
+        return self.types[position] == tarfile.DIRTYPE[0]
+
+    def is_regular(self, position):
+        return self.types[position] in REGULAR_TYPES
+
+    def find(self, name):
+        if self._positions is None:
+            self._positions = {member_name: position for position, member_name in enumerate(self.names)}
+        return self._positions.get(name.rstrip('/'))
+
+    def entries(self):
+        for position, name in enumerate(self.names):
+            yield name, self.sizes[position], self.mtimes[position], self.is_dir(position)
+
+    def read_tarinfo(self, archive, position):
+        # Jump straight to the member's header instead of walking the
+        # archive; tarfile then parses it exactly as it would have.
+        archive.fileobj.seek(self.header_offsets[position])
+        archive.offset = self.header_offsets[position]
+        tarinfo = archive.tarinfo.fromtarfile(archive)
+        archive.offset = tarinfo.offset_data
+        return tarinfo
+
+    def spans(self):
+        for position, start in enumerate(self.header_offsets):
+            stop = self.header_offsets[position + 1] if position + 1 < len(self.header_offsets) else self.end
+            yield position, start, stop - start
+
+    def copy_member(self, other, position, header_offset):
+        self.names.append(other.names[position])
+        self.header_offsets.append(header_offset)
+        self.data_offsets.append(other.data_offsets[position] - other.header_offsets[position] + header_offset)
+        self.sizes.append(other.sizes[position])
+        self.mtimes.append(other.mtimes[position])
+        self.types.append(other.types[position])
+        self._positions = None
+
+    def add(self, name, header_offset, data_offset, size, mtime, member_type):
+        self.names.append(name)
+        self.header_offsets.append(header_offset)
+        self.data_offsets.append(data_offset)
+        self.sizes.append(size)
+        self.mtimes.append(int(mtime))
+        self.types.append(member_type[0])
+        self._positions = None
+
+    def end_offset(self):
+        # Compressed offset of the block holding the end-of-archive marker,
+        # when that marker sits in a block of its own and can be replaced.
+        for offset, position in reversed(self.checkpoints):
+            if position == self.end:
+                return offset
+            if position < self.end:
+                break
+        return None
+
+    def _tail_anchor(self):
+        if self.codec is None:
+            return self.header_offsets[-1] if self.header_offsets else None
+        offset = self.end_offset()
+        return offset - tarfile.BLOCKSIZE if offset and offset >= tarfile.BLOCKSIZE else None
+
+    def open(self):
+        return open_tar(self.archive_name, self.checkpoints)
+
+    def _scan(self, archive, start=0, op=None):
+        if start:
+            archive.firstmember = None
+            archive.offset = start
+            archive.fileobj.seek(start)
+        while True:
+            tarinfo = archive.next()
+            if tarinfo is None:
+                break
+            self.names.append(tarinfo.name)
+            self.header_offsets.append(tarinfo.offset)
+            self.data_offsets.append(tarinfo.offset_data)
+            self.sizes.append(tarinfo.size)
+            self.mtimes.append(int(tarinfo.mtime))
+            self.types.append(tarinfo.type[0])
+            archive.members = []
+            if op is not None and len(self.names) % 1024 == 0:
+                op.advance(members=1024)
+        self.end = archive.offset
+        if self.codec is not None:
+            self.checkpoints = archive.fileobj.checkpoints
+        self._positions = None
+
+    def refresh(self):
+        stat = os.stat(self.archive_name)
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.inode = stat.st_ino
+        with open(self.archive_name, 'rb') as fp:
+            self.head_hash = _block_hash(fp, 0)
+            anchor = self._tail_anchor()
+            self.tail_hash = _block_hash(fp, anchor) if anchor is not None else ''
+
+    @classmethod
+    def scan(cls, archive_name, op=None, persist=True):
+        index = cls(archive_name, persist)
+        with index.open() as archive:
+            index._scan(archive, op=op)
+        index.refresh()
+        return index
+
+    def unchanged(self, stat):
+        # Size and mtime alone miss a rewrite that keeps both; the inode and
+        # the blocks extend() anchors on catch most of those cheaply.
+        if (self.size, self.mtime_ns, self.inode) != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            return False
+        with open(self.archive_name, 'rb') as fp:
+            if _block_hash(fp, 0) != self.head_hash:
+                return False
+            anchor = self._tail_anchor()
+            return anchor is None or _block_hash(fp, anchor) == self.tail_hash
+
+    @classmethod
+    def load(cls, archive_name, cache_dir=None, sidecar=False, op=None, persist=True):
+        if not persist:
+            return cls.scan(archive_name, op, persist)
+        path = index_path(archive_name, cache_dir, sidecar)
+        index = cls.read(path, archive_name)
+        if index is not None and index.unchanged(os.stat(archive_name)):
+            return index
+        if index is not None and index.extend(op):
+            index.save(path)
+            return index
+        index = cls.scan(archive_name, op)
+        index.save(path)
+        return index
+
+    def extend(self, op=None):
+        # An archive that was only appended to keeps its first header and
+        # the header of our last known member (for compressed archives, the
+        # block before the end marker); scan just the new tail.
+        if self.codec is None and os.path.getsize(self.archive_name) < self.end:
+            return False
+        anchor = self._tail_anchor()
+        if self.codec is not None and anchor is None and self.end:
+            return False
+        with open(self.archive_name, 'rb') as fp:
+            if _block_hash(fp, 0) != self.head_hash:
+                return False
+            if anchor is not None and _block_hash(fp, anchor) != self.tail_hash:
+                return False
+        with self.open() as archive:
+            if self.end:
+                self._scan(archive, self.end, op)
+            else:
+                self._scan(archive, op=op)
+        self.refresh()
+        return True
+
+    def save(self, path):
+        if not self.persist:
+            return
+        meta = {
+            'size': self.size,
+            'mtime_ns': self.mtime_ns,
+            'inode': self.inode,
+            'head_hash': self.head_hash,
+            'tail_hash': self.tail_hash,
+            'end': self.end,
+            'count': len(self.names),
+            'codec': self.codec,
+            'checkpoints': self.checkpoints,
+        }
+        meta_bytes = json.dumps(meta).encode('utf-8')
+        names = '\0'.join(self.names).encode('utf-8', 'surrogateescape')
+        temp_path = path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(MAGIC)
+                f.write(HEADER_LENGTH.pack(len(meta_bytes)))
+                f.write(meta_bytes)
+                for values in (self.header_offsets, self.data_offsets, self.sizes, self.mtimes):
+                    f.write(values.tobytes())
+                f.write(bytes(self.types))
+                f.write(names)
+            os.replace(temp_path, path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    @classmethod
+    def read(cls, path, archive_name):
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    return None
+                meta = json.loads(f.read(HEADER_LENGTH.unpack(f.read(HEADER_LENGTH.size))[0]))
+                index = cls(archive_name)
+                count = meta['count']
+                for values in (index.header_offsets, index.data_offsets, index.sizes, index.mtimes):
+                    values.frombytes(f.read(count * values.itemsize))
+                index.types = bytearray(f.read(count))
+                names = f.read().decode('utf-8', 'surrogateescape')
+        except (OSError, ValueError, KeyError, struct.error):
+            return None
+        index.names = names.split('\0') if count else []
+        if len(index.names) != count or len(index.types) != count:
+            return None
+        index.size = meta['size']
+        index.mtime_ns = meta['mtime_ns']
+        index.inode = meta.get('inode')
+        index.head_hash = meta['head_hash']
+        index.tail_hash = meta['tail_hash']
+        index.end = meta['end']
+        if meta.get('codec') != index.codec:
+            return None
+        index.checkpoints = [tuple(checkpoint) for checkpoint in meta.get('checkpoints', ())]
+        return index
+
+
+def load_tar_index(op, archive_name, cache_dir=None, persist=True):
+    return TarIndex.load(archive_name, cache_dir, op=op, persist=persist)
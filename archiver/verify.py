@@ -0,0 +1,247 @@
+import bz2
+import lzma
+import os
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+
+from .extractor import Handles, member_runs, run_tasks
+from .jobs import archive_kind
+from .tarindex import TarIndex
+from .zipreader import FLAG_ENCRYPTED, ZipDirectory
+
+TEST_CHUNK = 256 * 1024
+# Cap on what one decompress call may produce, so a member that inflates
+# enormously is still checked in bounded memory.
+OUTPUT_LIMIT = 4 * 1024 * 1024
+TEST_ERRORS = (zipfile.BadZipFile, tarfile.TarError, zlib.error, lzma.LZMAError, EOFError, OSError, ValueError,
+               NotImplementedError)
+
+
+class TestReport:
+    def __init__(self, archive_name):
+        self.archive_name = archive_name
+        self.members = 0
+        self.bytes = 0
+        self.failures = []
+        self.started = time.monotonic()
+        self.finished = None
+        self.first_error = None
+        self._lock = threading.Lock()
+
+    @property
+    def ok(self):
+        return not self.failures
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self):
+        elapsed = self.elapsed
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def passed(self, nbytes):
+        with self._lock:
+            self.members += 1
+            self.bytes += nbytes
+
+    def fail(self, name, message):
+        with self._lock:
+            if self.first_error is None:
+                self.first_error = time.monotonic() - self.started
+            self.failures.append((name, message))
+
+
+def test_archive(op, archive_name, workers=None):
+    workers = workers or os.cpu_count() or 1
+    report = TestReport(archive_name)
+    kind = archive_kind(archive_name)
+    try:
+        if kind == 'zip':
+            _test_zip(op, archive_name, report, workers)
+        elif kind == 'tar':
+            _test_tar(op, archive_name, report, workers)
+    except TEST_ERRORS as e:
+        # The member list itself could not be read.
+        report.fail('', str(e))
+    report.finished = time.monotonic()
+    report.failures.sort()
+    return report
+
+
+class _LZMADecompressor:
+    # A ZIP LZMA member: a version and a properties header, then raw LZMA1.
+    # Unlike zipfile.LZMADecompressor this takes max_length, so output
+    # stays bounded like it does for the other methods.
+    def __init__(self):
+        self._header = b''
+        self._decompressor = None
+
+    @property
+    def eof(self):
+        return self._decompressor is not None and self._decompressor.eof
+
+    @property
+    def needs_input(self):
+        return self._decompressor is None or self._decompressor.needs_input
+
+    def decompress(self, data, max_length=-1):
+        if self._decompressor is None:
+            self._header += data
+            if len(self._header) < 4:
+                return b''
+            size = int.from_bytes(self._header[2:4], 'little')
+            if len(self._header) < 4 + size:
+                return b''
+            properties = self._header[4:4 + size]
+            data = self._header[4 + size:]
+            self._header = b''
+            self._decompressor = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=[
+                lzma._decode_filter_properties(lzma.FILTER_LZMA1, properties)])
+        return self._decompressor.decompress(data, max_length)
+
+
+def _zip_decompressor(method):
+    if method == zipfile.ZIP_DEFLATED:
+        return zlib.decompressobj(-15)
+    if method == zipfile.ZIP_BZIP2:
+        return bz2.BZ2Decompressor()
+    if method == zipfile.ZIP_LZMA:
+        return _LZMADecompressor()
+    raise NotImplementedError(f'compression method {method} is not supported')
+
+
+def _inflate(decompressor, chunk):
+    if isinstance(decompressor, type(zlib.decompressobj())):
+        data = decompressor.decompress(chunk, OUTPUT_LIMIT)
+        yield data
+        while decompressor.unconsumed_tail:
+            yield decompressor.decompress(decompressor.unconsumed_tail, OUTPUT_LIMIT)
+    else:
+        yield decompressor.decompress(chunk, OUTPUT_LIMIT)
+        while not decompressor.eof and not decompressor.needs_input:
+            yield decompressor.decompress(b'', OUTPUT_LIMIT)
+
+
+def _test_zip(op, archive_name, report, workers):
+    with ZipDirectory(archive_name) as directory:
+        if directory.end.count not in (len(directory), 0xFFFF):
+            report.fail('', f'central directory lists {len(directory)} entries, end record says {directory.end.count}')
+        positions = [position for position in range(len(directory)) if not directory.is_dir(position)]
+        op.set_total(bytes_total=sum(directory.csizes[position] for position in positions), members_total=len(positions))
+        # The map is shared by every worker; reads from it need no locking.
+        run_tasks(op, [(directory.csizes[position], _test_zip_member, (op, directory, position, report)) for position in positions],
+                  workers)
+
+
+def _test_zip_member(op, directory, position, report):
+    op.check()
+    try:
+        _check_zip_member(op, directory, position)
+    except TEST_ERRORS as e:
+        report.fail(directory.name(position), str(e))
+    else:
+        report.passed(directory.usizes[position])
+    op.advance(members=1)
+
+
+def _check_zip_member(op, directory, position):
+    if directory.flags[position] & FLAG_ENCRYPTED:
+        raise NotImplementedError('encrypted members cannot be tested')
+    csize = directory.csizes[position]
+    method = directory.methods[position]
+    data = directory.raw_data(position)
+    try:
+        if len(data) != csize:
+            raise zipfile.BadZipFile('member data is truncated')
+        decompressor = None if method == zipfile.ZIP_STORED else _zip_decompressor(method)
+        crc = 0
+        length = 0
+        for offset in range(0, csize, TEST_CHUNK):
+            op.check()
+            chunk = data[offset:offset + TEST_CHUNK]
+            if decompressor is None:
+                crc = zlib.crc32(chunk, crc)
+                length += len(chunk)
+            else:
+                if decompressor.eof:
+                    break
+                for piece in _inflate(decompressor, chunk):
+                    crc = zlib.crc32(piece, crc)
+                    length += len(piece)
+            op.advance(len(chunk), check=False)
+        if decompressor is not None and not decompressor.eof:
+            raise zipfile.BadZipFile('compressed data ends early')
+    finally:
+        data.release()
+    if length != directory.usizes[position]:
+        raise zipfile.BadZipFile(f'size is {length}, expected {directory.usizes[position]}')
+    if crc != directory.crcs[position]:
+        raise zipfile.BadZipFile(f'bad CRC-32: {crc:08x}, expected {directory.crcs[position]:08x}')
+
+
+def _test_tar(op, archive_name, report, workers):
+    tar_index = TarIndex.load(archive_name, persist=op.tar_index_cache)
+    positions = list(range(len(tar_index)))
+    op.set_total(bytes_total=sum(tar_index.sizes[position] for position in positions if tar_index.is_regular(position)),
+                 members_total=len(positions))
+    if tar_index.codec is not None:
+        run_tasks(op, [(size, _test_tar_run, (op, tar_index, run, report)) for size, run in member_runs(tar_index, positions, workers)],
+                  workers)
+        return
+    handles = Handles(lambda: open(archive_name, 'rb'))
+    try:
+        run_tasks(op, [(tar_index.sizes[position], _test_plain_tar_member, (op, handles, tar_index, position, report))
+                       for position in positions], workers)
+    finally:
+        handles.close()
+
+
+def _read_through(op, read, size):
+    remaining = size
+    while remaining:
+        op.check()
+        chunk = read(min(TEST_CHUNK, remaining))
+        if not chunk:
+            raise tarfile.ReadError(f'data is truncated, {remaining} of {size} bytes missing')
+        remaining -= len(chunk)
+        op.advance(len(chunk), check=False)
+
+
+def _test_plain_tar_member(op, handles, tar_index, position, report):
+    op.check()
+    src = handles.get()
+    try:
+        src.seek(tar_index.header_offsets[position])
+        # frombuf() verifies the header checksum.
+        tarfile.TarInfo.frombuf(src.read(tarfile.BLOCKSIZE), tarfile.ENCODING, 'surrogateescape')
+        if tar_index.is_regular(position):
+            src.seek(tar_index.data_offsets[position])
+            _read_through(op, src.read, tar_index.sizes[position])
+    except TEST_ERRORS as e:
+        report.fail(tar_index.names[position], str(e))
+    else:
+        report.passed(tar_index.sizes[position])
+    op.advance(members=1)
+
+
+def _test_tar_run(op, tar_index, positions, report):
+    # Stream CRCs are checked by the decompressor as each block ends; once
+    # a block is damaged the rest of the run cannot be trusted either.
+    with tar_index.open() as archive:
+        for position in positions:
+            op.check()
+            try:
+                tarinfo = tar_index.read_tarinfo(archive, position)
+                if tarinfo.isreg():
+                    with archive.extractfile(tarinfo) as src:
+                        _read_through(op, src.read, tarinfo.size)
+            except TEST_ERRORS as e:
+                report.fail(tar_index.names[position], str(e))
+                return
+            report.passed(tar_index.sizes[position])
+            op.advance(members=1)
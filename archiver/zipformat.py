@@ -0,0 +1,295 @@
+import struct
+import time
+import zipfile
+
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+END_RECORD = struct.Struct('<4s4H2LH')
+ZIP64_END_RECORD = struct.Struct('<4sQ2H2L4Q')
+ZIP64_LOCATOR = struct.Struct('<4sLQL')
+DATA_DESCRIPTOR = struct.Struct('<4sLLL')
+ZIP64_DATA_DESCRIPTOR = struct.Struct('<4sLQQ')
+
+LOCAL_SIGNATURE = b'PK\x03\x04'
+CENTRAL_SIGNATURE = b'PK\x01\x02'
+END_SIGNATURE = b'PK\x05\x06'
+ZIP64_END_SIGNATURE = b'PK\x06\x06'
+ZIP64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+ZIP64_EXTRA = 0x0001
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_LZMA_EOS = 0x02
+FLAG_UTF8 = 0x800
+
+DEFAULT_VERSION = 20
+ZIP64_VERSION = 45
+BZIP2_VERSION = 46
+LZMA_VERSION = 63
+
+METHOD_VERSIONS = {zipfile.ZIP_BZIP2: BZIP2_VERSION, zipfile.ZIP_LZMA: LZMA_VERSION}
+
+CREATE_SYSTEM = zipfile.ZipInfo().create_system
+
+
+class ZipEntry:
+    __slots__ = ('name', 'flags', 'method', 'dostime', 'dosdate', 'crc', 'csize', 'usize', 'offset',
+                 'create_system', 'external_attr', 'extra')
+
+    def __init__(self, name, method=zipfile.ZIP_STORED, mtime=None, external_attr=0):
+        self.name = name
+        self.flags = 0
+        self.method = method
+        self.dostime, self.dosdate = dos_datetime(time.time() if mtime is None else mtime)
+        self.crc = 0
+        self.csize = 0
+        self.usize = 0
+        self.offset = 0
+        self.create_system = CREATE_SYSTEM
+        self.external_attr = external_attr
+        self.extra = b''
+        if method == zipfile.ZIP_LZMA:
+            self.flags |= FLAG_LZMA_EOS
+        if not name.isascii():
+            self.flags |= FLAG_UTF8
+
+    @property
+    def name_bytes(self):
+        return self.name.encode('utf-8' if self.flags & FLAG_UTF8 else 'ascii')
+
+    @property
+    def is_dir(self):
+        return self.name.endswith('/')
+
+    @property
+    def mtime(self):
+        return dos_timestamp(unpack_dos_datetime(self.dostime, self.dosdate))
+
+    def extract_version(self, zip64=False):
+        version = METHOD_VERSIONS.get(self.method, DEFAULT_VERSION)
+        return max(version, ZIP64_VERSION) if zip64 else version
+
+    def needs_zip64(self):
+        return self.usize >= ZIP64_LIMIT or self.csize >= ZIP64_LIMIT or self.offset >= ZIP64_LIMIT
+
+
+def dos_datetime(timestamp):
+    year, month, day, hour, minute, second = time.localtime(timestamp)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    elif year > 2107:
+        year, month, day, hour, minute, second = 2107, 12, 31, 23, 59, 58
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def unpack_dos_datetime(dostime, dosdate):
+    return ((dosdate >> 9) + 1980, (dosdate >> 5) & 0xF, dosdate & 0x1F,
+            dostime >> 11, (dostime >> 5) & 0x3F, (dostime & 0x1F) * 2)
+
+
+def dos_timestamp(date_time):
+    try:
+        return time.mktime(date_time + (0, 0, -1))
+    except (OverflowError, ValueError):
+        return None
+
+
+def normalize_arcname(arcname):
+    arcname = arcname.replace('\\', '/')
+    drive, sep, rest = arcname.partition(':')
+    if sep and len(drive) == 1:
+        arcname = rest
+    return arcname.lstrip('/')
+
+
+def local_header(entry, zip64=False):
+    name = entry.name_bytes
+    usize, csize = entry.usize, entry.csize
+    extra = b''
+    if zip64:
+        extra = struct.pack('<2H2Q', ZIP64_EXTRA, 16, usize, csize)
+        usize = csize = ZIP64_LIMIT
+    return LOCAL_HEADER.pack(LOCAL_SIGNATURE, entry.extract_version(zip64), 0, entry.flags, entry.method,
+                             entry.dostime, entry.dosdate, entry.crc, csize, usize, len(name), len(extra)) + name + extra
+
+
+def data_descriptor(entry, zip64=False):
+    if zip64:
+        return ZIP64_DATA_DESCRIPTOR.pack(DESCRIPTOR_SIGNATURE, entry.crc, entry.csize, entry.usize)
+    return DATA_DESCRIPTOR.pack(DESCRIPTOR_SIGNATURE, entry.crc, entry.csize, entry.usize)
+
+
+def central_record(entry):
+    name = entry.name_bytes
+    usize, csize, offset = entry.usize, entry.csize, entry.offset
+    fields = []
+    if usize >= ZIP64_LIMIT:
+        fields.append(usize)
+        usize = ZIP64_LIMIT
+    if csize >= ZIP64_LIMIT:
+        fields.append(csize)
+        csize = ZIP64_LIMIT
+    if offset >= ZIP64_LIMIT:
+        fields.append(offset)
+        offset = ZIP64_LIMIT
+    extra = struct.pack(f'<2H{len(fields)}Q', ZIP64_EXTRA, 8 * len(fields), *fields) if fields else b''
+    extra += entry.extra
+    version = entry.extract_version(bool(fields))
+    return CENTRAL_HEADER.pack(CENTRAL_SIGNATURE, version, entry.create_system, version, 0, entry.flags, entry.method,
+                               entry.dostime, entry.dosdate, entry.crc, csize, usize, len(name), len(extra), 0, 0, 0,
+                               entry.external_attr, offset) + name + extra
+
+
+def end_records(count, cd_offset, cd_size, comment=b''):
+    records = b''
+    if count > ZIP64_COUNT_LIMIT or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        records += ZIP64_END_RECORD.pack(ZIP64_END_SIGNATURE, ZIP64_END_RECORD.size - 12, ZIP64_VERSION, ZIP64_VERSION,
+                                         0, 0, count, count, cd_size, cd_offset)
+        records += ZIP64_LOCATOR.pack(ZIP64_LOCATOR_SIGNATURE, 0, cd_offset + cd_size, 1)
+    records += END_RECORD.pack(END_SIGNATURE, 0, 0, min(count, ZIP64_COUNT_LIMIT), min(count, ZIP64_COUNT_LIMIT),
+                               min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), len(comment))
+    return records + comment
+
+
+class EndRecord:
+    __slots__ = ('count', 'cd_size', 'cd_offset', 'cd_position', 'concat', 'end_position', 'comment')
+
+    def __init__(self, count, cd_size, cd_offset, cd_position, concat, end_position, comment):
+        self.count = count
+        self.cd_size = cd_size
+        self.cd_offset = cd_offset
+        self.cd_position = cd_position
+        self.concat = concat
+        self.end_position = end_position
+        self.comment = comment
+
+
+def find_end_record(buffer, base=0):
+    # The end record sits in the last 22 bytes unless the archive has a
+    # trailing comment, which is at most 64 KiB long.
+    position = buffer.rfind(END_SIGNATURE, max(0, len(buffer) - END_RECORD.size - 0xFFFF))
+    if position < 0 or len(buffer) - position < END_RECORD.size:
+        raise zipfile.BadZipFile('File is not a zip file')
+    (signature, disk, cd_disk, disk_count, count, cd_size, cd_offset,
+     comment_length) = END_RECORD.unpack_from(buffer, position)
+    comment = bytes(buffer[position + END_RECORD.size:position + END_RECORD.size + comment_length])
+    end_position = base + position
+    start_of_cd_end = end_position
+    locator_position = position - ZIP64_LOCATOR.size
+    if locator_position >= 0 and buffer[locator_position:locator_position + 4] == ZIP64_LOCATOR_SIGNATURE:
+        zip64_position = locator_position - ZIP64_END_RECORD.size
+        if zip64_position < 0 or buffer[zip64_position:zip64_position + 4] != ZIP64_END_SIGNATURE:
+            raise zipfile.BadZipFile('Corrupt zip64 end of central directory record')
+        fields = ZIP64_END_RECORD.unpack_from(buffer, zip64_position)
+        count, cd_size, cd_offset = fields[7], fields[8], fields[9]
+        start_of_cd_end = base + zip64_position
+    concat = start_of_cd_end - cd_size - cd_offset
+    if concat < 0:
+        raise zipfile.BadZipFile('Bad offset for central directory')
+    return EndRecord(count, cd_size, cd_offset, cd_offset + concat, concat, end_position, comment)
+
+
+def iter_central_directory(data):
+    position = 0
+    end = len(data)
+    while position < end:
+        fields = CENTRAL_HEADER.unpack_from(data, position)
+        if fields[0] != CENTRAL_SIGNATURE:
+            raise zipfile.BadZipFile('Bad magic number for central directory')
+        size = CENTRAL_HEADER.size + fields[12] + fields[13] + fields[14]
+        yield position, size, fields
+        position += size
+
+
+def decode_name(raw, flags):
+    return raw.decode('utf-8' if flags & FLAG_UTF8 else 'cp437')
+
+
+def _zip64_block(extra):
+    position = 0
+    while position + 4 <= len(extra):
+        tag, length = struct.unpack_from('<2H', extra, position)
+        if tag == ZIP64_EXTRA:
+            return position, length
+        position += 4 + length
+    return None, 0
+
+
+def record_values(record, fields=None):
+    # Returns (usize, csize, offset) with any ZIP64 overrides applied.
+    if fields is None:
+        fields = CENTRAL_HEADER.unpack_from(record)
+    usize, csize, offset = fields[11], fields[10], fields[18]
+    if ZIP64_LIMIT not in (usize, csize, offset):
+        return usize, csize, offset
+    start = CENTRAL_HEADER.size + fields[12]
+    extra = record[start:start + fields[13]]
+    block, length = _zip64_block(extra)
+    if block is None:
+        raise zipfile.BadZipFile('Missing ZIP64 extra field')
+    values = struct.unpack_from(f'<{length // 8}Q', extra, block + 4)
+    position = 0
+    if usize == ZIP64_LIMIT:
+        usize = values[position]
+        position += 1
+    if csize == ZIP64_LIMIT:
+        csize = values[position]
+        position += 1
+    if offset == ZIP64_LIMIT:
+        offset = values[position]
+    return usize, csize, offset
+
+
+def encode_name(name, flags):
+    flags &= ~FLAG_UTF8
+    if not name.isascii():
+        flags |= FLAG_UTF8
+    return name.encode('utf-8' if flags & FLAG_UTF8 else 'ascii'), flags
+
+
+def patch_local_header(header, name):
+    fields = list(LOCAL_HEADER.unpack_from(header))
+    start = LOCAL_HEADER.size
+    extra = header[start + fields[10]:start + fields[10] + fields[11]]
+    name_bytes, fields[3] = encode_name(name, fields[3])
+    fields[10] = len(name_bytes)
+    return LOCAL_HEADER.pack(*fields) + name_bytes + extra
+
+
+def patch_central_record(record, offset=None, name=None):
+    fields = list(CENTRAL_HEADER.unpack_from(record))
+    start = CENTRAL_HEADER.size
+    name_bytes = record[start:start + fields[12]]
+    extra = bytearray(record[start + fields[12]:start + fields[12] + fields[13]])
+    comment = record[start + fields[12] + fields[13]:start + fields[12] + fields[13] + fields[14]]
+    if name is not None:
+        name_bytes, fields[5] = encode_name(name, fields[5])
+    if offset is not None:
+        block, length = _zip64_block(extra)
+        index = (fields[11] == ZIP64_LIMIT) + (fields[10] == ZIP64_LIMIT)
+        if fields[18] == ZIP64_LIMIT:
+            struct.pack_into('<Q', extra, block + 4 + 8 * index, offset)
+        elif offset < ZIP64_LIMIT:
+            fields[18] = offset
+        else:
+            if block is None:
+                block, length = len(extra), 0
+                extra += struct.pack('<2H', ZIP64_EXTRA, 0)
+            extra[block + 4 + 8 * index:block + 4 + 8 * index] = struct.pack('<Q', offset)
+            struct.pack_into('<2H', extra, block, ZIP64_EXTRA, length + 8)
+            fields[18] = ZIP64_LIMIT
+            fields[1] = fields[3] = max(fields[3], ZIP64_VERSION)
+    fields[12] = len(name_bytes)
+    fields[13] = len(extra)
+    return CENTRAL_HEADER.pack(*fields) + name_bytes + bytes(extra) + comment
+
+
+def read_end_record(fp):
+    fp.seek(0, 2)
+    file_size = fp.tell()
+    tail_size = min(file_size, END_RECORD.size + 0xFFFF + ZIP64_LOCATOR.size + ZIP64_END_RECORD.size)
+    fp.seek(file_size - tail_size)
+    return find_end_record(fp.read(tail_size), file_size - tail_size)
@@ -0,0 +1,220 @@
+import bz2
+import mmap
+import zipfile
+import zlib
+from array import array
+
+from . import zipformat
+
+FLAG_ENCRYPTED = 0x1
+READ_CHUNK = 256 * 1024
+
+
+class ZipDirectory:
+    # Read-only view of a ZIP's central directory kept as parallel arrays
+    # over a memory map; names stay as byte slices of the map until asked
+    # for, and ZipEntry objects are only built on demand.
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise zipfile.BadZipFile('File is not a zip file')
+        try:
+            self.end = zipformat.find_end_record(self._map)
+            self._parse()
+        except BaseException:
+            self.close()
+            raise
+        self._names = None
+
+    def _parse(self):
+        self.name_starts = array('Q')
+        self.name_lengths = array('H')
+        self.flags = array('H')
+        self.methods = array('H')
+        # DOS date in the high half, DOS time in the low half.
+        self.dostimes = array('L')
+        self.crcs = array('L')
+        self.csizes = array('Q')
+        self.usizes = array('Q')
+        self.offsets = array('Q')
+        self.external_attrs = array('L')
+        self.create_systems = bytearray()
+        base = self.end.cd_position
+        central = memoryview(self._map)[base:base + self.end.cd_size]
+        try:
+            for position, size, fields in zipformat.iter_central_directory(central):
+                if zipformat.ZIP64_LIMIT in (fields[10], fields[11], fields[18]):
+                    usize, csize, offset = zipformat.record_values(central[position:position + size], fields)
+                else:
+                    usize, csize, offset = fields[11], fields[10], fields[18]
+                self.name_starts.append(base + position + zipformat.CENTRAL_HEADER.size)
+                self.name_lengths.append(fields[12])
+                self.flags.append(fields[5])
+                self.methods.append(fields[6])
+                self.dostimes.append(fields[8] << 16 | fields[7])
+                self.crcs.append(fields[9])
+                self.csizes.append(csize)
+                self.usizes.append(usize)
+                self.offsets.append(offset + self.end.concat)
+                self.external_attrs.append(fields[17])
+                self.create_systems.append(fields[2])
+        finally:
+            central.release()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A caller still holds a memoryview of a stored member; the
+                # map goes away with the last reference instead.
+                pass
+            self._map = None
+        self._file.close()
+
+    def raw_name(self, index):
+        start = self.name_starts[index]
+        return self._map[start:start + self.name_lengths[index]]
+
+    def name(self, index):
+        return zipformat.decode_name(self.raw_name(index), self.flags[index])
+
+    def names(self):
+        for index in range(len(self)):
+            yield self.name(index)
+
+    def find(self, name):
+        if self._names is None:
+            self._names = {member_name: index for index, member_name in enumerate(self.names())}
+        return self._names.get(name)
+
+    def is_dir(self, index):
+        start = self.name_starts[index] + self.name_lengths[index] - 1
+        return self.name_lengths[index] > 0 and self._map[start] == 0x2F
+
+    def date_time(self, index):
+        value = self.dostimes[index]
+        return zipformat.unpack_dos_datetime(value & 0xFFFF, value >> 16)
+
+    def mtime(self, index):
+        return zipformat.dos_timestamp(self.date_time(index))
+
+    def entry(self, index):
+        entry = zipformat.ZipEntry(self.name(index), self.methods[index])
+        entry.flags = self.flags[index]
+        entry.dostime = self.dostimes[index] & 0xFFFF
+        entry.dosdate = self.dostimes[index] >> 16
+        entry.crc = self.crcs[index]
+        entry.csize = self.csizes[index]
+        entry.usize = self.usizes[index]
+        entry.offset = self.offsets[index] - self.end.concat
+        entry.create_system = self.create_systems[index]
+        entry.external_attr = self.external_attrs[index]
+        return entry
+
+    def data_offset(self, index):
+        offset = self.offsets[index]
+        header = zipformat.LOCAL_HEADER.unpack_from(self._map, offset)
+        if header[0] != zipformat.LOCAL_SIGNATURE:
+            raise zipfile.BadZipFile(f'Bad magic number for file header of {self.name(index)!r}')
+        return offset + zipformat.LOCAL_HEADER.size + header[10] + header[11]
+
+    def raw_data(self, index):
+        start = self.data_offset(index)
+        return memoryview(self._map)[start:start + self.csizes[index]]
+
+    def open(self, index):
+        if self.flags[index] & FLAG_ENCRYPTED:
+            raise NotImplementedError(f'{self.name(index)!r} is encrypted')
+        return _MemberReader(self.raw_data(index), self.methods[index], self.usizes[index], self.crcs[index], self.name(index))
+
+    def read(self, index, check_crc=True):
+        # Stored members come back as a zero-copy memoryview of the map;
+        # compressed ones are inflated into a new bytes object.
+        if self.flags[index] & FLAG_ENCRYPTED:
+            raise NotImplementedError(f'{self.name(index)!r} is encrypted')
+        raw = self.raw_data(index)
+        method = self.methods[index]
+        if method == zipfile.ZIP_STORED:
+            data = raw
+        elif method == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(raw, -15)
+        elif method == zipfile.ZIP_BZIP2:
+            data = bz2.decompress(raw)
+        elif method == zipfile.ZIP_LZMA:
+            data = zipfile.LZMADecompressor().decompress(bytes(raw))
+        else:
+            raise NotImplementedError(f'compression method {method} is not supported')
+        if data is not raw:
+            raw.release()
+        if check_crc and zlib.crc32(data) != self.crcs[index]:
+            raise zipfile.BadZipFile(f'Bad CRC-32 for file {self.name(index)!r}')
+        return data
+
+
+class _MemberReader:
+    # Streams one member out of the map, inflating a chunk at a time and
+    # checking the CRC once the last byte has been handed out.
+    def __init__(self, raw, method, size, crc, name):
+        self.name = name
+        self._raw = raw
+        self._position = 0
+        self._remaining = size
+        self._expected_crc = crc
+        self._crc = 0
+        self._buffer = b''
+        if method == zipfile.ZIP_STORED:
+            self._decompressor = None
+        elif method == zipfile.ZIP_DEFLATED:
+            self._decompressor = zlib.decompressobj(-15)
+        elif method == zipfile.ZIP_BZIP2:
+            self._decompressor = bz2.BZ2Decompressor()
+        elif method == zipfile.ZIP_LZMA:
+            self._decompressor = zipfile.LZMADecompressor()
+        else:
+            raise NotImplementedError(f'compression method {method} is not supported')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._raw is not None:
+            self._raw.release()
+            self._raw = None
+
+    def _fill(self, size):
+        while len(self._buffer) < size and self._position < len(self._raw):
+            chunk = self._raw[self._position:self._position + READ_CHUNK]
+            self._position += len(chunk)
+            self._buffer += chunk if self._decompressor is None else self._decompressor.decompress(chunk)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._remaining
+        size = min(size, self._remaining)
+        self._fill(size)
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        if len(data) < size:
+            raise EOFError(f'{self.name!r} is truncated')
+        self._remaining -= len(data)
+        self._crc = zlib.crc32(data, self._crc)
+        if not self._remaining and self._crc != self._expected_crc:
+            raise zipfile.BadZipFile(f'Bad CRC-32 for file {self.name!r}')
+        return bytes(data)
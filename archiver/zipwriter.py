@@ -0,0 +1,474 @@
+import bz2
+import collections
+import contextlib
+import os
+import shutil
+import stat
+import tempfile
+import zlib
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from . import zipformat
+from .metrics import Metrics
+from .zipformat import ZipEntry
+
+CHUNK_SIZE = 1024 * 1024
+LARGE_FILE = 4 * CHUNK_SIZE
+MIN_PENDING_BYTES = 64 * 1024 * 1024
+SPOOL_LIMIT = 16 * 1024 * 1024
+DEFLATE_WINDOW = 32 * 1024
+
+METHODS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflated': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+
+
+def compressor_for(method, level=None):
+    if method == zipfile.ZIP_DEFLATED:
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level, zlib.DEFLATED, -15)
+    if method == zipfile.ZIP_BZIP2:
+        return bz2.BZ2Compressor(9 if level is None else max(1, min(level, 9)))
+    if method == zipfile.ZIP_LZMA:
+        return zipfile.LZMACompressor()
+    if method == zipfile.ZIP_STORED:
+        return None
+    raise NotImplementedError(f'compression method {method} is not supported')
+
+
+def compress_data(data, method, level=None):
+    compressor = compressor_for(method, level)
+    if compressor is None:
+        return data
+    return compressor.compress(data) + compressor.flush()
+
+
+def _compress_file(path, method, level, policy=None, name=None, metrics=None):
+    metrics = metrics or Metrics()
+    with metrics.phase('read') as phase:
+        with open(path, 'rb') as f:
+            data = f.read()
+        phase.bytes = len(data)
+    crc = zlib.crc32(data)
+    if policy is None:
+        with metrics.phase('compress', len(data)):
+            return crc, compress_data(data, method, level), len(data), method
+    # The whole file is in memory anyway, so the policy samples it here on
+    # the worker and a result that did not shrink enough is stored instead.
+    with metrics.phase('compress', len(data)):
+        method, level = policy.choose(name, data, len(data))
+        compressed = compress_data(data, method, level)
+    if method != zipfile.ZIP_STORED and not policy.accept(len(data), len(compressed)):
+        return crc, data, len(data), zipfile.ZIP_STORED
+    return crc, compressed, len(data), method
+
+
+def _deflate_chunk(data, dictionary, level, last):
+    # Each chunk is an independent raw deflate run primed with the tail of
+    # the previous chunk, so the pieces concatenate into one valid stream
+    # (the same trick pigz uses).
+    level = zlib.Z_DEFAULT_COMPRESSION if level is None else level
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 8, zlib.Z_DEFAULT_STRATEGY, dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def seekable(fileobj):
+    try:
+        return fileobj.seekable()
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+class StreamSink:
+    # Write-only wrapper for pipes and sockets that keeps count of what went
+    # through, since the offsets in ZIP and TAR headers need a tell().
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.position = 0
+
+    def tell(self):
+        return self.position
+
+    def seekable(self):
+        return False
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.position += len(data)
+        return len(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+class _Pending:
+    __slots__ = ('entry', 'future', 'data', 'path', 'level', 'size')
+
+    def __init__(self, entry, future=None, data=None, path=None, level=None, size=0):
+        self.entry = entry
+        self.future = future
+        self.data = data
+        self.path = path
+        self.level = level
+        self.size = size
+
+
+class ParallelZipWriter:
+    def __init__(self, file, mode='w', method=zipfile.ZIP_DEFLATED, level=None, workers=None, chunk_size=CHUNK_SIZE, op=None, policy=None):
+        self.method = method
+        self.level = level
+        self.policy = policy
+        self.chunk_size = chunk_size
+        self.large_file = max(LARGE_FILE, 2 * chunk_size)
+        self.op = op
+        self.metrics = op.metrics if op is not None else Metrics()
+        self.workers = workers or os.cpu_count() or 1
+        self.entries = []
+        self.comment = b''
+        self.closed = False
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='archiver-zip')
+        self._pending = collections.deque()
+        self._pending_bytes = 0
+        self._max_pending_bytes = max(MIN_PENDING_BYTES, self.workers * chunk_size * 4)
+        self._tail = None
+        self._tail_start = 0
+        self._old_count = 0
+        self._old_cd_size = 0
+        self._concat = 0
+        if isinstance(file, (str, os.PathLike)):
+            self._own_file = True
+            if mode == 'a' and os.path.exists(file):
+                self.fp = open(file, 'r+b')
+            else:
+                self.fp = open(file, 'wb')
+                mode = 'w'
+        else:
+            self._own_file = False
+            self.fp = file
+        # On a pipe or socket nothing can be patched or rolled back after the
+        # fact: sizes of streamed members go into data descriptors, and an
+        # aborted archive simply ends without a central directory.
+        self.streaming = not seekable(self.fp)
+        if self.streaming:
+            if mode == 'a':
+                raise ValueError('cannot append to a non-seekable stream')
+            if not isinstance(self.fp, StreamSink):
+                self.fp = StreamSink(self.fp)
+        self.mode = mode
+        if mode == 'a':
+            self._load_existing()
+        self._start = self.fp.tell()
+
+    def _load_existing(self):
+        end = zipformat.read_end_record(self.fp)
+        self.comment = end.comment
+        self._concat = end.concat
+        self._old_count = end.count
+        self._old_cd_size = end.cd_size
+        self._tail_start = end.cd_position
+        self._tail = tempfile.SpooledTemporaryFile(SPOOL_LIMIT)
+        self.fp.seek(end.cd_position)
+        shutil.copyfileobj(self.fp, self._tail, CHUNK_SIZE)
+        self.fp.seek(end.cd_position)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _check(self):
+        if self.op is not None:
+            self.op.check()
+
+    def _advance(self, nbytes, members=0):
+        if self.op is not None:
+            self.op.advance(nbytes, members)
+
+    def _tell(self):
+        return self.fp.tell() - self._concat
+
+    def add_file(self, path, arcname=None, st=None, method=None, level=None):
+        if st is None:
+            st = os.stat(path)
+        arcname = zipformat.normalize_arcname(path if arcname is None else arcname)
+        if stat.S_ISDIR(st.st_mode):
+            return self.add_directory(arcname, st.st_mtime, st.st_mode)
+        if stat.S_ISLNK(st.st_mode):
+            return self.add_symlink(arcname, os.readlink(path), st.st_mtime, st.st_mode)
+        policy = self.policy if method is None else None
+        method = self.method if method is None else method
+        level = self.level if level is None else level
+        if policy is not None and st.st_size > self.large_file:
+            method, level = policy.choose_file(path, arcname, st.st_size)
+            policy = None
+        entry = ZipEntry(arcname, method, st.st_mtime, (st.st_mode & 0xFFFF) << 16)
+        entry.usize = st.st_size
+        if st.st_size > self.large_file:
+            self._queue(_Pending(entry, path=path, level=level))
+        else:
+            future = self._executor.submit(_compress_file, path, method, level, policy, arcname, self.metrics)
+            self._queue(_Pending(entry, future=future, size=st.st_size))
+        return entry
+
+    def add_directory(self, arcname, mtime=None, mode=0o40775):
+        arcname = zipformat.normalize_arcname(arcname)
+        if not arcname.endswith('/'):
+            arcname += '/'
+        entry = ZipEntry(arcname, zipfile.ZIP_STORED, mtime, ((mode & 0xFFFF) << 16) | 0x10)
+        self._queue(_Pending(entry, data=(0, b'', 0, zipfile.ZIP_STORED)))
+        return entry
+
+    def add_symlink(self, arcname, target, mtime=None, mode=stat.S_IFLNK | 0o777):
+        # Info-ZIP convention: the link target is the stored content and
+        # the Unix mode in the external attributes marks it as a link.
+        arcname = zipformat.normalize_arcname(arcname)
+        data = os.fsencode(target)
+        entry = ZipEntry(arcname, zipfile.ZIP_STORED, mtime, (mode & 0xFFFF) << 16)
+        entry.create_system = 3
+        self._queue(_Pending(entry, data=(zlib.crc32(data), data, len(data), zipfile.ZIP_STORED)))
+        return entry
+
+    def add_bytes(self, arcname, data, mtime=None, method=None, level=None, mode=0o600):
+        arcname = zipformat.normalize_arcname(arcname)
+        method = self.method if method is None else method
+        entry = ZipEntry(arcname, method, mtime, ((stat.S_IFREG | mode) & 0xFFFF) << 16)
+        future = self._executor.submit(self.metrics.timed('compress', lambda: (zlib.crc32(data), compress_data(data, method, level), len(data), method)))
+        self._queue(_Pending(entry, future=future, size=len(data)))
+        return entry
+
+    def add_stream(self, arcname, fileobj, size, mtime=None, method=None, level=None, mode=0o644):
+        # The source can only be read now and in order, so everything queued
+        # before it is written out first.
+        arcname = zipformat.normalize_arcname(arcname)
+        method = self.method if method is None else method
+        level = self.level if level is None else level
+        entry = ZipEntry(arcname, method, mtime, ((stat.S_IFREG | mode) & 0xFFFF) << 16)
+        entry.usize = size
+        self.flush()
+        self._check()
+        self._write_streamed(entry, fileobj, level)
+        self.entries.append(entry)
+        self._advance(0, 1)
+        return entry
+
+    def add_compressed(self, entry, pieces):
+        # Data that is already in the entry's method goes in as it is; the
+        # caller fills in crc, usize and csize.
+        self.flush()
+        self._check()
+        entry.offset = self._tell()
+        self.fp.write(zipformat.local_header(entry, entry.usize >= zipformat.ZIP64_LIMIT or entry.csize >= zipformat.ZIP64_LIMIT))
+        written = 0
+        for piece in pieces:
+            with self.metrics.phase('write', len(piece)):
+                self.fp.write(piece)
+            written += len(piece)
+        if written != entry.csize:
+            raise zipfile.BadZipFile(f'{entry.name} has {written} bytes of compressed data, expected {entry.csize}')
+        self._advance(entry.usize)
+        self.entries.append(entry)
+        self._advance(0, 1)
+        return entry
+
+    def _queue(self, pending):
+        if self.closed:
+            raise ValueError('write to a closed zip writer')
+        self._pending.append(pending)
+        self._pending_bytes += pending.size
+        while self._pending and (self._pending_bytes > self._max_pending_bytes or self._head_ready()):
+            self._write_head()
+        self.metrics.set_depth('zip', len(self._pending))
+
+    def _head_ready(self):
+        head = self._pending[0]
+        return head.future is None or head.future.done()
+
+    def _write_head(self):
+        self._check()
+        pending = self._pending.popleft()
+        self._pending_bytes -= pending.size
+        entry = pending.entry
+        if pending.path is not None:
+            self._write_streamed(entry, pending.path, pending.level)
+        else:
+            if pending.data is not None:
+                crc, data, usize, method = pending.data
+            else:
+                with self.metrics.phase('wait'):
+                    crc, data, usize, method = pending.future.result()
+            if method != entry.method:
+                entry.method = method
+                entry.flags &= ~zipformat.FLAG_LZMA_EOS
+                if method == zipfile.ZIP_LZMA:
+                    entry.flags |= zipformat.FLAG_LZMA_EOS
+            entry.crc = crc
+            entry.usize = usize
+            entry.csize = len(data)
+            entry.offset = self._tell()
+            with self.metrics.phase('write', len(data)):
+                self.fp.write(zipformat.local_header(entry, entry.usize >= zipformat.ZIP64_LIMIT or entry.csize >= zipformat.ZIP64_LIMIT))
+                self.fp.write(data)
+            self._advance(usize)
+        if self.policy is not None and not entry.is_dir:
+            self.policy.report.record(entry.usize, entry.csize, entry.method != zipfile.ZIP_STORED)
+        self.entries.append(entry)
+        self._advance(0, 1)
+
+    def _write_streamed(self, entry, source, level):
+        entry.offset = self._tell()
+        zip64 = entry.usize * 1.05 > zipformat.ZIP64_LIMIT
+        header_position = self.fp.tell()
+        if self.streaming:
+            entry.flags |= zipformat.FLAG_DATA_DESCRIPTOR
+            entry.usize = 0
+        self.fp.write(zipformat.local_header(entry, zip64))
+        crc = 0
+        usize = 0
+        csize = 0
+        with (open(source, 'rb') if isinstance(source, (str, os.PathLike)) else contextlib.nullcontext(source)) as f:
+            if entry.method == zipfile.ZIP_DEFLATED:
+                window = collections.deque()
+                dictionary = None
+                deflate = self.metrics.timed('compress', _deflate_chunk)
+                chunk = self._read(f)
+                while chunk:
+                    following = self._read(f)
+                    crc = zlib.crc32(chunk, crc)
+                    usize += len(chunk)
+                    window.append((self._executor.submit(deflate, chunk, dictionary, level, not following), len(chunk)))
+                    dictionary = chunk[-DEFLATE_WINDOW:]
+                    self.metrics.set_depth('chunks', len(window))
+                    while len(window) > 2 * self.workers:
+                        csize += self._write_chunk(*window.popleft())
+                    chunk = following
+                while window:
+                    csize += self._write_chunk(*window.popleft())
+            else:
+                compressor = compressor_for(entry.method, level)
+                while True:
+                    chunk = self._read(f)
+                    if not chunk:
+                        break
+                    crc = zlib.crc32(chunk, crc)
+                    usize += len(chunk)
+                    if compressor is not None:
+                        with self.metrics.phase('compress', len(chunk)):
+                            data = compressor.compress(chunk)
+                    else:
+                        data = chunk
+                    with self.metrics.phase('write', len(data)):
+                        self.fp.write(data)
+                    csize += len(data)
+                    self._advance(len(chunk))
+                if compressor is not None:
+                    data = compressor.flush()
+                    with self.metrics.phase('write', len(data)):
+                        self.fp.write(data)
+                    csize += len(data)
+        entry.crc = crc
+        entry.usize = usize
+        entry.csize = csize
+        if not zip64 and (usize >= zipformat.ZIP64_LIMIT or csize >= zipformat.ZIP64_LIMIT):
+            raise zipfile.LargeZipFile(f'{entry.name} grew past the 4 GiB limit while it was being compressed')
+        if self.streaming:
+            self.fp.write(zipformat.data_descriptor(entry, zip64))
+            return
+        end_position = self.fp.tell()
+        self.fp.seek(header_position)
+        self.fp.write(zipformat.local_header(entry, zip64))
+        self.fp.seek(end_position)
+
+    def _read(self, f):
+        with self.metrics.phase('read') as phase:
+            data = f.read(self.chunk_size)
+            phase.bytes = len(data)
+        return data
+
+    def _write_chunk(self, future, size):
+        with self.metrics.phase('wait'):
+            data = future.result()
+        with self.metrics.phase('write', len(data)):
+            self.fp.write(data)
+        self._advance(size)
+        self._check()
+        return len(data)
+
+    def flush(self):
+        while self._pending:
+            self._write_head()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+        except BaseException:
+            self.abort()
+            raise
+        try:
+            with self.metrics.phase('write') as phase:
+                cd_position = self.fp.tell()
+                if self._tail is not None:
+                    self._tail.seek(0)
+                    self._copy_old_central()
+                for entry in self.entries:
+                    self.fp.write(zipformat.central_record(entry))
+                cd_size = self.fp.tell() - cd_position
+                self.fp.write(zipformat.end_records(self._old_count + len(self.entries), cd_position - self._concat, cd_size, self.comment))
+                if self.mode == 'a':
+                    self.fp.truncate()
+                self.fp.flush()
+                phase.bytes = cd_size
+        finally:
+            self._finish()
+
+    def _copy_old_central(self):
+        remaining = self._old_cd_size
+        while remaining:
+            data = self._tail.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                raise zipfile.BadZipFile('Truncated central directory')
+            self.fp.write(data)
+            remaining -= len(data)
+
+    def abort(self):
+        if self.closed:
+            return
+        try:
+            for pending in self._pending:
+                if pending.future is not None:
+                    pending.future.cancel()
+            self._pending.clear()
+            if self._tail is not None:
+                # Put the original central directory back over whatever
+                # was written, leaving the archive exactly as it was.
+                self.fp.seek(self._tail_start)
+                self._tail.seek(0)
+                shutil.copyfileobj(self._tail, self.fp, CHUNK_SIZE)
+                self.fp.truncate()
+            elif not self.streaming:
+                self.fp.seek(self._start)
+                self.fp.write(zipformat.end_records(0, self._start - self._concat, 0))
+                self.fp.truncate()
+            self.fp.flush()
+        finally:
+            self._finish()
+
+    def _finish(self):
+        self.closed = True
+        self._executor.shutdown(wait=True)
+        if self._tail is not None:
+            self._tail.close()
+            self._tail = None
+        if self._own_file:
+            self.fp.close()
@@ -0,0 +1,83 @@
+import argparse
+import json
+import sys
+
+# (key, label, unit, divisor, digits) of the columns compared; lower is
+# better for all of them.
+METRICS = (
+    ('wall', 'time', 's', 1, 3),
+    ('peak_rss', 'peak RSS', 'MB', 1048576, 1),
+    ('syscr', 'read calls', '', 1, 0),
+    ('syscw', 'write calls', '', 1, 0),
+)
+
+
+def load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+    return results, {result['case']: result for result in results['results']}
+
+
+def _change(base, new):
+    if base is None or new is None:
+        return None
+    if not base:
+        return 0.0 if not new else None
+    return (new - base) / base
+
+
+def _value(value, divisor, digits):
+    return '-' if value is None else f'{value / divisor:.{digits}f}'
+
+
+def compare(base, new, threshold, metrics):
+    # Returns the table rows and the cases whose time or memory grew by
+    # more than threshold.
+    rows = []
+    regressions = []
+    for case in sorted(base.keys() & new.keys()):
+        row = [case]
+        for key, label, unit, divisor, digits in metrics:
+            change = _change(base[case].get(key), new[case].get(key))
+            row.append(f'{_value(base[case].get(key), divisor, digits)} -> {_value(new[case].get(key), divisor, digits)}'
+                       + (f' ({change:+.1%})' if change is not None else ''))
+            if change is not None and change > threshold and key in ('wall', 'peak_rss'):
+                regressions.append((case, label, change))
+        rows.append(row)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.compare', description='Compare two benchmark result files.')
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help='relative growth in time or peak RSS reported as a regression (default: 0.1)')
+    args = parser.parse_args(argv)
+    try:
+        base_results, base = load(args.base)
+        new_results, new = load(args.new)
+    except (OSError, ValueError, KeyError) as e:
+        print(f'{parser.prog}: {e}', file=sys.stderr)
+        return 2
+    for label, results in (('base', base_results), ('new', new_results)):
+        environment = results.get('environment', {})
+        print(f"{label}: revision {environment.get('revision') or '?'}, scale {results.get('scale')}, "
+              f"{results.get('repeat')} samples, python {environment.get('python')}, {environment.get('cpus')} CPUs")
+    if base_results.get('scale') != new_results.get('scale'):
+        print('warning: the runs used different scales', file=sys.stderr)
+    rows, regressions = compare(base, new, args.threshold, METRICS)
+    header = ['case'] + [f'{label} ({unit})' if unit else label for key, label, unit, divisor, digits in METRICS]
+    widths = [max(len(str(row[column])) for row in rows + [header]) for column in range(len(header))]
+    for row in [header] + rows:
+        print('  '.join(str(cell).ljust(width) for cell, width in zip(row, widths)).rstrip())
+    for label, cases in (('base', base.keys() - new.keys()), ('new', new.keys() - base.keys())):
+        if cases:
+            print(f"only in {label}: {', '.join(sorted(cases))}")
+    for case, label, change in regressions:
+        print(f'regression: {case} {label} {change:+.1%}', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import io
+import json
+import os
+import random
+import shutil
+import tarfile
+import zipfile
+
+from archiver.blockcodec import BlockCompressor, tar_codec
+from archiver.jobs import archive_kind
+from archiver.zipwriter import ParallelZipWriter
+
+POOL_SIZE = 1024 * 1024
+WRITE_CHUNK = 1024 * 1024
+FILES_PER_FOLDER = 1000
+# A fixed timestamp keeps generated archives byte for byte identical.
+MTIME = 1700000000
+MANIFEST = 'manifest.json'
+WORDS = ('archive', 'member', 'folder', 'index', 'block', 'offset', 'header', 'record', 'stream', 'buffer', 'window', 'deflate',
+         'the', 'of', 'and', 'to', 'in', 'is', 'for', 'with', 'on', 'as', 'by', 'at', 'from', 'this', 'that', 'data', 'file', 'size')
+
+# Sizes per scale. 'entries' is the member count of the generated-only
+# archive used for listing, searching and deleting at large counts.
+SCALES = {
+    'small': {'tiny_files': 2000, 'huge_files': 2, 'huge_size': 16 * 1024 * 1024, 'deep_depth': 32, 'deep_files': 4,
+              'mixed_files': 200, 'mixed_max_size': 512 * 1024, 'entries': 20000},
+    'default': {'tiny_files': 20000, 'huge_files': 3, 'huge_size': 256 * 1024 * 1024, 'deep_depth': 64, 'deep_files': 8,
+                'mixed_files': 1000, 'mixed_max_size': 2 * 1024 * 1024, 'entries': 200000},
+    'full': {'tiny_files': 100000, 'huge_files': 4, 'huge_size': 1024 * 1024 * 1024, 'deep_depth': 128, 'deep_files': 16,
+             'mixed_files': 4000, 'mixed_max_size': 8 * 1024 * 1024, 'entries': 1000000},
+}
+DISK_CORPORA = ('tiny', 'huge', 'deep', 'mixed')
+CORPORA = DISK_CORPORA + ('entries',)
+
+
+class _Data:
+    # Deterministic file contents: slices of a pseudo-text pool for data
+    # that compresses, fresh seeded random bytes for data that does not.
+    def __init__(self, rng):
+        self.rng = rng
+        text = []
+        length = 0
+        while length < POOL_SIZE:
+            word = rng.choice(WORDS)
+            text.append(word)
+            length += len(word) + 1
+        self.text = ' '.join(text).encode('ascii')[:POOL_SIZE]
+
+    def chunks(self, size, kind):
+        while size:
+            length = min(size, WRITE_CHUNK)
+            if kind == 'random':
+                yield self.rng.randbytes(length)
+            elif kind == 'zeros':
+                yield bytes(length)
+            else:
+                start = self.rng.randrange(POOL_SIZE)
+                data = self.text[start:start + length]
+                while len(data) < length:
+                    data += self.text[:length - len(data)]
+                yield data
+            size -= length
+
+
+def _write_file(path, data, size, kind):
+    with open(path, 'wb') as f:
+        for chunk in data.chunks(size, kind):
+            f.write(chunk)
+    os.utime(path, (MTIME, MTIME))
+
+
+def _tiny(root, params, data, rng):
+    for number in range(params['tiny_files']):
+        folder = os.path.join(root, f'd{number // FILES_PER_FOLDER:04d}')
+        if not number % FILES_PER_FOLDER:
+            os.makedirs(folder)
+        _write_file(os.path.join(folder, f'file-{number:07d}.txt'), data, rng.randrange(4097), 'text')
+
+
+def _huge(root, params, data, rng):
+    for number in range(params['huge_files']):
+        _write_file(os.path.join(root, f'huge-{number}.bin'), data, params['huge_size'], 'random' if number % 2 else 'text')
+
+
+def _deep(root, params, data, rng):
+    folder = root
+    for depth in range(params['deep_depth']):
+        folder = os.path.join(folder, f'level-{depth:03d}')
+        os.makedirs(folder)
+        for number in range(params['deep_files']):
+            _write_file(os.path.join(folder, f'file-{number:03d}.txt'), data, rng.randrange(16384), 'text')
+
+
+def _mixed(root, params, data, rng):
+    for number in range(params['mixed_files']):
+        folder = os.path.join(root, f'd{number // 100:03d}')
+        if not number % 100:
+            os.makedirs(folder)
+        kind = rng.choice(('text', 'text', 'random', 'zeros'))
+        _write_file(os.path.join(folder, f'file-{number:06d}.{kind}'), data, rng.randrange(params['mixed_max_size'] + 1), kind)
+
+
+GENERATORS = {'tiny': _tiny, 'huge': _huge, 'deep': _deep, 'mixed': _mixed}
+
+
+def _tree_stats(root):
+    files = folders = total = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        folders += len(dirnames)
+        files += len(filenames)
+        total += sum(os.path.getsize(os.path.join(dirpath, name)) for name in filenames)
+    return {'files': files, 'folders': folders, 'bytes': total}
+
+
+def _load_manifest(path, params):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('params') == params else None
+
+
+def make_corpus(work_dir, name, scale, seed):
+    # Builds the folder tree for a disk corpus once per (scale, seed) and
+    # reuses it afterwards; returns its manifest.
+    params = dict(SCALES[scale], corpus=name, seed=seed)
+    base = os.path.join(work_dir, 'corpora', f'{scale}-{seed}', name)
+    manifest_path = os.path.join(base, MANIFEST)
+    manifest = _load_manifest(manifest_path, params)
+    if manifest is not None:
+        return manifest
+    shutil.rmtree(base, ignore_errors=True)
+    root = os.path.join(base, name)
+    os.makedirs(root)
+    rng = random.Random(f'{seed}:{name}')
+    GENERATORS[name](root, params, _Data(rng), rng)
+    manifest = dict(_tree_stats(root), params=params, path=root)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def entry_names(count):
+    for number in range(count):
+        if not number % FILES_PER_FOLDER:
+            yield f'entries/d{number // FILES_PER_FOLDER:04d}/'
+        yield f'entries/d{number // FILES_PER_FOLDER:04d}/file-{number:07d}.txt'
+
+
+def _entry_data(number):
+    return f'entry {number}\n'.encode('ascii')
+
+
+def make_entries_archive(work_dir, archive_format, scale, seed):
+    # The many-entries corpus only ever exists as an archive: writing a
+    # million files to disk first would dominate the run.
+    count = SCALES[scale]['entries']
+    params = {'corpus': 'entries', 'entries': count, 'format': archive_format}
+    base = os.path.join(work_dir, 'corpora', f'{scale}-{seed}', f'entries-{archive_format}')
+    manifest_path = os.path.join(base, MANIFEST)
+    manifest = _load_manifest(manifest_path, params)
+    if manifest is not None:
+        return manifest
+    shutil.rmtree(base, ignore_errors=True)
+    os.makedirs(base)
+    path = os.path.join(base, 'entries.' + archive_format)
+    total = 0
+    if archive_kind(path) == 'zip':
+        with ParallelZipWriter(path, 'w', method=zipfile.ZIP_DEFLATED) as writer:
+            for number, name in enumerate(entry_names(count)):
+                if name.endswith('/'):
+                    writer.add_directory(name, MTIME)
+                else:
+                    data = _entry_data(number)
+                    total += len(data)
+                    writer.add_bytes(name, data, MTIME, mode=0o644)
+    else:
+        codec = tar_codec(path)
+        with open(path, 'wb') as fp:
+            compressor = BlockCompressor(fp, codec) if codec is not None else None
+            with tarfile.open(fileobj=compressor or fp, mode='w', format=tarfile.PAX_FORMAT) as archive:
+                for number, name in enumerate(entry_names(count)):
+                    tarinfo = tarfile.TarInfo(name.rstrip('/'))
+                    tarinfo.mtime = MTIME
+                    if name.endswith('/'):
+                        tarinfo.type = tarfile.DIRTYPE
+                        tarinfo.mode = 0o755
+                        archive.addfile(tarinfo)
+                    else:
+                        data = _entry_data(number)
+                        tarinfo.size = len(data)
+                        total += len(data)
+                        archive.addfile(tarinfo, io.BytesIO(data))
+            if compressor is not None:
+                compressor.close()
+    manifest = {'files': count, 'folders': -(-count // FILES_PER_FOLDER), 'bytes': total, 'params': params, 'path': path}
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
@@ -0,0 +1,342 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from archiver.engine import ArchiveEngine
+from archiver.jobs import archive_kind
+from archiver.operations import Operation
+from archiver.tarindex import index_path
+
+from . import corpus
+
+RESULTS_VERSION = 1
+FORMATS = ('zip', 'tar')
+# Each operation stands in for the GUI handler doing the same work.
+OPERATIONS = {
+    'add': 'on_add_file_or_folder',
+    'list': 'update_file_list',
+    'list-cached': 'update_file_list',
+    'search': 'search_in_archive',
+    'extract': 'on_extract_all',
+    'delete': 'delete_selected_file',
+}
+# Operations that need an archive written from a folder on disk.
+DISK_ONLY = ('add', 'extract')
+SEARCH_QUERY = '42'
+DELETE_EVERY = 100
+
+
+def _proc_io():
+    # Per-process I/O counters, threads included; syscr/syscw count the
+    # read and write system calls. Linux only.
+    try:
+        with open('/proc/self/io', 'r') as f:
+            return {key: int(value) for key, value in (line.split(':') for line in f)}
+    except OSError:
+        return None
+
+
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss(reset):
+    if reset:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _rusage():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {'user_time': usage.ru_utime, 'system_time': usage.ru_stime, 'blocks_in': usage.ru_inblock,
+            'blocks_out': usage.ru_oublock, 'voluntary_switches': usage.ru_nvcsw, 'involuntary_switches': usage.ru_nivcsw}
+
+
+def _delta(before, after):
+    if before is None or after is None:
+        return {}
+    return {key: after[key] - before[key] for key in after}
+
+
+def _prepare(engine, op, spec):
+    # Untimed setup, so that every sample starts from the same state.
+    archive_name = spec['archive']
+    if spec['operation'] == 'add':
+        if os.path.exists(archive_name):
+            os.remove(archive_name)
+        engine.create(archive_name)
+    elif spec['operation'] == 'list':
+        if archive_kind(archive_name) == 'tar' and os.path.exists(index_path(archive_name)):
+            os.remove(index_path(archive_name))
+    elif spec['operation'] == 'list-cached':
+        engine.load_index(op, archive_name)
+    elif spec['operation'] == 'search':
+        return engine.load_index(op, archive_name)
+    elif spec['operation'] == 'extract':
+        shutil.rmtree(spec['destination'], ignore_errors=True)
+    elif spec['operation'] == 'delete':
+        shutil.copyfile(spec['source_archive'], archive_name)
+        engine.load_index(op, archive_name)
+    return None
+
+
+def _execute(engine, op, spec, archive_index):
+    archive_name = spec['archive']
+    operation = spec['operation']
+    if operation == 'add':
+        engine.add(op, archive_name, [spec['source']])
+    elif operation in ('list', 'list-cached'):
+        engine.load_index(op, archive_name).listdir('')
+    elif operation == 'search':
+        engine.search(op, archive_name, spec['query'], 'substring', archive_index)
+    elif operation == 'extract':
+        engine.extract(op, archive_name, spec['destination'])
+    elif operation == 'delete':
+        with open(spec['names'], 'r', encoding='utf-8') as f:
+            engine.delete(op, archive_name, json.load(f))
+
+
+def run_sample(spec):
+    engine = ArchiveEngine(spec['method'], workers=spec['workers'])
+    op = Operation(spec['operation'], None)
+    archive_index = _prepare(engine, op, spec)
+    op.reset_progress()
+    io_before = _proc_io()
+    usage_before = _rusage()
+    reset = _reset_peak_rss()
+    started = time.perf_counter()
+    _execute(engine, op, spec, archive_index)
+    wall = time.perf_counter() - started
+    sample = {'wall': wall, 'peak_rss': _peak_rss(reset), 'peak_rss_scope': 'operation' if reset else 'process'}
+    sample.update(_delta(usage_before, _rusage()))
+    sample.update(_delta(io_before, _proc_io()))
+    if os.path.exists(spec['archive']):
+        sample['archive_size'] = os.path.getsize(spec['archive'])
+    return sample
+
+
+def _child(spec_path):
+    with open(spec_path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    json.dump(run_sample(spec), sys.stdout)
+    return 0
+
+
+def _archive_names(root):
+    # Member names engine.add gives the files of a corpus folder.
+    base = os.path.dirname(root)
+    names = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            names.append(os.path.relpath(os.path.join(dirpath, name), base).replace(os.sep, '/'))
+    return names
+
+
+def _delete_names(names, path):
+    selection = names[::DELETE_EVERY] or names[:1]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(selection, f)
+    return len(selection)
+
+
+def _environment():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(), 'platform': platform.platform(),
+            'machine': platform.machine(), 'cpus': os.cpu_count(), 'revision': revision}
+
+
+def _summarize(samples, nbytes, members):
+    walls = [sample['wall'] for sample in samples]
+    wall = statistics.median(walls)
+    result = {'wall': wall, 'wall_min': min(walls), 'wall_max': max(walls),
+              'bytes_per_second': nbytes / wall if nbytes and wall > 0 else None,
+              'members_per_second': members / wall if members and wall > 0 else None}
+    peaks = [sample['peak_rss'] for sample in samples if sample.get('peak_rss') is not None]
+    result['peak_rss'] = max(peaks) if peaks else None
+    for key in ('syscr', 'syscw', 'read_bytes', 'write_bytes', 'user_time', 'system_time'):
+        values = [sample[key] for sample in samples if key in sample]
+        result[key] = statistics.median(values) if values else None
+    return result
+
+
+class Runner:
+    def __init__(self, args):
+        self.args = args
+        self.work_dir = os.path.abspath(args.work_dir)
+        self.run_dir = os.path.join(self.work_dir, 'run')
+        self.env = dict(os.environ)
+        # Keep the persisted tar indexes of the run out of the user's cache.
+        cache_dir = os.path.join(self.work_dir, 'cache')
+        self.env['LOCALAPPDATA'] = cache_dir
+        self.env['XDG_CACHE_HOME'] = cache_dir
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, os.environ.get('PYTHONPATH')]))
+        self.results = []
+        self.corpora = {}
+
+    def log(self, message):
+        if not self.args.quiet:
+            print(message, file=sys.stderr, flush=True)
+
+    def sample(self, spec):
+        spec_path = os.path.join(self.run_dir, 'spec.json')
+        with open(spec_path, 'w', encoding='utf-8') as f:
+            json.dump(spec, f)
+        # A fresh interpreter per sample keeps peak RSS and the counters of
+        # one operation apart from the next.
+        process = subprocess.run([sys.executable, '-m', 'benchmarks.run', '--child', spec_path], env=self.env, capture_output=True,
+                                 text=True)
+        if process.returncode:
+            raise RuntimeError(f"{spec['operation']} failed:\n{process.stderr}")
+        return json.loads(process.stdout)
+
+    def measure(self, archive_format, corpus_name, operation, spec, nbytes, members):
+        case = f'{archive_format}/{corpus_name}/{operation}'
+        samples = [self.sample(spec) for _ in range(self.args.repeat)]
+        result = {'case': case, 'format': archive_format, 'corpus': corpus_name, 'operation': operation,
+                  'gui_handler': OPERATIONS[operation], 'bytes': nbytes, 'members': members, 'samples': samples}
+        result.update(_summarize(samples, nbytes, members))
+        self.results.append(result)
+        rate = f", {result['bytes_per_second'] / 1048576:.1f} MB/s" if result['bytes_per_second'] else ''
+        self.log(f'{case}: {result["wall"]:.3f} s{rate}')
+
+    def run_corpus(self, archive_format, corpus_name):
+        operations = [operation for operation in OPERATIONS if operation in self.args.operations
+                      and not (corpus_name == 'entries' and operation in DISK_ONLY)
+                      and not (operation == 'list-cached' and archive_kind('x.' + archive_format) == 'zip')]
+        if not operations:
+            return
+        base_spec = {'method': self.args.method, 'workers': self.args.jobs, 'query': SEARCH_QUERY}
+        if corpus_name == 'entries':
+            manifest = corpus.make_entries_archive(self.work_dir, archive_format, self.args.scale, self.args.seed)
+            archive_name = manifest['path']
+            names = [name for name in corpus.entry_names(corpus.SCALES[self.args.scale]['entries']) if not name.endswith('/')]
+        else:
+            manifest = corpus.make_corpus(self.work_dir, corpus_name, self.args.scale, self.args.seed)
+            archive_name = os.path.join(self.run_dir, f'{corpus_name}.{archive_format}')
+            names = _archive_names(manifest['path'])
+            # Everything after 'add' reads the archive it wrote; without it
+            # in the selection, write one first.
+            if 'add' not in operations:
+                self.sample(dict(base_spec, operation='add', archive=archive_name, source=manifest['path']))
+        self.corpora[corpus_name] = {key: manifest[key] for key in ('files', 'folders', 'bytes', 'params')}
+        members = manifest['files'] + manifest['folders']
+        for operation in operations:
+            spec = dict(base_spec, operation=operation, archive=archive_name)
+            nbytes = manifest['bytes']
+            count = members
+            if operation == 'add':
+                spec['source'] = manifest['path']
+            elif operation == 'extract':
+                spec['destination'] = os.path.join(self.run_dir, 'extracted')
+            elif operation == 'delete':
+                spec['source_archive'] = archive_name
+                spec['archive'] = os.path.join(self.run_dir, 'delete-' + os.path.basename(archive_name))
+                spec['names'] = os.path.join(self.run_dir, 'names.json')
+                count = _delete_names(names, spec['names'])
+                nbytes = os.path.getsize(archive_name)
+            else:
+                nbytes = 0
+            self.measure(archive_format, corpus_name, operation, spec, nbytes, count)
+        shutil.rmtree(os.path.join(self.run_dir, 'extracted'), ignore_errors=True)
+
+    def run(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        os.makedirs(self.run_dir)
+        started = time.time()
+        try:
+            for archive_format in self.args.formats:
+                for corpus_name in self.args.corpora:
+                    self.run_corpus(archive_format, corpus_name)
+        finally:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+        return {'version': RESULTS_VERSION, 'started': started, 'duration': time.time() - started, 'scale': self.args.scale,
+                'seed': self.args.seed, 'repeat': self.args.repeat, 'method': self.args.method, 'workers': self.args.jobs,
+                'environment': _environment(), 'corpora': self.corpora, 'results': self.results}
+
+
+def _list_argument(choices):
+    def parse(value):
+        items = [item.strip() for item in value.split(',') if item.strip()]
+        if not items or choices is not None and any(item not in choices for item in items):
+            raise argparse.ArgumentTypeError(f"choose from {', '.join(choices)}" if choices else 'empty list')
+        return items
+    return parse
+
+
+def _formats(value):
+    formats = _list_argument(None)(value)
+    for archive_format in formats:
+        if archive_kind('x.' + archive_format) is None:
+            raise argparse.ArgumentTypeError(f'unsupported archive format {archive_format!r}')
+    return formats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run',
+                                     description='Time archive operations on generated corpora and write the results as JSON.')
+    parser.add_argument('-o', '--output', help='results file (default: bench-<date>-<time>.json)')
+    parser.add_argument('--scale', default='default', choices=sorted(corpus.SCALES))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help='samples per operation; the median is reported')
+    parser.add_argument('--corpora', type=_list_argument(corpus.CORPORA), default=list(corpus.CORPORA),
+                        help=f"comma-separated subset of {', '.join(corpus.CORPORA)}")
+    parser.add_argument('--formats', type=_formats, default=list(FORMATS),
+                        help='comma-separated archive suffixes, e.g. zip,tar,tar.gz (default: zip,tar)')
+    parser.add_argument('--operations', type=_list_argument(tuple(OPERATIONS)), default=list(OPERATIONS),
+                        help=f"comma-separated subset of {', '.join(OPERATIONS)}")
+    parser.add_argument('-m', '--method', default='deflated', help='ZIP compression method')
+    parser.add_argument('-j', '--jobs', type=int, help='worker threads per operation')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'archiver-bench'),
+                        help='where corpora are generated and kept between runs')
+    parser.add_argument('-q', '--quiet', action='store_true')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        return _child(args.child)
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    output = args.output or time.strftime('bench-%Y%m%d-%H%M%S.json')
+    try:
+        results = Runner(args).run()
+    except (OSError, RuntimeError) as e:
+        print(f'{parser.prog}: {e}', file=sys.stderr)
+        return 1
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,28 @@
+import tarfile
+import zipfile
+
+from archiver.operations import Operation
+
+ARCHIVE_NAMES = ['test.zip', 'test.tar', 'test.tar.gz']
+
+
+def make_op():
+    return Operation('test', None)
+
+
+def write_files(root, contents):
+    for name, data in contents.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+
+def read_archive(archive_name):
+    # Member name to data, read back with the standard library; folders
+    # map to None.
+    if archive_name.endswith('.zip'):
+        with zipfile.ZipFile(archive_name) as archive:
+            assert archive.testzip() is None
+            return {info.filename.rstrip('/'): None if info.is_dir() else archive.read(info) for info in archive.infolist()}
+    with tarfile.open(archive_name) as archive:
+        return {member.name: archive.extractfile(member).read() if member.isreg() else None for member in archive}
@@ -0,0 +1,63 @@
+import io
+import os
+import tarfile
+import threading
+
+import pytest
+
+from archiver.extractor import extract_tar, run_tasks
+from archiver.operations import Operation, OperationCancelled
+
+
+def _fail(op):
+    raise OSError('disk full')
+
+
+def _wait(op, started):
+    started.set()
+    while True:
+        op.check()
+
+
+def test_failed_task_is_not_a_cancellation():
+    op = Operation('test', None)
+    started = threading.Event()
+    with pytest.raises(OSError):
+        run_tasks(op, [(1, _wait, (op, started)), (0, _fail, (op,))], 2)
+    assert started.is_set()
+    assert not op.cancelled
+    op.check()
+
+
+def test_cancel_still_stops_tasks():
+    op = Operation('test', None)
+    op.cancel()
+    with pytest.raises(OperationCancelled):
+        run_tasks(op, [(0, _wait, (op, threading.Event()))], 1)
+
+
+def _link(name, linkname, link_type=tarfile.SYMTYPE):
+    info = tarfile.TarInfo(name)
+    info.type = link_type
+    info.linkname = linkname
+    return info
+
+
+def test_tar_links_stay_inside_destination(tmp_path):
+    archive_name = str(tmp_path / 'links.tar')
+    with tarfile.open(archive_name, 'w') as archive:
+        info = tarfile.TarInfo('sub/file.txt')
+        info.size = 4
+        archive.addfile(info, io.BytesIO(b'data'))
+        archive.addfile(_link('../escape_link', '/etc/passwd'))
+        archive.addfile(_link('sub/up', '../../outside'))
+        archive.addfile(_link('sub/ok', 'file.txt'))
+        archive.addfile(_link('../hard', 'sub/file.txt', tarfile.LNKTYPE))
+    dest = tmp_path / 'out'
+    dest.mkdir()
+    extract_tar(Operation('test', None), archive_name, None, str(dest))
+    assert sorted(os.listdir(tmp_path)) == ['links.tar', 'out']
+    assert not os.path.lexists(dest / 'escape_link')
+    assert not os.path.lexists(dest / 'sub' / 'up')
+    assert os.readlink(dest / 'sub' / 'ok') == 'file.txt'
+    assert (dest / 'hard').read_bytes() == b'data'
@@ -0,0 +1,23 @@
+import re
+
+from archiver.search import NameIndex, regex_literals
+
+PATHS = ['x', 'xx', 'xxxxxxxxxx', 'xxxxxxxxxxy', 'ab', 'abb', 'aab', 'b', 'a/b', 'docs/readme.txt', 'docs/read.me',
+         'src/main.py', 'src/mainly.py', 'src/ma.py', 'docs/A.txt', 'x/café.md', 'a.b', 'a1b', 'color', 'colour', 'colouur',
+         ']abc', 'abc]x', 'zx', 'a{1}']
+PATTERNS = ['x{10}', 'x{2,}', 'x{,3}y', 'a{1,2}b', 'ab{0}', 'ab{2}', 'colou?r', 'colou*r', 'colou+r', 'mai?n', 'main.py',
+            r'read\.me', 'src/ma.*py', '^x+$', '[^]abc]x', '[]a]bc', 'b$', r'a\{1\}', 'a{1', 'x*?y', r'\x41', r'\101',
+            r'caf\u00e9', r'\N{LATIN SMALL LETTER E WITH ACUTE}\.md', r'a\.b', r'a\.?b', r'a\db', r'\w+\.txt', r'\bA\.']
+
+
+def test_regex_literals_skip_repeat_bounds():
+    assert regex_literals('x{10}') == []
+    assert regex_literals('a{1,2}b') == ['b']
+
+
+def test_regex_matches_brute_force():
+    index = NameIndex(PATHS)
+    for pattern in PATTERNS:
+        regex = re.compile(pattern, re.IGNORECASE)
+        expected = [position for position, path in enumerate(PATHS) if regex.search(path)]
+        assert index.regex(pattern) == expected, pattern
@@ -0,0 +1,100 @@
+import pytest
+
+from archiver import jobs
+from archiver.operations import OperationCancelled
+from archiver.session import Session
+from archiver.tarindex import TarIndex
+
+from .helpers import ARCHIVE_NAMES, make_op, read_archive, write_files
+
+CONTENTS = {
+    'docs/readme.txt': b'read me\n' * 100,
+    'docs/guide/intro.txt': b'introduction',
+    'src/main.py': b'print("hello")\n',
+    'data.bin': bytes(range(256)) * 64,
+}
+
+
+@pytest.fixture(params=ARCHIVE_NAMES)
+def archive(tmp_path, request):
+    source = tmp_path / 'source'
+    write_files(source, CONTENTS)
+    archive_name = str(tmp_path / request.param)
+    jobs.create_archive(archive_name)
+    records = [(str(source / name), name, (source / name).stat()) for name in CONTENTS]
+    jobs.add_items(make_op(), archive_name, records)
+    assert read_archive(archive_name) == CONTENTS
+    return archive_name, source
+
+
+def _check_index(archive_name):
+    # A tar index saved by the commit must agree with a fresh scan.
+    if archive_name.endswith('.zip'):
+        return
+    saved = TarIndex.load(archive_name)
+    scanned = TarIndex.scan(archive_name)
+    assert saved.names == scanned.names
+    assert saved.data_offsets == scanned.data_offsets
+
+
+def test_delete(archive):
+    archive_name, source = archive
+    assert jobs.delete_members(make_op(), archive_name, ['docs/', 'data.bin']) > 0
+    assert read_archive(archive_name) == {'src/main.py': CONTENTS['src/main.py']}
+    _check_index(archive_name)
+
+
+def test_delete_in_place(tmp_path):
+    archive_name = str(tmp_path / 'test.zip')
+    write_files(tmp_path / 'source', CONTENTS)
+    jobs.create_archive(archive_name)
+    jobs.add_files(make_op(), archive_name, [str(tmp_path / 'source' / name) for name in CONTENTS], '')
+    jobs.delete_members(make_op(), archive_name, ['readme.txt'], in_place=True)
+    assert read_archive(archive_name) == {name.rpartition('/')[2]: data for name, data in CONTENTS.items() if name != 'docs/readme.txt'}
+
+
+def test_rename_folder(archive):
+    archive_name, source = archive
+    session = Session(archive_name)
+    session.rename('docs', 'manual')
+    session.commit(make_op())
+    expected = {name.replace('docs/', 'manual/'): data for name, data in CONTENTS.items()}
+    assert read_archive(archive_name) == expected
+    _check_index(archive_name)
+
+
+def test_commit_applies_journal_in_one_pass(archive, tmp_path):
+    archive_name, source = archive
+    extra = tmp_path / 'extra.txt'
+    extra.write_bytes(b'extra')
+    session = Session(archive_name)
+    session.delete(['data.bin'])
+    session.add_file(str(extra), 'src/extra.txt')
+    session.rename('src/main.py', 'src/app.py')
+    session.mkdir('empty/')
+    session.add_file(str(source / 'data.bin'), 'docs/readme.txt')
+    added, removed = session.commit(make_op())
+    assert 'data.bin' in removed
+    expected = dict(CONTENTS)
+    del expected['data.bin']
+    expected['src/app.py'] = expected.pop('src/main.py')
+    expected['src/extra.txt'] = b'extra'
+    expected['docs/readme.txt'] = CONTENTS['data.bin']
+    expected['empty'] = None
+    assert read_archive(archive_name) == expected
+    _check_index(archive_name)
+
+
+def test_cancelled_commit_leaves_archive(archive):
+    archive_name, source = archive
+    with open(archive_name, 'rb') as f:
+        before = f.read()
+    session = Session(archive_name)
+    session.delete(['src/'])
+    op = make_op()
+    op.cancel()
+    with pytest.raises(OperationCancelled):
+        session.commit(op)
+    with open(archive_name, 'rb') as f:
+        assert f.read() == before
+    assert read_archive(archive_name) == CONTENTS
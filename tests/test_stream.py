@@ -0,0 +1,82 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import tarfile
+import threading
+import zipfile
+
+import pytest
+
+from archiver.operations import Operation
+from archiver.stream import stream_records, write_stream
+
+# More than one 4 MiB compressed block, so block boundaries are crossed.
+BIG_SIZE = 9 * 1024 * 1024
+
+
+@pytest.fixture(scope='module')
+def source(tmp_path_factory):
+    root = tmp_path_factory.mktemp('stream') / 'src'
+    (root / 'sub' / 'empty').mkdir(parents=True)
+    contents = {
+        'src/small.txt': b'hello archive\n' * 1000,
+        'src/sub/random.bin': os.urandom(300000),
+        'src/sub/big.bin': (os.urandom(1024) + b'\0' * 3072) * (BIG_SIZE // 4096),
+        'src/empty.txt': b'',
+    }
+    for name, data in contents.items():
+        (root.parent / name).write_bytes(data)
+    return str(root), contents
+
+
+def _stream_through_pipe(archive_format, paths, consume):
+    # The writer only ever sees the write end of a pipe, so any seek or
+    # tell on it would fail.
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def produce():
+        try:
+            with open(write_fd, 'wb') as f:
+                write_stream(Operation('stream', None), f, archive_format, stream_records(paths))
+        except BaseException as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=produce)
+    thread.start()
+    try:
+        with open(read_fd, 'rb') as f:
+            result = consume(f)
+    finally:
+        thread.join()
+    assert not errors
+    return result
+
+
+def test_zip_over_pipe(source):
+    path, contents = source
+    data = _stream_through_pipe('zip', [path], lambda f: f.read())
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        files = {info.filename: archive.read(info) for info in archive.infolist() if not info.is_dir()}
+        assert 'src/sub/empty/' in archive.namelist()
+    assert files == contents
+
+
+# Compressed tars are a series of independent streams; tarfile's own 'r|gz'
+# stops after the first one, the codec modules' open() reads them all.
+@pytest.mark.parametrize('archive_format, codec', [('tar', None), ('tar.gz', gzip), ('tar.bz2', bz2), ('tar.xz', lzma)])
+def test_tar_over_pipe(source, archive_format, codec):
+    path, contents = source
+
+    def consume(f):
+        files = {}
+        with tarfile.open(fileobj=codec.open(f) if codec else f, mode='r|') as archive:
+            for member in archive:
+                if member.isreg():
+                    files[member.name] = archive.extractfile(member).read()
+        return files
+
+    assert _stream_through_pipe(archive_format, [path], consume) == contents
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from archiver import jobs
+from archiver.sync import sync_folder
+from archiver.zipwriter import ParallelZipWriter
+
+from .helpers import ARCHIVE_NAMES, make_op, read_archive, write_files
+
+OLD_TIME = 1000000000
+
+
+@pytest.fixture(params=ARCHIVE_NAMES)
+def archive_name(tmp_path, request):
+    archive_name = str(tmp_path / request.param)
+    jobs.create_archive(archive_name)
+    return archive_name
+
+
+@pytest.mark.parametrize('folder', ['x', 'x/'])
+def test_sync_leaves_sibling_with_same_prefix(tmp_path, archive_name, folder):
+    write_files(tmp_path / 'src', {'a.txt': b'a', 'sub/b.txt': b'b'})
+    write_files(tmp_path / 's2', {'c.txt': b'c'})
+    sync_folder(make_op(), archive_name, str(tmp_path / 'src'), 'xylophone')
+    sync_folder(make_op(), archive_name, str(tmp_path / 's2'), folder, delete_missing=True)
+    assert read_archive(archive_name) == {'xylophone/a.txt': b'a', 'xylophone/sub/b.txt': b'b', 'x/c.txt': b'c'}
+
+
+def test_sync_replaces_and_removes(tmp_path, archive_name):
+    source = tmp_path / 'src'
+    write_files(source, {'keep.txt': b'keep', 'change.txt': b'old', 'gone/drop.txt': b'drop'})
+    sync_folder(make_op(), archive_name, str(source), 'x', delete_missing=True)
+    (source / 'change.txt').write_bytes(b'new and longer')
+    os.remove(source / 'gone' / 'drop.txt')
+    write_files(source, {'more/new.txt': b'new'})
+    added, removed = sync_folder(make_op(), archive_name, str(source), 'x', delete_missing=True)
+    assert sorted(name for name, size, mtime, is_dir in added) == ['x/change.txt', 'x/more/new.txt']
+    assert 'x/gone/drop.txt' in removed
+    assert read_archive(archive_name) == {'x/keep.txt': b'keep', 'x/change.txt': b'new and longer', 'x/more/new.txt': b'new'}
+    assert sync_folder(make_op(), archive_name, str(source), 'x', delete_missing=True) == ([], [])
+
+
+def test_failed_sync_keeps_old_versions(tmp_path, archive_name, monkeypatch):
+    source = tmp_path / 'src'
+    write_files(source, {'a.txt': b'first', 'b.txt': b'second'})
+    sync_folder(make_op(), archive_name, str(source), '', delete_missing=True)
+    (source / 'a.txt').write_bytes(b'changed')
+    os.utime(source / 'a.txt', (OLD_TIME, OLD_TIME))
+    os.remove(source / 'b.txt')
+    with open(archive_name, 'rb') as f:
+        before = f.read()
+
+    def fail(*args, **kwargs):
+        raise OSError('read error')
+
+    monkeypatch.setattr(ParallelZipWriter, 'add_file', fail)
+    monkeypatch.setattr(jobs, 'tarinfo_from_stat', fail)
+    with pytest.raises(OSError):
+        sync_folder(make_op(), archive_name, str(source), '', delete_missing=True)
+    with open(archive_name, 'rb') as f:
+        assert f.read() == before
+    assert sorted(os.listdir(tmp_path)) == sorted(['src', os.path.basename(archive_name)])
@@ -0,0 +1,60 @@
+import io
+import os
+import tarfile
+
+from archiver.engine import ArchiveEngine
+from archiver.operations import Operation
+from archiver.tarindex import TarIndex, index_path
+
+
+def _tar_bytes(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = 1700000000
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def _write_tar(path, members):
+    with open(path, 'wb') as f:
+        f.write(_tar_bytes(members))
+
+
+def test_same_size_rewrite_is_rescanned(tmp_path):
+    path = str(tmp_path / 'a.tar')
+    cache_dir = str(tmp_path / 'cache')
+    _write_tar(path, [('one', b'x' * 10), ('two', b'y' * 600)])
+    assert TarIndex.load(path, cache_dir).names == ['one', 'two']
+    st = os.stat(path)
+    # Same size, same mtime and same inode, but other members.
+    data = _tar_bytes([('uno', b'x' * 600), ('dos', b'y' * 10)])
+    assert len(data) == st.st_size
+    with open(path, 'r+b') as fp:
+        fp.write(data)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    tar_index = TarIndex.load(path, cache_dir)
+    assert tar_index.names == ['uno', 'dos']
+    assert tar_index.sizes.tolist() == [600, 10]
+
+
+def test_persistence_can_be_turned_off(tmp_path):
+    path = str(tmp_path / 'a.tar')
+    cache_dir = str(tmp_path / 'cache')
+    _write_tar(path, [('one', b'x')])
+    tar_index = TarIndex.load(path, cache_dir, persist=False)
+    assert tar_index.names == ['one']
+    tar_index.save(index_path(path, cache_dir))
+    assert not os.path.exists(index_path(path, cache_dir))
+    TarIndex.load(path, cache_dir)
+    assert os.path.exists(index_path(path, cache_dir))
+
+
+def test_engine_setting_is_per_engine():
+    uncached = ArchiveEngine(tar_index_cache=False)
+    cached = ArchiveEngine()
+    assert not uncached.instrument(Operation('test', None)).tar_index_cache
+    assert cached.instrument(Operation('test', None)).tar_index_cache
+    assert TarIndex('a.tar').persist
@@ -0,0 +1,46 @@
+import zipfile
+
+import pytest
+
+from archiver.verify import OUTPUT_LIMIT, _inflate, _zip_decompressor, test_archive as check_archive
+from archiver.zipreader import ZipDirectory
+
+from .helpers import make_op
+
+# Compresses to a few kilobytes but inflates to many times OUTPUT_LIMIT.
+BOMB_SIZE = 8 * OUTPUT_LIMIT
+
+
+@pytest.mark.parametrize('method', [zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA])
+def test_output_stays_bounded(tmp_path, method):
+    archive_name = str(tmp_path / 'bomb.zip')
+    with zipfile.ZipFile(archive_name, 'w', method) as archive:
+        archive.writestr('zeros', bytes(BOMB_SIZE))
+    with ZipDirectory(archive_name) as directory:
+        decompressor = _zip_decompressor(method)
+        total = 0
+        with directory.raw_data(0) as raw:
+            # A tiny first chunk also splits the LZMA properties header.
+            for chunk in (raw[:3], raw[3:]):
+                for piece in _inflate(decompressor, chunk):
+                    assert len(piece) <= OUTPUT_LIMIT
+                    assert not any(piece)
+                    total += len(piece)
+        assert decompressor.eof
+    assert total == BOMB_SIZE
+    report = check_archive(make_op(), archive_name)
+    assert report.ok and report.bytes == BOMB_SIZE
+
+
+def test_corrupt_lzma_member_fails(tmp_path):
+    archive_name = str(tmp_path / 'bad.zip')
+    with zipfile.ZipFile(archive_name, 'w', zipfile.ZIP_LZMA) as archive:
+        archive.writestr('good', b'good data' * 1000)
+        archive.writestr('bad', b'some text ' * 1000)
+    with ZipDirectory(archive_name) as directory:
+        offset = directory.data_offset(1) + 20
+    with open(archive_name, 'r+b') as f:
+        f.seek(offset)
+        f.write(b'\xff' * 8)
+    report = check_archive(make_op(), archive_name)
+    assert [name for name, message in report.failures] == ['bad']
@@ -0,0 +1,72 @@
+import os
+import zipfile
+
+import pytest
+
+from archiver.zipwriter import METHODS, ParallelZipWriter
+
+# Past LARGE_FILE, so the member is deflated in parallel chunks.
+LARGE_SIZE = 6 * 1024 * 1024
+
+
+@pytest.fixture(scope='module')
+def files(tmp_path_factory):
+    root = tmp_path_factory.mktemp('zipwriter')
+    contents = {
+        'text.txt': b'line of text\n' * 5000,
+        'random.bin': os.urandom(200000),
+        'large.bin': (os.urandom(2048) + b'a' * 6144) * (LARGE_SIZE // 8192),
+        'empty': b'',
+    }
+    paths = {}
+    for name, data in contents.items():
+        path = root / name
+        path.write_bytes(data)
+        paths[name] = str(path)
+    return paths, contents
+
+
+def _read_back(archive_name):
+    with zipfile.ZipFile(archive_name) as archive:
+        assert archive.testzip() is None
+        return {info.filename: archive.read(info) for info in archive.infolist()}
+
+
+@pytest.mark.parametrize('method', sorted(METHODS))
+def test_written_archive_passes_testzip(tmp_path, files, method):
+    paths, contents = files
+    archive_name = str(tmp_path / 'out.zip')
+    with ParallelZipWriter(archive_name, 'w', method=METHODS[method], workers=4) as writer:
+        for name, path in paths.items():
+            writer.add_file(path, 'files/' + name)
+        writer.add_directory('folder/')
+        writer.add_bytes('bytes.txt', b'from memory')
+    expected = {'files/' + name: data for name, data in contents.items()}
+    expected.update({'folder/': b'', 'bytes.txt': b'from memory'})
+    assert _read_back(archive_name) == expected
+
+
+def test_append_keeps_old_members(tmp_path, files):
+    paths, contents = files
+    archive_name = str(tmp_path / 'out.zip')
+    with zipfile.ZipFile(archive_name, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('old.txt', b'old member')
+    with ParallelZipWriter(archive_name, 'a') as writer:
+        writer.add_file(paths['large.bin'], 'large.bin')
+    assert _read_back(archive_name) == {'old.txt': b'old member', 'large.bin': contents['large.bin']}
+
+
+def test_abort_restores_appended_archive(tmp_path, files):
+    paths, contents = files
+    archive_name = str(tmp_path / 'out.zip')
+    with zipfile.ZipFile(archive_name, 'w') as archive:
+        archive.writestr('old.txt', b'old member')
+    with open(archive_name, 'rb') as f:
+        before = f.read()
+    with pytest.raises(RuntimeError):
+        with ParallelZipWriter(archive_name, 'a') as writer:
+            writer.add_file(paths['random.bin'], 'random.bin')
+            writer.flush()
+            raise RuntimeError('stop')
+    with open(archive_name, 'rb') as f:
+        assert f.read() == before